@@ -17,8 +17,8 @@ from prometheus_fastapi_instrumentator import Instrumentator
 
 from api.auth.db import make_sure_db_and_tables
 from api.auth.users import Props
-from api.dependencies import ModelServiceDep
-from api.utils import add_exception_handlers, add_middlewares
+from api.dependencies import ModelServiceDep, MultiModelServiceDep
+from api.utils import add_exception_handlers, add_middlewares, ModelRoutingMiddleware, StageTimingMiddleware, StageTimedCapacityLimiter
 from domain import Tags, TagsStreamable
 from management.tracker_client import TrackerClient
 from utils import get_settings
@@ -86,6 +86,12 @@ def _get_app(msd_overwritten: Optional[ModelServiceDep] = None, streamable: bool
     if msd_overwritten is not None:
         cms_globals.model_service_dep = msd_overwritten
 
+    if config.ENABLE_STAGE_TIMING == "true":
+        app.add_middleware(StageTimingMiddleware)
+
+    if isinstance(cms_globals.model_service_dep, MultiModelServiceDep):
+        app.add_middleware(ModelRoutingMiddleware, model_types=cms_globals.model_service_dep.model_types)
+
     cms_globals.props = Props(config.AUTH_USER_ENABLED == "true")
 
     app.mount("/static", StaticFiles(directory=os.path.join(os.path.dirname(__file__), "static")), name="static")
@@ -94,7 +100,8 @@ def _get_app(msd_overwritten: Optional[ModelServiceDep] = None, streamable: bool
     async def on_startup() -> None:
         loop = asyncio.get_running_loop()
         loop.set_default_executor(ThreadPoolExecutor(max_workers=50))
-        RunVar("_default_thread_limiter").set(CapacityLimiter(50))  # type: ignore
+        thread_limiter = CapacityLimiter(50)
+        RunVar("_default_thread_limiter").set(StageTimedCapacityLimiter(thread_limiter) if config.ENABLE_STAGE_TIMING == "true" else thread_limiter)
         instrumentator.expose(app, include_in_schema=False, should_gzip=False)
         if config.AUTH_USER_ENABLED == "true":
             await make_sure_db_and_tables()
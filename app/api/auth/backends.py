@@ -1,9 +1,15 @@
+import time
+import jwt
 from functools import lru_cache
-from typing import List
+from typing import List, Optional
+from fastapi_users import BaseUserManager, exceptions, models
 from fastapi_users.authentication.transport.base import Transport
 from fastapi_users.authentication.strategy.base import Strategy
 from fastapi_users.authentication import BearerTransport, JWTStrategy
 from fastapi_users.authentication import AuthenticationBackend
+from fastapi_users.jwt import decode_jwt
+from api.auth.token_cache import get_token_cache
+from management.prometheus_metrics import cms_auth_duration
 from utils import get_settings
 
 
@@ -19,4 +25,33 @@ def _get_transport() -> Transport:
 
 
 def _get_strategy() -> Strategy:
-    return JWTStrategy(secret=get_settings().AUTH_JWT_SECRET, lifetime_seconds=get_settings().AUTH_ACCESS_TOKEN_EXPIRE_SECONDS)
+    return _CachedJWTStrategy(secret=get_settings().AUTH_JWT_SECRET, lifetime_seconds=get_settings().AUTH_ACCESS_TOKEN_EXPIRE_SECONDS)
+
+
+class _CachedJWTStrategy(JWTStrategy):
+
+    async def read_token(self, token: Optional[str], user_manager: BaseUserManager[models.UP, models.ID]) -> Optional[models.UP]:
+        if token is None:
+            return None
+
+        start = time.perf_counter()
+        token_cache = get_token_cache()
+        cached_token = token_cache.get(token)
+        if cached_token is not None and cached_token.user is not None:
+            cms_auth_duration.labels(cache="hit").observe(time.perf_counter() - start)
+            return cached_token.user
+
+        try:
+            data = decode_jwt(token, self.decode_key, self.token_audience, algorithms=[self.algorithm])
+            user_id = data.get("sub")
+            if user_id is None:
+                return None
+            parsed_id = user_manager.parse_id(user_id)
+            user = await user_manager.get(parsed_id)
+        except (jwt.PyJWTError, exceptions.UserNotExists, exceptions.InvalidID):
+            return None
+        finally:
+            cms_auth_duration.labels(cache="miss").observe(time.perf_counter() - start)
+
+        token_cache.put(token, user_id, data.get("exp"), user)
+        return user
@@ -0,0 +1,78 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Optional, final
+from utils import get_settings
+
+
+@final
+class CachedToken(object):
+
+    def __init__(self, user_id: str, expires_at: float, user: Any = None) -> None:
+        self.user_id = user_id
+        self.limiter_key = hashlib.sha256(user_id.encode()).hexdigest()
+        self.expires_at = expires_at
+        self.user = user
+
+
+@final
+class TokenCache(object):
+
+    def __init__(self, ttl_seconds: float, max_size: int = 10000) -> None:
+        self._ttl = ttl_seconds
+        self._max_size = max(max_size, 1)
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self._ttl > 0
+
+    def get(self, token: str) -> Optional[CachedToken]:
+        if not self.enabled:
+            return None
+        key = self._get_key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, token: str, user_id: str, exp: Optional[float], user: Any = None) -> CachedToken:
+        expires_at = time.time() + self._ttl
+        if exp is not None:
+            expires_at = min(expires_at, float(exp))
+        entry = CachedToken(user_id, expires_at, user)
+        if self.enabled:
+            key = self._get_key(token)
+            with self._lock:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self._max_size:
+                    self._entries.popitem(last=False)
+        return entry
+
+    def invalidate_user(self, user_id: str) -> None:
+        with self._lock:
+            stale_keys = [key for key, entry in self._entries.items() if entry.user_id == user_id]
+            for key in stale_keys:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    @staticmethod
+    def _get_key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+
+@lru_cache()
+def get_token_cache() -> TokenCache:
+    return TokenCache(get_settings().AUTH_TOKEN_CACHE_TTL_SECONDS)
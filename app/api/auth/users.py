@@ -1,12 +1,13 @@
 import uuid
 import logging
-from typing import Optional, AsyncGenerator, List, Callable
+from typing import Any, Dict, Optional, AsyncGenerator, List, Callable
 from fastapi import Depends, Request
 from fastapi_users import BaseUserManager, FastAPIUsers, UUIDIDMixin
 from fastapi_users.db import SQLAlchemyUserDatabase
 from fastapi_users.authentication import AuthenticationBackend
 from api.auth.db import User, get_user_db
 from api.auth.backends import get_backends
+from api.auth.token_cache import get_token_cache
 from utils import get_settings
 
 logger = logging.getLogger("cms")
@@ -25,6 +26,12 @@ class _UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]):
     async def on_after_request_verify(self, user: User, token: str, request: Optional[Request] = None) -> None:
         logger.info(f"Verification requested for user {user.id}. Verification token: {token}")
 
+    async def on_after_update(self, user: User, update_dict: Dict[str, Any], request: Optional[Request] = None) -> None:
+        get_token_cache().invalidate_user(str(user.id))
+
+    async def on_after_delete(self, user: User, request: Optional[Request] = None) -> None:
+        get_token_cache().invalidate_user(str(user.id))
+
 
 class Props(object):
 
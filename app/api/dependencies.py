@@ -1,10 +1,15 @@
 import logging
 
-from typing import Optional
+from functools import partial
+from typing import List, Optional
+from fastapi import HTTPException, Request
+from starlette.status import HTTP_404_NOT_FOUND
 from config import Settings
 from registry import model_service_registry
 from model_services.base import AbstractModelService
 from management.model_manager import ModelManager
+from management.model_host import ModelHost
+from management.model_replica_pool import ModelReplicaPool
 
 logger = logging.getLogger("cms")
 
@@ -19,6 +24,10 @@ class ModelServiceDep(object):
     def model_service(self, model_service: AbstractModelService) -> None:
         self._model_sevice = model_service
 
+    @property
+    def model_type(self) -> str:
+        return self._model_type
+
     def __init__(self, model_type: str, config: Settings, model_name: Optional[str] = None) -> None:
         self._model_type = model_type
         self._config = config
@@ -37,11 +46,46 @@ class ModelServiceDep(object):
             return self._model_sevice
 
 
+class MultiModelServiceDep(ModelServiceDep):
+
+    def __init__(self, model_host: ModelHost, model_type: str, config: Settings, model_name: Optional[str] = None) -> None:
+        super().__init__(model_type, config, model_name)
+        self._model_host = model_host
+
+    @property
+    def model_service(self) -> AbstractModelService:
+        return self._model_host.get_model_service(self._model_type)
+
+    @model_service.setter
+    def model_service(self, model_service: AbstractModelService) -> None:
+        raise NotImplementedError("Hosted model services are loaded by the model host")
+
+    @property
+    def model_types(self) -> List[str]:
+        return self._model_host.model_types
+
+    def __call__(self, request: Request = None) -> AbstractModelService:  # type: ignore
+        model_type = request.scope.get("cms_model_type") if request is not None else None
+        model_type = model_type or self._model_type
+        if model_type not in self._model_host.model_types:
+            raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail=f"The model type {model_type} is not hosted")
+        leases = request.scope.get("cms_model_leases") if request is not None else None
+        if leases is None:
+            return self._model_host.get_model_service(model_type)
+        model_service = self._model_host.get_model_service(model_type, lease=True)
+        leases.append(partial(self._model_host.release, model_service))
+        return model_service
+
+
 class ModelManagerDep(object):
 
-    def __init__(self, model_service: AbstractModelService) -> None:
-        self._model_manager = ModelManager(model_service.__class__, model_service.service_config)
-        self._model_manager.model_service = model_service
+    def __init__(self, model_service_dep: ModelServiceDep) -> None:
+        self._model_service_dep = model_service_dep
 
     def __call__(self) -> ModelManager:
-        return self._model_manager
+        model_service = self._model_service_dep.model_service
+        if isinstance(model_service, ModelReplicaPool):
+            model_service = model_service.model_service
+        model_manager = ModelManager(model_service.__class__, model_service.service_config)
+        model_manager.model_service = model_service
+        return model_manager
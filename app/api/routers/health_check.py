@@ -1,7 +1,7 @@
 import api.globals as cms_globals
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter
 from fastapi.responses import PlainTextResponse
-from model_services.base import AbstractModelService
+from management.warm_up import get_readiness
 
 router = APIRouter()
 
@@ -16,5 +16,8 @@ async def is_healthy() -> PlainTextResponse:
 @router.get("/readyz",
             description="Readiness check endpoint",
             include_in_schema=False)
-async def is_ready(model_service: AbstractModelService = Depends(cms_globals.model_service_dep)) -> PlainTextResponse:
-    return PlainTextResponse(content=model_service.info().model_type, status_code=200)
+async def is_ready() -> PlainTextResponse:
+    if not get_readiness().ready:
+        return PlainTextResponse(content="Warming up", status_code=503)
+    # the model type is taken from the dependency so that the probe never touches the model
+    return PlainTextResponse(content=cms_globals.model_service_dep.model_type, status_code=200)
@@ -1,33 +1,28 @@
-import statistics
 import tempfile
 import itertools
 import json
 import ijson
 import uuid
 import hashlib
-import pandas as pd
 import api.globals as cms_globals
 
-from typing import Dict, List, Union, Iterator, Any
-from collections import defaultdict
-from io import BytesIO
+from functools import partial
+from typing import Dict, List, Union, Iterator, Iterable, Any, IO, Optional, AsyncIterator, Callable, Tuple
 from starlette.status import HTTP_400_BAD_REQUEST
 from typing_extensions import Annotated
 from fastapi import APIRouter, Depends, Body, UploadFile, File, Request, Query, Response
+from fastapi.encoders import jsonable_encoder
 from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
 from pydantic import ValidationError
-from domain import TextWithAnnotations, TextWithPublicKey, TextStreamItem, ModelCard, Tags
+from domain import TextWithAnnotations, TextWithPublicKey, TextsWithPublicKey, TextStreamItem, ModelCard, Tags
 from model_services.base import AbstractModelService
 from utils import get_settings
-from api.utils import get_rate_limiter, encrypt
-from management.prometheus_metrics import (
-    cms_doc_annotations,
-    cms_avg_anno_acc_per_doc,
-    cms_avg_anno_acc_per_concept,
-    cms_avg_meta_anno_conf_per_doc,
-    cms_bulk_processed_docs,
-)
-from processors.data_batcher import mini_batch
+from api.utils import get_rate_limiter, encrypt, EnvelopeEncryptor, LocalStreamingResponse, annotate, batch_annotate, annotate_docs, parse_json_line, get_docs
+from management.prometheus_metrics import cms_doc_annotations, cms_bulk_processed_docs
+from management.metrics_aggregator import get_metrics_aggregator
+from management.model_manager import ModelManager
+from management.stage_timings import STAGE_SERIALISATION, STAGE_VALIDATION, timed_stage
+from processors.data_batcher import mini_batch, get_lines_from_byte_stream, process_in_batches
 
 PATH_INFO = "/info"
 PATH_PROCESS = "/process"
@@ -35,7 +30,12 @@ PATH_PROCESS_JSON_LINES = "/process_jsonl"
 PATH_PROCESS_BULK = "/process_bulk"
 PATH_PROCESS_BULK_FILE = "/process_bulk_file"
 PATH_REDACT = "/redact"
+PATH_REDACT_BULK = "/redact_bulk"
+PATH_REDACT_JSON_LINES = "/redact_jsonl"
 PATH_REDACT_WITH_ENCRYPTION = "/redact_with_encryption"
+PATH_REDACT_BULK_WITH_ENCRYPTION = "/redact_bulk_with_encryption"
+READ_CHUNK_SIZE = 1024 * 1024
+NO_REDACTION_WARNING = "WARNING: No entities were detected for redaction."
 
 router = APIRouter()
 config = get_settings()
@@ -62,37 +62,38 @@ async def get_model_card(request: Request,
 @limiter.limit(config.PROCESS_RATE_LIMIT)
 def get_entities_from_text(request: Request,
                            text: Annotated[str, Body(description="The plain text to be sent to the model for NER", media_type="text/plain")],
-                           model_service: AbstractModelService = Depends(cms_globals.model_service_dep)) -> TextWithAnnotations:
-    annotations = model_service.annotate(text)
+                           model_service: AbstractModelService = Depends(cms_globals.model_service_dep)) -> Response:
+    annotations = annotate(model_service, text, config)
     _send_annotation_num_metric(len(annotations), PATH_PROCESS)
 
-    _send_accuracy_metric(annotations, PATH_PROCESS)
-    _send_meta_confidence_metric(annotations, PATH_PROCESS)
+    _send_quality_metrics(annotations, PATH_PROCESS)
 
-    return TextWithAnnotations(text=text, annotations=annotations)
+    with timed_stage(STAGE_VALIDATION):
+        body = TextWithAnnotations(text=text, annotations=annotations)
+    with timed_stage(STAGE_SERIALISATION):
+        return JSONResponse(content=jsonable_encoder(body, exclude_none=True))
 
 
 @router.post(PATH_PROCESS_JSON_LINES,
              response_class=StreamingResponse,
              tags=[Tags.Annotations.name],
              dependencies=[Depends(cms_globals.props.current_active_user)],
-             description="Extract the NER entities from texts in the JSON Lines format")
+             description="Extract the NER entities from texts in the JSON Lines format",
+             openapi_extra={
+                 "requestBody": {
+                     "description": "The texts in the jsonlines format and each line contains {\"text\": \"<TEXT>\"[, \"name\": \"<NAME>\"]}",
+                     "required": True,
+                     "content": {"application/x-ndjson": {"schema": {"type": "string"}}},
+                 },
+             })
 @limiter.limit(config.PROCESS_RATE_LIMIT)
-def get_entities_from_jsonlines_text(request: Request,
-                                     json_lines: Annotated[str, Body(description="The texts in the jsonlines format and each line contains {\"text\": \"<TEXT>\"[, \"name\": \"<NAME>\"]}", media_type="application/x-ndjson")]) -> Response:
-    model_manager = cms_globals.model_manager_dep()
-    stream: Iterator[Dict[str, Any]] = itertools.chain()
-
-    try:
-        for chunked_input in _chunk_request_body(json_lines):
-            predicted_stream = model_manager.predict_stream(context=None, model_input=chunked_input)
-            stream = itertools.chain(stream, predicted_stream)
-
-        return StreamingResponse(_get_jsonlines_stream(stream), media_type="application/x-ndjson; charset=utf-8")
-    except json.JSONDecodeError:
-        return JSONResponse(status_code=HTTP_400_BAD_REQUEST, content={"message": "Invalid JSON Lines."})
-    except ValidationError:
-        return JSONResponse(status_code=HTTP_400_BAD_REQUEST, content={"message": f"Invalid JSON properties found. The schema should be {TextStreamItem.schema_json()}"})
+async def get_entities_from_jsonlines_text(request: Request,
+                                           model_service: AbstractModelService = Depends(cms_globals.model_service_dep)) -> Response:
+    lines = get_lines_from_byte_stream(request.stream())
+    first_doc = await _get_first_doc(lines)
+    if isinstance(first_doc, Response):
+        return first_doc
+    return LocalStreamingResponse(_get_jsonlines_stream(model_service, first_doc, lines), media_type="application/x-ndjson; charset=utf-8")
 
 
 @router.post(PATH_PROCESS_BULK,
@@ -104,20 +105,20 @@ def get_entities_from_jsonlines_text(request: Request,
 @limiter.limit(config.PROCESS_BULK_RATE_LIMIT)
 def get_entities_from_multiple_texts(request: Request,
                                      texts: Annotated[List[str], Body(description="A list of plain texts to be sent to the model for NER, in the format of [\"text_1\", \"text_2\", ..., \"text_n\"]")],
-                                     model_service: AbstractModelService = Depends(cms_globals.model_service_dep)) -> List[TextWithAnnotations]:
-    annotations_list = model_service.batch_annotate(texts)
-    body: List[TextWithAnnotations] = []
+                                     model_service: AbstractModelService = Depends(cms_globals.model_service_dep)) -> Response:
+    annotations_list = batch_annotate(model_service, texts, config)
     annotation_sum = 0
-    for text, annotations in zip(texts, annotations_list):
-        body.append(TextWithAnnotations(text=text, annotations=annotations))
+    for annotations in annotations_list:
         annotation_sum += len(annotations)
-        _send_accuracy_metric(annotations, PATH_PROCESS_BULK)
-        _send_meta_confidence_metric(annotations, PATH_PROCESS_BULK)
+        _send_quality_metrics(annotations, PATH_PROCESS_BULK)
 
-    _send_bulk_processed_docs_metric(body, PATH_PROCESS_BULK)
+    _send_bulk_processed_docs_metric(len(annotations_list), PATH_PROCESS_BULK)
     _send_annotation_num_metric(annotation_sum, PATH_PROCESS_BULK)
 
-    return body
+    with timed_stage(STAGE_VALIDATION):
+        body = [TextWithAnnotations(text=text, annotations=annotations) for text, annotations in zip(texts, annotations_list)]
+    with timed_stage(STAGE_SERIALISATION):
+        return JSONResponse(content=jsonable_encoder(body, exclude_none=True))
 
 
 @router.post(PATH_PROCESS_BULK_FILE,
@@ -128,34 +129,22 @@ def get_entities_from_multiple_texts(request: Request,
 def extract_entities_from_multi_text_file(request: Request,
                                           multi_text_file: Annotated[UploadFile, File(description="A file containing a list of plain texts, in the format of [\"text_1\", \"text_2\", ..., \"text_n\"]")],
                                           model_service: AbstractModelService = Depends(cms_globals.model_service_dep)) -> StreamingResponse:
-    with tempfile.NamedTemporaryFile() as data_file:
-        for line in multi_text_file.file:
-            data_file.write(line)
+    data_file = tempfile.NamedTemporaryFile()
+    try:
+        for chunk in iter(lambda: multi_text_file.file.read(READ_CHUNK_SIZE), b""):
+            data_file.write(chunk)
         data_file.flush()
-
-        data_file.seek(0)
-        texts = ijson.items(data_file, "item")
-        annotations_list = []
-        for batch in mini_batch(texts, batch_size=5):
-            annotations_list += model_service.batch_annotate(batch)
-
-        body = []
-        annotation_sum = 0
         data_file.seek(0)
-        texts = ijson.items(data_file, "item")
-        for text, annotations in zip(texts, annotations_list):
-            body.append({"text": text, "annotations": annotations})
-            annotation_sum += len(annotations)
-            _send_accuracy_metric(annotations, PATH_PROCESS_BULK)
-            _send_meta_confidence_metric(annotations, PATH_PROCESS_BULK)
-
-        _send_bulk_processed_docs_metric(body, PATH_PROCESS_BULK)
-        _send_annotation_num_metric(annotation_sum, PATH_PROCESS_BULK)
+        batches = mini_batch(ijson.items(data_file, "item"), batch_size=5)
+        first_batch = list(next(batches, []))
+    except Exception:
+        data_file.close()
+        raise
 
-        json_file = BytesIO(json.dumps(body).encode())
-        response = StreamingResponse(json_file, media_type="application/json")
-        response.headers["Content-Disposition"] = f'attachment ; filename="concatenated_{str(uuid.uuid4())}.json"'
-        return response
+    response = StreamingResponse(_get_annotated_texts_stream(data_file, model_service, itertools.chain([first_batch], batches)),
+                                 media_type="application/json")
+    response.headers["Content-Disposition"] = f'attachment ; filename="concatenated_{str(uuid.uuid4())}.json"'
+    return response
 
 
 @router.post(PATH_REDACT,
@@ -169,28 +158,57 @@ def get_redacted_text(request: Request,
                       mask: Annotated[Union[str, None], Query(description="The custom symbols used for masking detected spans")] = None,
                       hash: Annotated[Union[bool, None], Query(description="Whether or not to hash detected spans")] = False,
                       model_service: AbstractModelService = Depends(cms_globals.model_service_dep)) -> PlainTextResponse:
-    annotations = model_service.annotate(text)
+    annotations = annotate(model_service, text, config)
     _send_annotation_num_metric(len(annotations), PATH_REDACT)
 
-    _send_accuracy_metric(annotations, PATH_REDACT)
-    _send_meta_confidence_metric(annotations, PATH_REDACT)
+    _send_quality_metrics(annotations, PATH_REDACT)
 
-    redacted_text = ""
-    start_index = 0
     if not annotations and warn_on_no_redaction:
-        return PlainTextResponse(content="WARNING: No entities were detected for redaction.", status_code=200)
+        return PlainTextResponse(content=NO_REDACTION_WARNING, status_code=200)
     else:
-        for annotation in annotations:
-            if hash:
-                label = hashlib.sha256(text[annotation["start"]:annotation["end"]].encode()).hexdigest()
-            elif mask is None or len(mask) == 0:
-                label = f"[{annotation['label_name']}]"
-            else:
-                label = mask
-            redacted_text += text[start_index:annotation["start"]] + label
-            start_index = annotation["end"]
-        redacted_text += text[start_index:]
-        return PlainTextResponse(content=redacted_text, status_code=200)
+        return PlainTextResponse(content=_get_redacted_text(text, annotations, mask, hash), status_code=200)
+
+
+@router.post(PATH_REDACT_BULK,
+             response_model=List[str],
+             tags=[Tags.Redaction.name],
+             dependencies=[Depends(cms_globals.props.current_active_user)],
+             description="Extract and redact NER entities from multiple plain texts")
+@limiter.limit(config.PROCESS_BULK_RATE_LIMIT)
+async def get_redacted_texts(request: Request,
+                             texts: Annotated[List[str], Body(description="A list of plain texts to be sent to the model for NER and redaction, in the format of [\"text_1\", \"text_2\", ..., \"text_n\"]")],
+                             warn_on_no_redaction: Annotated[Union[bool, None], Query(description="Return warning for each text in which no entities were detected for redaction to prevent potential info leaking")] = False,
+                             mask: Annotated[Union[str, None], Query(description="The custom symbols used for masking detected spans")] = None,
+                             hash: Annotated[Union[bool, None], Query(description="Whether or not to hash detected spans")] = False,
+                             model_service: AbstractModelService = Depends(cms_globals.model_service_dep)) -> Response:
+    return LocalStreamingResponse(_get_redacted_texts_stream(model_service, texts, warn_on_no_redaction, mask, hash),
+                                  media_type="application/json")
+
+
+@router.post(PATH_REDACT_JSON_LINES,
+             response_class=StreamingResponse,
+             tags=[Tags.Redaction.name],
+             dependencies=[Depends(cms_globals.props.current_active_user)],
+             description="Extract and redact NER entities from texts in the JSON Lines format",
+             openapi_extra={
+                 "requestBody": {
+                     "description": "The texts in the jsonlines format and each line contains {\"text\": \"<TEXT>\"[, \"name\": \"<NAME>\"]}",
+                     "required": True,
+                     "content": {"application/x-ndjson": {"schema": {"type": "string"}}},
+                 },
+             })
+@limiter.limit(config.PROCESS_BULK_RATE_LIMIT)
+async def get_redacted_jsonlines_texts(request: Request,
+                                       warn_on_no_redaction: Annotated[Union[bool, None], Query(description="Return warning for each text in which no entities were detected for redaction to prevent potential info leaking")] = False,
+                                       mask: Annotated[Union[str, None], Query(description="The custom symbols used for masking detected spans")] = None,
+                                       hash: Annotated[Union[bool, None], Query(description="Whether or not to hash detected spans")] = False,
+                                       model_service: AbstractModelService = Depends(cms_globals.model_service_dep)) -> Response:
+    lines = get_lines_from_byte_stream(request.stream())
+    first_doc = await _get_first_doc(lines)
+    if isinstance(first_doc, Response):
+        return first_doc
+    return LocalStreamingResponse(_get_redacted_jsonlines_stream(model_service, first_doc, lines, warn_on_no_redaction, mask, hash),
+                                  media_type="application/x-ndjson; charset=utf-8")
 
 
 @router.post(PATH_REDACT_WITH_ENCRYPTION,
@@ -201,87 +219,221 @@ def get_redacted_text(request: Request,
 def get_redacted_text_with_encryption(request: Request,
                                       text_with_public_key: Annotated[TextWithPublicKey, Body()],
                                       warn_on_no_redaction: Annotated[Union[bool, None], Query(description="Return warning when no entities were detected for redaction to prevent potential info leaking")] = False,
+                                      envelope: Annotated[Union[bool, None], Query(description="Whether or not to encrypt detected spans with AES-GCM under a data key wrapped by the public key")] = False,
                                       model_service: AbstractModelService = Depends(cms_globals.model_service_dep)) -> JSONResponse:
-    annotations = model_service.annotate(text_with_public_key.text)
+    annotations = annotate(model_service, text_with_public_key.text, config)
     _send_annotation_num_metric(len(annotations), PATH_REDACT_WITH_ENCRYPTION)
 
-    _send_accuracy_metric(annotations, PATH_REDACT_WITH_ENCRYPTION)
-    _send_meta_confidence_metric(annotations, PATH_REDACT_WITH_ENCRYPTION)
+    _send_quality_metrics(annotations, PATH_REDACT_WITH_ENCRYPTION)
 
-    redacted_text = ""
-    start_index = 0
-    encryptions = []
     if not annotations and warn_on_no_redaction:
-        return JSONResponse(content={"message": "WARNING: No entities were detected for redaction."})
+        return JSONResponse(content={"message": NO_REDACTION_WARNING})
+    elif envelope:
+        encryptor = EnvelopeEncryptor(text_with_public_key.public_key_pem)
+        redacted_text, encryptions = _get_redacted_text_with_encryptions(text_with_public_key.text, annotations, encryptor.encrypt)
+        return JSONResponse(content={"redacted_text": redacted_text, "encryptions": encryptions, "encrypted_data_key": encryptor.encrypted_data_key})
     else:
-        for idx, annotation in enumerate(annotations):
-            label = f"[REDACTED_{idx}]"
-            encrypted = encrypt(text_with_public_key.text[annotation["start"]:annotation["end"]], text_with_public_key.public_key_pem)
-            redacted_text += text_with_public_key.text[start_index:annotation["start"]] + label
-            encryptions.append({"label": label, "encryption": encrypted})
-            start_index = annotation["end"]
-        redacted_text += text_with_public_key.text[start_index:]
-
+        redacted_text, encryptions = _get_redacted_text_with_encryptions(text_with_public_key.text,
+                                                                         annotations,
+                                                                         partial(encrypt, public_key_pem=text_with_public_key.public_key_pem))
         return JSONResponse(content={"redacted_text": redacted_text, "encryptions": encryptions})
 
 
+@router.post(PATH_REDACT_BULK_WITH_ENCRYPTION,
+             tags=[Tags.Redaction.name],
+             dependencies=[Depends(cms_globals.props.current_active_user)],
+             description="Redact and encrypt NER entities from multiple plain texts under one public key")
+@limiter.limit(config.PROCESS_BULK_RATE_LIMIT)
+def get_redacted_texts_with_encryption(request: Request,
+                                       texts_with_public_key: Annotated[TextsWithPublicKey, Body()],
+                                       warn_on_no_redaction: Annotated[Union[bool, None], Query(description="Return warning for each text in which no entities were detected for redaction to prevent potential info leaking")] = False,
+                                       envelope: Annotated[Union[bool, None], Query(description="Whether or not to encrypt detected spans with AES-GCM under a data key wrapped by the public key")] = False,
+                                       model_service: AbstractModelService = Depends(cms_globals.model_service_dep)) -> JSONResponse:
+    annotations_list = batch_annotate(model_service, texts_with_public_key.texts, config)
+    if envelope:
+        encryptor = EnvelopeEncryptor(texts_with_public_key.public_key_pem)
+        encrypt_span = encryptor.encrypt
+    else:
+        encrypt_span = partial(encrypt, public_key_pem=texts_with_public_key.public_key_pem)
+
+    results: List[Dict[str, Any]] = []
+    annotation_sum = 0
+    for text, annotations in zip(texts_with_public_key.texts, annotations_list):
+        annotation_sum += len(annotations)
+        _send_quality_metrics(annotations, PATH_REDACT_BULK_WITH_ENCRYPTION)
+        if not annotations and warn_on_no_redaction:
+            results.append({"message": NO_REDACTION_WARNING})
+        else:
+            redacted_text, encryptions = _get_redacted_text_with_encryptions(text, annotations, encrypt_span)
+            results.append({"redacted_text": redacted_text, "encryptions": encryptions})
+
+    _send_bulk_processed_docs_metric(len(results), PATH_REDACT_BULK_WITH_ENCRYPTION)
+    _send_annotation_num_metric(annotation_sum, PATH_REDACT_BULK_WITH_ENCRYPTION)
+
+    if envelope:
+        return JSONResponse(content={"results": results, "encrypted_data_key": encryptor.encrypted_data_key})
+    return JSONResponse(content={"results": results})
+
+
 def _send_annotation_num_metric(annotation_num: int, handler: str) -> None:
     cms_doc_annotations.labels(handler=handler).observe(annotation_num)
 
 
-def _send_accuracy_metric(annotations: List[Dict], handler: str) -> None:
-    if annotations and annotations[0].get("accuracy", None) is not None:
-        doc_avg_acc = statistics.mean([annotation["accuracy"] for annotation in annotations])
-        cms_avg_anno_acc_per_doc.labels(handler=handler).set(doc_avg_acc)
-
-        if config.LOG_PER_CONCEPT_ACCURACIES == "true":
-            accumulated_concept_accuracy: Dict[str, float] = defaultdict(float)
-            concept_count: Dict[str, int] = defaultdict(int)
-            for annotation in annotations:
-                accumulated_concept_accuracy[annotation["label_id"]] += annotation["accuracy"]
-                concept_count[annotation["label_id"]] += 1
-            for concept, accumulated_accuracy in accumulated_concept_accuracy.items():
-                concept_avg_acc = accumulated_accuracy / concept_count[concept]
-                cms_avg_anno_acc_per_concept.labels(handler=handler, concept=concept).set(concept_avg_acc)
-
-
-def _send_meta_confidence_metric(annotations: List[Dict], handler: str) -> None:
-    if annotations and annotations[0].get("meta_anns", None):
-        avg_conf = statistics.mean([meta_value["confidence"] for annotation in annotations for _, meta_value in annotation["meta_anns"].items()])
-        cms_avg_meta_anno_conf_per_doc.labels(handler=handler).set(avg_conf)
-
-
-def _send_bulk_processed_docs_metric(processed_docs: List[Dict], handler: str) -> None:
-    cms_bulk_processed_docs.labels(handler=handler).observe(len(processed_docs))
-
-
-def _chunk_request_body(json_lines: str, chunk_size: int = 5) -> Iterator[pd.DataFrame]:
-    chunk = []
-    doc_idx = 0
-    for line in json_lines.splitlines():
-        json_line_obj = json.loads(line)
-        TextStreamItem(**json_line_obj)
-        if "name" not in json_line_obj:
-            json_line_obj["name"] = str(doc_idx)
-        doc_idx += 1
-        chunk.append(json_line_obj)
-
-        if len(chunk) == chunk_size:
-            df = pd.DataFrame(chunk)
-            yield df
-            chunk.clear()
-    if chunk:
-        df = pd.DataFrame(chunk)
-        yield df
-        chunk.clear()
-
-
-def _get_jsonlines_stream(output_stream: Iterator[Dict[str, Any]]) -> Iterator[str]:
-    current_doc_name = ""
-    annotation_num = 0
-    for item in output_stream:
-        if current_doc_name != "" and current_doc_name != item["doc_name"]:
-            cms_doc_annotations.labels(handler=PATH_PROCESS_JSON_LINES).observe(annotation_num)
-        current_doc_name = item["doc_name"]
-        annotation_num += 1
-        yield json.dumps(item) + "\n"
+def _send_quality_metrics(annotations: List[Dict], handler: str) -> None:
+    get_metrics_aggregator().record(handler, annotations)
+
+
+def _send_bulk_processed_docs_metric(processed_doc_num: int, handler: str) -> None:
+    cms_bulk_processed_docs.labels(handler=handler).observe(processed_doc_num)
+
+
+def _get_annotated_texts_stream(data_file: IO,
+                                model_service: AbstractModelService,
+                                batches: Iterable[List[str]]) -> Iterator[str]:
+    doc_num = 0
+    annotation_sum = 0
+    try:
+        yield "["
+        for batch in batches:
+            if not batch:
+                continue
+            annotations_list = batch_annotate(model_service, batch, config)
+            for text, annotations in zip(batch, annotations_list):
+                yield ("," if doc_num else "") + json.dumps({"text": text, "annotations": annotations})
+                doc_num += 1
+                annotation_sum += len(annotations)
+                _send_quality_metrics(annotations, PATH_PROCESS_BULK)
+        yield "]"
+
+        _send_bulk_processed_docs_metric(doc_num, PATH_PROCESS_BULK)
+        _send_annotation_num_metric(annotation_sum, PATH_PROCESS_BULK)
+    finally:
+        data_file.close()
+
+
+def _get_redacted_text(text: str, annotations: List[Dict], mask: Optional[str] = None, hash: Optional[bool] = False) -> str:
+    spans = []
+    start_index = 0
+    for annotation in annotations:
+        if hash:
+            label = hashlib.sha256(text[annotation["start"]:annotation["end"]].encode()).hexdigest()
+        elif mask is None or len(mask) == 0:
+            label = f"[{annotation['label_name']}]"
+        else:
+            label = mask
+        spans.append(text[start_index:annotation["start"]])
+        spans.append(label)
+        start_index = annotation["end"]
+    spans.append(text[start_index:])
+    return "".join(spans)
+
+
+def _get_redacted_text_with_encryptions(text: str,
+                                        annotations: List[Dict],
+                                        encrypt_span: Callable[[str], str]) -> Tuple[str, List[Dict[str, str]]]:
+    spans = []
+    encryptions = []
+    start_index = 0
+    for idx, annotation in enumerate(annotations):
+        label = f"[REDACTED_{idx}]"
+        spans.append(text[start_index:annotation["start"]])
+        spans.append(label)
+        encryptions.append({"label": label, "encryption": encrypt_span(text[annotation["start"]:annotation["end"]])})
+        start_index = annotation["end"]
+    spans.append(text[start_index:])
+    return "".join(spans), encryptions
+
+
+async def _get_first_doc(lines: AsyncIterator[bytes]) -> Union[Dict[str, Any], Response]:
+    async for line in lines:
+        if not line.strip():
+            continue
+        try:
+            return parse_json_line(line, 0)
+        except json.JSONDecodeError:
+            return JSONResponse(status_code=HTTP_400_BAD_REQUEST, content={"message": "Invalid JSON Lines."})
+        except (ValidationError, TypeError):
+            return JSONResponse(status_code=HTTP_400_BAD_REQUEST, content={"message": f"Invalid JSON properties found. The schema should be {TextStreamItem.schema_json()}"})
+    return Response(content="", media_type="application/x-ndjson; charset=utf-8")
+
+
+async def _get_jsonlines_stream(model_service: AbstractModelService,
+                                first_doc: Dict[str, Any],
+                                lines: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    output_names = set(ModelManager.output_schema.input_names())
+    async for doc, annotations in process_in_batches(get_docs(lines, first_doc),
+                                                     partial(annotate_docs, model_service, config=config),
+                                                     get_char_num=lambda doc: len(doc.get("text", "")),
+                                                     max_docs=config.STREAM_BATCH_MAX_DOCS,
+                                                     max_chars=config.STREAM_BATCH_MAX_CHARS,
+                                                     max_in_flight=config.STREAM_MAX_IN_FLIGHT_BATCHES,
+                                                     max_wait_ms=config.STREAM_BATCH_MAX_WAIT_MS):
+        if "error" in doc:
+            yield json.dumps(doc) + "\n"
+            continue
+        _send_annotation_num_metric(len(annotations), PATH_PROCESS_JSON_LINES)
+        with timed_stage(STAGE_SERIALISATION):
+            annotation_lines = "".join(json.dumps({key: value for key, value in {"doc_name": doc["name"], **annotation}.items() if key in output_names}) + "\n"
+                                       for annotation in annotations)
+        yield annotation_lines
+
+
+async def _get_texts(texts: List[str]) -> AsyncIterator[str]:
+    for text in texts:
+        yield text
+
+
+async def _get_redacted_texts_stream(model_service: AbstractModelService,
+                                     texts: List[str],
+                                     warn_on_no_redaction: Optional[bool],
+                                     mask: Optional[str],
+                                     hash: Optional[bool]) -> AsyncIterator[str]:
+    doc_num = 0
+    annotation_sum = 0
+    yield "["
+    async for text, annotations in process_in_batches(_get_texts(texts),
+                                                      partial(batch_annotate, model_service, config=config),
+                                                      get_char_num=len,
+                                                      max_docs=config.STREAM_BATCH_MAX_DOCS,
+                                                      max_chars=config.STREAM_BATCH_MAX_CHARS,
+                                                      max_in_flight=config.STREAM_MAX_IN_FLIGHT_BATCHES,
+                                                      max_wait_ms=config.STREAM_BATCH_MAX_WAIT_MS):
+        annotation_sum += len(annotations)
+        _send_quality_metrics(annotations, PATH_REDACT_BULK)
+        if not annotations and warn_on_no_redaction:
+            redacted_text = NO_REDACTION_WARNING
+        else:
+            redacted_text = _get_redacted_text(text, annotations, mask, hash)
+        yield ("," if doc_num else "") + json.dumps(redacted_text)
+        doc_num += 1
+    yield "]"
+
+    _send_bulk_processed_docs_metric(doc_num, PATH_REDACT_BULK)
+    _send_annotation_num_metric(annotation_sum, PATH_REDACT_BULK)
+
+
+async def _get_redacted_jsonlines_stream(model_service: AbstractModelService,
+                                         first_doc: Dict[str, Any],
+                                         lines: AsyncIterator[bytes],
+                                         warn_on_no_redaction: Optional[bool],
+                                         mask: Optional[str],
+                                         hash: Optional[bool]) -> AsyncIterator[str]:
+    doc_num = 0
+    async for doc, annotations in process_in_batches(get_docs(lines, first_doc),
+                                                     partial(annotate_docs, model_service, config=config),
+                                                     get_char_num=lambda doc: len(doc.get("text", "")),
+                                                     max_docs=config.STREAM_BATCH_MAX_DOCS,
+                                                     max_chars=config.STREAM_BATCH_MAX_CHARS,
+                                                     max_in_flight=config.STREAM_MAX_IN_FLIGHT_BATCHES,
+                                                     max_wait_ms=config.STREAM_BATCH_MAX_WAIT_MS):
+        if "error" in doc:
+            yield json.dumps(doc) + "\n"
+            continue
+        doc_num += 1
+        _send_annotation_num_metric(len(annotations), PATH_REDACT_JSON_LINES)
+        _send_quality_metrics(annotations, PATH_REDACT_JSON_LINES)
+        if not annotations and warn_on_no_redaction:
+            yield json.dumps({"doc_name": doc["name"], "message": NO_REDACTION_WARNING}) + "\n"
+        else:
+            yield json.dumps({"doc_name": doc["name"], "text": _get_redacted_text(doc["text"], annotations, mask, hash)}) + "\n"
+    _send_bulk_processed_docs_metric(doc_num, PATH_REDACT_JSON_LINES)
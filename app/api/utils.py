@@ -1,27 +1,50 @@
+import os
 import json
+import asyncio
 import logging
 import re
 import hashlib
 import base64
+import threading
+import time
+from collections import OrderedDict
 from functools import lru_cache
-from typing import Optional
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Mapping, Optional, final
 from fastapi import FastAPI, Request
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, Response
+from starlette.datastructures import MutableHeaders
+from starlette.concurrency import run_in_threadpool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from starlette.background import BackgroundTask
 from starlette.status import HTTP_500_INTERNAL_SERVER_ERROR, HTTP_400_BAD_REQUEST, HTTP_429_TOO_MANY_REQUESTS
 from slowapi.middleware import SlowAPIMiddleware, SlowAPIASGIMiddleware
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.asymmetric.types import PublicKeyTypes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 from fastapi_users.jwt import decode_jwt
+from pydantic import ValidationError
 from config import Settings
+from domain import TextStreamItem
+from model_services.base import AbstractModelService
+from api.auth.token_cache import get_token_cache
 from exception import StartTrainingException, AnnotationException
+from management.annotation_cache import get_annotation_cache
+from management.micro_batcher import get_micro_batcher
+from management.prometheus_metrics import cms_stage_latency
+from management.stage_timings import STAGE_QUEUEING, StageTimings, get_stage_timings, set_stage_timings, reset_stage_timings
 
 logger = logging.getLogger("cms")
 
+_PUBLIC_KEY_CACHE_SIZE = 128
+_public_keys: OrderedDict = OrderedDict()
+_public_keys_lock = threading.Lock()
+
 
 def add_exception_handlers(app: FastAPI) -> None:
 
@@ -51,8 +74,96 @@ def add_middlewares(app: FastAPI, config: Settings, streamable: bool = False) ->
     app.add_middleware(SlowAPIMiddleware if not streamable else SlowAPIASGIMiddleware)
 
 
+@final
+class ModelRoutingMiddleware(object):
+
+    MODEL_TYPE_HEADER = b"x-cms-model-type"
+    PATH_PREFIX = "/models/"
+
+    def __init__(self, app: ASGIApp, model_types: Iterable[str]) -> None:
+        self._app = app
+        self._model_types = set(model_types)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] in ("http", "websocket"):
+            scope = dict(scope)
+            path = scope["path"]
+            model_type, _, remaining_path = path[len(self.PATH_PREFIX):].partition("/") if path.startswith(self.PATH_PREFIX) else ("", "", "")
+            if model_type in self._model_types:
+                scope["path"] = f"/{remaining_path}"
+                scope["raw_path"] = scope["path"].encode("utf-8")
+            else:
+                model_type = next((value.decode("latin-1") for key, value in scope.get("headers", []) if key == self.MODEL_TYPE_HEADER), "")
+            scope["cms_model_type"] = model_type or None
+            # hosted model services leased by the request are released once its response has been fully sent
+            leases = scope["cms_model_leases"] = []
+            try:
+                await self._app(scope, receive, send)
+            finally:
+                if leases:
+                    await run_in_threadpool(self._release, leases)
+        else:
+            await self._app(scope, receive, send)
+
+    @staticmethod
+    def _release(leases: List[Callable[[], None]]) -> None:
+        for release in leases:
+            release()
+
+
+@final
+class StageTimingMiddleware(object):
+
+    def __init__(self, app: ASGIApp) -> None:
+        self._app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self._app(scope, receive, send)
+            return
+        timings = StageTimings()
+        start = time.perf_counter()
+
+        async def send_with_server_timing(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append("Server-Timing", timings.to_server_timing(time.perf_counter() - start))
+            await send(message)
+
+        token = set_stage_timings(timings)
+        try:
+            await self._app(scope, receive, send_with_server_timing)
+        finally:
+            reset_stage_timings(token)
+            route = scope.get("route")
+            if route is not None:
+                for stage, duration in timings.durations.items():
+                    cms_stage_latency.labels(handler=route.path, stage=stage).observe(duration)
+
+
+@final
+class StageTimedCapacityLimiter(object):
+
+    def __init__(self, limiter: Any) -> None:
+        self._limiter = limiter
+
+    async def __aenter__(self) -> None:
+        start = time.perf_counter()
+        await self._limiter.__aenter__()
+        timings = get_stage_timings()
+        if timings is not None:
+            timings.add(STAGE_QUEUEING, time.perf_counter() - start)
+
+    async def __aexit__(self, *args: Any) -> Optional[bool]:
+        return await self._limiter.__aexit__(*args)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._limiter, name)
+
+
 @lru_cache()
 def get_rate_limiter(config: Settings, auth_user_enabled: Optional[bool] = None) -> Limiter:
+    token_cache = get_token_cache()
+
     def get_user_auth(request: Request) -> str:
         request_headers = request.scope.get("headers", [])
         limiter_prefix = request.scope.get("root_path", "") + request.scope.get("path") + ":"
@@ -61,11 +172,13 @@ def get_rate_limiter(config: Settings, auth_user_enabled: Optional[bool] = None)
         for headers in request_headers:
             if headers[0].decode() == "authorization":
                 token = headers[1].decode().split("Bearer ")[1]
-                payload = decode_jwt(token, config.AUTH_JWT_SECRET, ["fastapi-users:auth"])
-                sub = payload.get("sub")
-                assert sub is not None, "Cannot find 'sub' in the decoded payload"
-                hash_object = hashlib.sha256(sub.encode())
-                current_key = hash_object.hexdigest()
+                cached_token = token_cache.get(token)
+                if cached_token is None:
+                    payload = decode_jwt(token, config.AUTH_JWT_SECRET, ["fastapi-users:auth"])
+                    sub = payload.get("sub")
+                    assert sub is not None, "Cannot find 'sub' in the decoded payload"
+                    cached_token = token_cache.put(token, sub, payload.get("exp"))
+                current_key = cached_token.limiter_key
                 break
 
         limiter_key = re.sub(r":+", ":", re.sub(r"/+", ":", limiter_prefix + current_key))
@@ -82,11 +195,23 @@ def adjust_rate_limit_str(rate_limit: str) -> str:
         return f"{int(rate_limit.split('/')[0]) * 2}/{rate_limit.split('/')[1]}"
 
 
-def encrypt(raw: str, public_key_pem: str) -> str:
+def get_public_key(public_key_pem: str) -> PublicKeyTypes:
+    fingerprint = hashlib.sha256(public_key_pem.strip().encode()).hexdigest()
+    with _public_keys_lock:
+        public_key = _public_keys.get(fingerprint)
+        if public_key is not None:
+            _public_keys.move_to_end(fingerprint)
+            return public_key
     public_key = serialization.load_pem_public_key(public_key_pem.encode(), backend=default_backend)
-    encrypted = public_key.encrypt(raw.encode(),  # type: ignore
-                                   padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None))
-    return base64.b64encode(encrypted).decode()
+    with _public_keys_lock:
+        _public_keys[fingerprint] = public_key
+        while len(_public_keys) > _PUBLIC_KEY_CACHE_SIZE:
+            _public_keys.popitem(last=False)
+    return public_key
+
+
+def encrypt(raw: str, public_key_pem: str) -> str:
+    return base64.b64encode(_rsa_encrypt(raw.encode(), public_key_pem)).decode()
 
 
 def decrypt(b64_encoded: str, private_key_pem: str) -> str:
@@ -94,3 +219,139 @@ def decrypt(b64_encoded: str, private_key_pem: str) -> str:
     decrypted = private_key.decrypt(base64.b64decode(b64_encoded),  # type: ignore
                                     padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None))
     return decrypted.decode()
+
+
+def envelope_decrypt(b64_encoded: str, encrypted_data_key: str, private_key_pem: str) -> str:
+    private_key = serialization.load_pem_private_key(private_key_pem.encode(), password=None)
+    data_key = private_key.decrypt(base64.b64decode(encrypted_data_key),  # type: ignore
+                                   padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None))
+    encrypted = base64.b64decode(b64_encoded)
+    return AESGCM(data_key).decrypt(encrypted[:12], encrypted[12:], None).decode()
+
+
+@final
+class EnvelopeEncryptor(object):
+
+    def __init__(self, public_key_pem: str) -> None:
+        data_key = AESGCM.generate_key(bit_length=256)
+        self._aesgcm = AESGCM(data_key)
+        self.encrypted_data_key = base64.b64encode(_rsa_encrypt(data_key, public_key_pem)).decode()
+
+    def encrypt(self, raw: str) -> str:
+        nonce = os.urandom(12)
+        return base64.b64encode(nonce + self._aesgcm.encrypt(nonce, raw.encode(), None)).decode()
+
+
+def annotate(model_service: AbstractModelService, text: str, config: Settings) -> List[Dict]:
+    annotate_text = model_service.annotate
+    if config.ENABLE_MICRO_BATCHING == "true":
+        annotate_text = get_micro_batcher(model_service, config).annotate
+    if config.ENABLE_ANNOTATION_CACHE == "true":
+        return get_annotation_cache().annotate(model_service, text, annotate_text)
+    return annotate_text(text)
+
+
+def batch_annotate(model_service: AbstractModelService, texts: List[str], config: Settings) -> List[List[Dict]]:
+    if config.ENABLE_ANNOTATION_CACHE == "true":
+        return get_annotation_cache().batch_annotate(model_service, texts)
+    return model_service.batch_annotate(texts)
+
+
+def annotate_docs(model_service: AbstractModelService, docs: List[Dict[str, Any]], config: Settings) -> List[Optional[List[Dict]]]:
+    texts = [doc["text"] for doc in docs if "error" not in doc]
+    annotations_list = iter(batch_annotate(model_service, texts, config) if texts else [])
+    return [None if "error" in doc else next(annotations_list) for doc in docs]
+
+
+def parse_json_line(line: bytes, doc_idx: int) -> Dict[str, Any]:
+    json_line_obj = json.loads(line)
+    TextStreamItem(**json_line_obj)
+    return {"name": json_line_obj["name"] if "name" in json_line_obj else str(doc_idx), "text": json_line_obj["text"]}
+
+
+async def get_docs(lines: AsyncIterator[bytes], first_doc: Optional[Dict[str, Any]] = None) -> AsyncIterator[Dict[str, Any]]:
+    doc_idx = 0
+    if first_doc is not None:
+        yield first_doc
+        doc_idx += 1
+    async for line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield parse_json_line(line, doc_idx)
+        except json.JSONDecodeError:
+            yield {"error": "Invalid JSON Line", "content": line.decode("utf-8", errors="replace")}
+        except (ValidationError, TypeError):
+            yield {"error": f"Invalid JSON properties found. The schema should be {TextStreamItem.schema_json()}", "content": line.decode("utf-8", errors="replace")}
+        finally:
+            doc_idx += 1
+
+
+def _rsa_encrypt(raw: bytes, public_key_pem: str) -> bytes:
+    return get_public_key(public_key_pem).encrypt(raw,  # type: ignore
+                                                  padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None))
+
+
+class LocalStreamingResponse(Response):
+
+    def __init__(self,
+                 content: Any,
+                 status_code: int = 200,
+                 headers: Optional[Mapping[str, str]] = None,
+                 media_type: Optional[str] = None,
+                 background: Optional[BackgroundTask] = None,
+                 max_write_size: int = 64 * 1024,
+                 max_pending_items: int = 64) -> None:
+        self.content = content
+        self.status_code = status_code
+        self.media_type = self.media_type if media_type is None else media_type
+        self.background = background
+        self.max_write_size = max_write_size
+        self.max_pending_items = max_pending_items
+        self.init_headers(headers)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        pending: asyncio.Queue = asyncio.Queue(maxsize=max(self.max_pending_items, 1))
+        end_of_content = object()
+
+        async def _produce() -> None:
+            try:
+                async for item in self.content:
+                    await pending.put(item)
+                await pending.put(end_of_content)
+            except Exception as e:
+                await pending.put(e)
+
+        producer = asyncio.create_task(_produce())
+        response_started = False
+        try:
+            exhausted = False
+            while not exhausted:
+                item = await pending.get()
+                buffer = bytearray()
+                item_num = 0
+                while True:
+                    if item is end_of_content:
+                        exhausted = True
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    buffer.extend(item.encode("utf-8"))
+                    item_num += 1
+                    if len(buffer) >= self.max_write_size or pending.empty():
+                        break
+                    item = pending.get_nowait()
+                if not response_started and item_num:
+                    await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+                    response_started = True
+                if buffer:
+                    await send({"type": "http.response.body", "body": bytes(buffer), "more_body": True})
+        finally:
+            producer.cancel()
+        if not response_started:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            await send({"type": "http.response.body", "body": '{"error": "Empty stream"}\n'.encode("utf-8"), "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+        if self.background is not None:
+            await self.background()
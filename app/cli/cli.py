@@ -1,9 +1,11 @@
 import json
+import asyncio
 import logging.config
 import os
 import sys
 import uuid
 import inspect
+import tempfile
 import warnings
 
 current_frame = inspect.currentframe()
@@ -21,21 +23,31 @@ import graypy  # noqa
 import api.globals as cms_globals  # noqa
 
 from logging import LogRecord  # noqa
-from typing import Optional, Tuple, Dict, Any  # noqa
+from functools import partial  # noqa
+from typing import Optional, Tuple, Dict, Any, List, AsyncIterator, Callable  # noqa
 from urllib.parse import urlparse  # noqa
 from fastapi.routing import APIRoute  # noqa
 from domain import ModelType, TrainingType  # noqa
+from config import Settings  # noqa
 from registry import model_service_registry  # noqa
+from model_services.base import AbstractModelService  # noqa
 from api.api import get_model_server, get_stream_server # noqa
 from utils import get_settings, send_gelf_message  # noqa
 from management.model_manager import ModelManager  # noqa
-from api.dependencies import ModelServiceDep, ModelManagerDep  # noqa
+from management.model_replica_pool import ModelReplicaPool  # noqa
+from api.dependencies import ModelServiceDep, ModelManagerDep, MultiModelServiceDep  # noqa
+from api.utils import annotate, batch_annotate  # noqa
+from management.model_host import ModelHost  # noqa
 from management.tracker_client import TrackerClient  # noqa
+from management.warm_up import get_warm_up_texts, start_warm_up  # noqa
+from management.benchmark import Benchmark, get_corpus  # noqa
 
 cmd_app = typer.Typer(name="python cli.py", help="CLI for various CogStack ModelServe operations", add_completion=False)
 logging.config.fileConfig(os.path.join(parent_dir, "logging.ini"), disable_existing_loggers=False)
 logger = logging.getLogger("cms")
 
+BENCHMARK_SCENARIOS = ["annotate", "batch_annotate", "redact", "stream", "redact_stream"]
+
 
 @cmd_app.command("serve")
 def serve_model(model_type: ModelType = typer.Option(..., help="The type of the model to serve"),
@@ -44,7 +56,8 @@ def serve_model(model_type: ModelType = typer.Option(..., help="The type of the
                 host: str = typer.Option("127.0.0.1", help="The hostname of the server"),
                 port: str = typer.Option("8000", help="The port of the server"),
                 model_name: Optional[str] = typer.Option(None, help="The string representation of the model name"),
-                streamable: bool = typer.Option(False, help="Serve the bidirectional streamable endpoint only")) -> None:
+                streamable: bool = typer.Option(False, help="Serve the bidirectional streamable endpoint only"),
+                hosted_model: List[str] = typer.Option([], help="An additional model to be hosted and loaded on first use, routed by the path prefix /models/MODEL_TYPE or the X-CMS-Model-Type header", metavar="MODEL_TYPE=MODEL_PATH")) -> None:
     """
     This serves various CogStack NLP models
     """
@@ -70,38 +83,78 @@ def serve_model(model_type: ModelType = typer.Option(..., help="The type of the
 
     config = get_settings()
 
+    if hosted_model:
+        _init_hosted_model_services(model_type, model_path, model_name, hosted_model, config)
+    else:
+        _init_model_service(model_type, model_path, mlflow_model_uri, model_name, config)
+
+    if config.WARM_UP_ON_START == "true":
+        start_warm_up(cms_globals.model_service_dep.model_service, get_warm_up_texts(config.WARM_UP_SAMPLE_TEXTS_FILE))
+    else:
+        # worker pools are still started before the first request without annotating any sample texts
+        cms_globals.model_service_dep.model_service.warm_up([])
+
+    logger.info(f'Start serving model "{model_type}" on {host}:{port}')
+    # interrupted = False
+    # while not interrupted:
+    uvicorn.run(get_model_server() if not streamable else get_stream_server(), host=host, port=int(port), log_config=None)
+    # interrupted = True
+    print("Shutting down due to either keyboard interrupt or system exit")
+
+
+def _init_model_service(model_type: ModelType, model_path: str, mlflow_model_uri: str, model_name: Optional[str], config: Settings) -> None:
     model_service_dep = ModelServiceDep(model_type, config, model_name)
     cms_globals.model_service_dep = model_service_dep
-    model_server_app = get_model_server()
-
-    dst_model_path = os.path.join(parent_dir, "model", "model.zip")
-    if dst_model_path and os.path.exists(dst_model_path.replace(".zip", "")):
+    model_service_dep.model_service = _load_model_service(model_type, model_path, mlflow_model_uri, model_name, config, os.path.join(parent_dir, "model"))
+    cms_globals.model_manager_dep = ModelManagerDep(model_service_dep)
+    _replicate_model_service(model_service_dep, config)
+
+
+def _load_model_service(model_type: ModelType,
+                        model_path: str,
+                        mlflow_model_uri: str,
+                        model_name: Optional[str],
+                        config: Settings,
+                        model_dir: str) -> AbstractModelService:
+    dst_model_path = os.path.join(model_dir, "model.zip")
+    if os.path.exists(dst_model_path.replace(".zip", "")):
         shutil.rmtree(dst_model_path.replace(".zip", ""))
     if model_path:
         try:
             shutil.copy2(model_path, dst_model_path)
         except shutil.SameFileError:
             pass
-        model_service = model_service_dep()
+        model_service = model_service_registry[model_type](config, model_parent_dir=model_dir, base_model_file=os.path.basename(dst_model_path))
         model_service.model_name = model_name if model_name is not None else "CMS model"
         model_service.init_model()
-        cms_globals.model_manager_dep = ModelManagerDep(model_service)
     elif mlflow_model_uri:
         model_service = ModelManager.retrieve_model_service_from_uri(mlflow_model_uri, config, dst_model_path)
         model_service.model_name = model_name if model_name is not None else "CMS model"
-        model_service_dep.model_service = model_service
-        cms_globals.model_manager_dep = ModelManagerDep(model_service)
-        model_server_app = get_model_server()
     else:
         logger.error("Neither the model path or the mlflow model uri was passed in")
         sys.exit(1)
+    return model_service
 
-    logger.info(f'Start serving model "{model_type}" on {host}:{port}')
-    # interrupted = False
-    # while not interrupted:
-    uvicorn.run(model_server_app if not streamable else get_stream_server(), host=host, port=int(port), log_config=None)
-    # interrupted = True
-    print("Shutting down due to either keyboard interrupt or system exit")
+
+def _init_hosted_model_services(model_type: ModelType, model_path: str, model_name: Optional[str], hosted_models: List[str], config: Settings) -> None:
+    if not model_path:
+        logger.error("The model path of the default model must be passed in when hosting multiple models")
+        sys.exit(1)
+    if config.MODEL_WORKER_PROCESSES > 0:
+        logger.warning("Model workers are not forked when hosting multiple models and annotations will be served by the main process")
+    model_host = ModelHost(config, config.HOSTED_MODELS_MEMORY_BUDGET_MB * 1024 ** 2)
+    model_host.register(model_type.value, model_path, model_name)
+    for hosted_model in hosted_models:
+        hosted_model_type, _, hosted_model_path = hosted_model.partition("=")
+        if hosted_model_type not in model_service_registry or not hosted_model_path:
+            logger.error(f"Cannot host the model \"{hosted_model}\" which should be in the format of MODEL_TYPE=MODEL_PATH")
+            sys.exit(1)
+        model_host.register(hosted_model_type, hosted_model_path)
+    model_host.get_model_service(model_type.value)
+    model_service_dep = MultiModelServiceDep(model_host, model_type.value, config, model_name)
+    cms_globals.model_service_dep = model_service_dep
+    cms_globals.model_manager_dep = ModelManagerDep(model_service_dep)
+    logger.info(f"Hosting models of types {', '.join(model_host.model_types)} with \"{model_type}\" loaded by default")
 
 
 @cmd_app.command("train")
@@ -131,25 +184,8 @@ def train_model(model_type: ModelType = typer.Option(..., help="The type of the
 
     model_service_dep = ModelServiceDep(model_type, config)
     cms_globals.model_service_dep = model_service_dep
-
-    dst_model_path = os.path.join(parent_dir, "model", "model.zip")
-    if dst_model_path and os.path.exists(dst_model_path.replace(".zip", "")):
-        shutil.rmtree(dst_model_path.replace(".zip", ""))
-    if base_model_path:
-        try:
-            shutil.copy2(base_model_path, dst_model_path)
-        except shutil.SameFileError:
-            pass
-        model_service = model_service_dep()
-        model_service.model_name = model_name if model_name is not None else "CMS model"
-        model_service.init_model()
-    elif mlflow_model_uri:
-        model_service = ModelManager.retrieve_model_service_from_uri(mlflow_model_uri, config, dst_model_path)
-        model_service.model_name = model_name if model_name is not None else "CMS model"
-        model_service_dep.model_service = model_service
-    else:
-        logger.error("Neither the model path or the mlflow model uri was passed in")
-        sys.exit(1)
+    model_service = _load_model_service(model_type, base_model_path, mlflow_model_uri, model_name, config, os.path.join(parent_dir, "model"))
+    model_service_dep.model_service = model_service
 
     training_id = str(uuid.uuid4())
     with open(data_file_path, "r") as data_file:
@@ -165,6 +201,109 @@ def train_model(model_type: ModelType = typer.Option(..., help="The type of the
             sys.exit(1)
 
 
+@cmd_app.command("benchmark")
+def benchmark_model(model_type: ModelType = typer.Option(..., help="The type of the model to benchmark"),
+                    model_path: str = typer.Option("", help="The file path to the model package"),
+                    mlflow_model_uri: str = typer.Option("", help="The URI of the MLflow model to benchmark", metavar="models:/MODEL_NAME/ENV"),
+                    corpus_file_path: str = typer.Option("", help="The path to the corpus file containing one text or one JSON object with the \"text\" property per line"),
+                    scenario: List[str] = typer.Option(BENCHMARK_SCENARIOS, help="The scenario to be benchmarked and can be repeated"),
+                    concurrency: int = typer.Option(1, help="The number of concurrent callers"),
+                    batch_size: int = typer.Option(8, help="The number of texts per call in the batch and stream scenarios"),
+                    repeats: int = typer.Option(1, help="The number of times the corpus is repeated"),
+                    warm_up: bool = typer.Option(True, help="Warm up the model before benchmarking"),
+                    output_path: Optional[str] = typer.Option(None, help="The path to the file where results will be saved as JSON"),
+                    log_to_mlflow: bool = typer.Option(False, help="Log the results as an MLflow run"),
+                    model_name: Optional[str] = typer.Option(None, help="The string representation of the model name")) -> None:
+    """
+    This benchmarks the throughput and latency of various CogStack NLP models
+    """
+    unknown_scenarios = [s for s in scenario if s not in BENCHMARK_SCENARIOS]
+    if unknown_scenarios:
+        logger.error(f"Unknown scenario(s): {', '.join(unknown_scenarios)}. Supported scenarios are {', '.join(BENCHMARK_SCENARIOS)}")
+        sys.exit(1)
+
+    config = get_settings()
+
+    # the model pack is unpacked into a temporary directory to leave any served model in the tree untouched
+    with tempfile.TemporaryDirectory() as model_dir:
+        model_service = _load_model_service(model_type, model_path, mlflow_model_uri, model_name, config, model_dir)
+        try:
+            _run_benchmark(model_type, model_service, model_path or mlflow_model_uri, corpus_file_path, scenario, concurrency, batch_size, repeats, warm_up, output_path, log_to_mlflow, config)
+        finally:
+            model_service.close()
+
+
+def _run_benchmark(model_type: ModelType,
+                   model_service: AbstractModelService,
+                   model_origin: str,
+                   corpus_file_path: str,
+                   scenario: List[str],
+                   concurrency: int,
+                   batch_size: int,
+                   repeats: int,
+                   warm_up: bool,
+                   output_path: Optional[str],
+                   log_to_mlflow: bool,
+                   config: Settings) -> None:
+    model_service_dep = ModelServiceDep(model_type, config)
+    model_service_dep.model_service = model_service
+    cms_globals.model_service_dep = model_service_dep
+
+    # the routers are importable only after the app has been created
+    get_model_server()
+    from api.routers import invocation
+
+    texts = get_corpus(corpus_file_path) if corpus_file_path else get_warm_up_texts(config.WARM_UP_SAMPLE_TEXTS_FILE)
+    if warm_up:
+        model_service.warm_up(texts[:batch_size])
+
+    benchmark = Benchmark(texts, concurrency, repeats)
+    scenario_funcs: Dict[str, Tuple[Callable[[List[str]], Any], int]] = {
+        "annotate": (lambda batch: [annotate(model_service, text, config) for text in batch], 1),
+        "batch_annotate": (lambda batch: batch_annotate(model_service, batch, config), batch_size),
+        "redact": (lambda batch: [invocation._get_redacted_text(text, annotate(model_service, text, config)) for text in batch], 1),
+        "stream": (lambda batch: _consume_jsonlines_stream(invocation._get_jsonlines_stream, model_service, batch), batch_size),
+        "redact_stream": (lambda batch: _consume_jsonlines_stream(partial(invocation._get_redacted_jsonlines_stream, warn_on_no_redaction=False, mask=None, hash=False), model_service, batch), batch_size),
+    }
+    results = {s: benchmark.run(s, *scenario_funcs[s]) for s in scenario}
+
+    print(json.dumps(results, indent=4))
+    if output_path is not None:
+        with open(output_path, "w") as f:
+            json.dump(results, f, indent=4)
+
+    if log_to_mlflow:
+        model_card = model_service.info()
+        benchmark_params = {
+            "model_type": model_type.value,
+            "model_origin": model_origin,
+            "model_description": model_card.model_description,
+            "api_version": model_card.api_version,
+            "corpus": corpus_file_path or "default",
+            "docs": len(texts),
+            "concurrency": concurrency,
+            "batch_size": batch_size,
+            "repeats": repeats,
+            "annotation_cache_enabled": config.ENABLE_ANNOTATION_CACHE,
+            "micro_batching_enabled": config.ENABLE_MICRO_BATCHING,
+        }
+        run_id = TrackerClient(config.MLFLOW_TRACKING_URI).save_benchmark_results(model_service.model_name, str(uuid.uuid4()), benchmark_params, results)
+        print(f"Benchmark results logged to the MLflow run {run_id}")
+
+
+def _consume_jsonlines_stream(get_stream: Callable[..., AsyncIterator[str]], model_service: Any, texts: List[str]) -> None:
+
+    async def lines() -> AsyncIterator[bytes]:
+        for idx, text in enumerate(texts[1:], 1):
+            yield json.dumps({"name": str(idx), "text": text}).encode("utf-8")
+
+    async def consume() -> None:
+        async for _ in get_stream(model_service, {"name": "0", "text": texts[0]}, lines()):
+            pass
+
+    asyncio.run(consume())
+
+
 @cmd_app.command("register")
 def register_model(model_type: ModelType = typer.Option(..., help="The type of the model to serve"),
                    model_path: str = typer.Option(..., help="The file path to the model package"),
@@ -266,5 +405,14 @@ def generate_api_doc(api_title: str = typer.Option("CogStack Model Serve APIs",
     print(f"OpenAPI doc exported to {doc_name}")
 
 
+def _replicate_model_service(model_service_dep: ModelServiceDep, config: Settings) -> None:
+    if config.MODEL_WORKER_PROCESSES <= 0:
+        return
+    if config.DEVICE.startswith("cuda") or config.DEVICE.startswith("mps"):
+        logger.warning(f"Model workers cannot be forked for the device {config.DEVICE} and annotations will be served by the main process")
+        return
+    model_service_dep.model_service = ModelReplicaPool(model_service_dep.model_service, config.MODEL_WORKER_PROCESSES)
+
+
 if __name__ == "__main__":
     cmd_app()
@@ -19,7 +19,7 @@ class Settings(BaseSettings):
     SKIP_SAVE_MODEL: str = "false"                    # if "true", newly trained models won't be saved but training metrics will be collected
     SKIP_SAVE_TRAINING_DATASET: str = "true"          # if "true", the dataset used for training won't be saved
     PROCESS_RATE_LIMIT: str = "180/minute"            # the rate limit on the /process route
-    PROCESS_BULK_RATE_LIMIT: str = "90/minute"        # the rate limit on the /process_bulk route
+    PROCESS_BULK_RATE_LIMIT: str = "90/minute"        # the rate limit on the /process_bulk, /redact_bulk and /redact_jsonl routes
     TYPE_UNIQUE_ID_WHITELIST: str = ""                # the comma-separated TUIs used for filtering and if set to "", all TUIs are whitelisted
     AUTH_USER_ENABLED: str = "false"                  # if "true", enable user authentication on API access
     AUTH_JWT_SECRET: str = ""                         # the JWT secret and will be ignored if AUTH_USER_ENABLED is not "true"
@@ -28,7 +28,34 @@ class Settings(BaseSettings):
     TRAINING_CONCEPT_ID_WHITELIST: str = ""           # the comma-separated concept IDs used for filtering annotations of interest
     TRAINING_METRICS_LOGGING_INTERVAL: int = 5        # the number of steps after which training metrics will be collected
     TRAINING_SAFE_MODEL_SERIALISATION: str = "false"  # if "true", serialise the trained model using safe tensors
-    LOG_PER_CONCEPT_ACCURACIES: str = "false"         # if "true", per-concept accuracies will be exposed to the metrics scrapper. Switch this on with caution due to the potentially high number of concepts
+    LOG_PER_CONCEPT_ACCURACIES: str = "false"         # if "true", per-concept accuracies of the most frequent concepts will be exposed to the metrics scrapper
+    PER_CONCEPT_ACCURACIES_TOP_K: int = 100           # the maximum number of concepts whose accuracies are exposed to the metrics scrapper
+    METRICS_WINDOW_SIZE: int = 1000                   # the number of recent documents over which the means and quantiles of annotation quality metrics are calculated
+    METRICS_AGGREGATION_INTERVAL_SECONDS: int = 5     # the seconds between two aggregations of annotation quality metrics
+    ENABLE_MICRO_BATCHING: str = "false"              # if "true", concurrent single-document requests to /process and /redact will be coalesced into batches
+    MICRO_BATCH_MAX_WAIT_MS: int = 10                 # the maximum milliseconds for which a micro-batch window waits for more documents
+    MICRO_BATCH_MAX_DOCS: int = 32                    # the maximum number of documents in a micro-batch
+    MICRO_BATCH_MAX_CHARS: int = 100000               # the maximum number of characters in a micro-batch
+    ENABLE_ANNOTATION_CACHE: str = "false"            # if "true", annotations of previously seen texts will be served from an in-memory LRU cache
+    ANNOTATION_CACHE_MAX_BYTES: int = 268435456       # the maximum size of the annotation cache in bytes
+    STREAM_BATCH_MAX_DOCS: int = 32                   # the maximum number of documents in a batch annotated from a JSON Lines stream
+    STREAM_BATCH_MAX_CHARS: int = 100000              # the maximum number of characters in a batch annotated from a JSON Lines stream
+    STREAM_BATCH_MAX_WAIT_MS: int = 10                # the maximum milliseconds for which a batch from a JSON Lines stream waits for more documents
+    STREAM_MAX_IN_FLIGHT_BATCHES: int = 2             # the maximum number of batches being annotated concurrently for each JSON Lines stream
+    MODEL_WORKER_PROCESSES: int = 0                   # the number of forked processes sharing the loaded model to serve annotations and if set to 0, annotations are served by the main process
+    MODEL_WORKER_TIMEOUT_SECONDS: int = 300           # the maximum seconds to wait for a model worker to respond before it is restarted and if set to 0, workers are waited for indefinitely
+    BATCH_POOL_PROCESSES: int = 0                     # the number of forked processes kept for annotating batches with MedCAT models on CPU, started on warm-up, and if set to 0, batches are annotated by the main process
+    ENABLE_ONNX_RUNTIME: str = "false"                # if "true", run the transformer models of DeID services with ONNX Runtime on CPU and fall back to PyTorch if unavailable
+    ONNX_INTRA_OP_THREADS: int = 0                    # the number of threads used by ONNX Runtime within each operator and if set to 0, the ONNX Runtime default is used
+    ENABLE_DYNAMIC_QUANTISATION: str = "false"        # if "true", apply dynamic int8 quantisation to MetaCAT networks and DeID transformers loaded on CPU
+    QUANTISATION_SANITY_CHECK_EXPORT: str = ""        # the path to the trainer export used for checking the accuracy of the quantised model and if set to "", the check is skipped
+    QUANTISATION_MAX_F1_DROP: float = 0.01            # the maximum drop in F1 tolerated after quantisation before the original networks are restored
+    AUTH_TOKEN_CACHE_TTL_SECONDS: int = 60            # the maximum seconds for which a verified JWT and its user are cached and if set to 0, the cache is disabled
+    MODEL_PACK_CACHE_DIR: str = ""                    # the directory where served model packs are kept unpacked with snapshots of their CDB and vocab, keyed by content hash, and if set to "", the cache is disabled
+    HOSTED_MODELS_MEMORY_BUDGET_MB: int = 0           # the memory budget for models loaded when hosting multiple models and if exceeded, the least recently used models are evicted, and if set to 0, models are never evicted
+    WARM_UP_SAMPLE_TEXTS_FILE: str = ""               # the path to the file containing one sample text per line for warming up a new model and if set to "", bundled texts are used
+    WARM_UP_ON_START: str = "true"                    # if "true", warm up the served model on start-up before /readyz reports readiness
+    ENABLE_STAGE_TIMING: str = "false"                # if "true", time each stage of the annotation pipeline per request and report them in histograms and the Server-Timing header
     DEBUG: str = "false"                              # if "true", the debug mode is switched on
 
     class Config:
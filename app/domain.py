@@ -76,6 +76,11 @@ class TextWithPublicKey(BaseModel):
     public_key_pem: str = Field(description="the public PEM key used for encrypting detected spans")
 
 
+class TextsWithPublicKey(BaseModel):
+    texts: List[str] = Field(description="The plain texts to be sent to the model for NER and redaction")
+    public_key_pem: str = Field(description="the public PEM key used for encrypting detected spans")
+
+
 class TextStreamItem(BaseModel):
     text: str = Field(description="The text from which the annotations are extracted")
     name: Optional[str] = Field(description="The name of the document containing the text")
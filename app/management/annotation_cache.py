@@ -0,0 +1,204 @@
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple, final
+from model_services.base import AbstractModelService
+from config import Settings
+from utils import get_settings
+from management.prometheus_metrics import (
+    cms_annotation_cache_hits,
+    cms_annotation_cache_misses,
+    cms_annotation_cache_evictions,
+    cms_annotation_cache_size,
+)
+
+logger = logging.getLogger("cms")
+
+_ENTRY_OVERHEAD_BYTES = 256
+
+
+@final
+class AnnotationCache(object):
+
+    def __init__(self, max_bytes: int, config: Optional[Settings] = None) -> None:
+        self._max_bytes = max_bytes
+        self._config = config or get_settings()
+        self._entries: OrderedDict = OrderedDict()
+        self._in_flight: Dict[Tuple, Future] = {}
+        self._generations: Dict[int, int] = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def annotate(self,
+                 model_service: AbstractModelService,
+                 text: str,
+                 annotate: Optional[Callable[[str], List[Dict]]] = None) -> List[Dict]:
+        annotate = annotate or model_service.annotate
+        text_key = self._get_text_key(model_service, text)
+        with self._lock:
+            key = self._get_key(model_service, text_key)
+            serialised = self._get(key)
+            if serialised is not None:
+                return json.loads(serialised)
+            future = self._in_flight.get(key)
+            if future is None:
+                future = Future()
+                self._in_flight[key] = future
+                is_owner = True
+            else:
+                is_owner = False
+
+        if not is_owner:
+            cms_annotation_cache_hits.inc()
+            return json.loads(future.result())
+
+        cms_annotation_cache_misses.inc()
+        try:
+            annotations = annotate(text)
+            serialised = self._serialise(annotations)
+        except Exception as e:
+            self._fail(key, future, e)
+            raise
+        self._complete(key, future, serialised)
+        return annotations
+
+    def batch_annotate(self,
+                       model_service: AbstractModelService,
+                       texts: List[str],
+                       batch_annotate: Optional[Callable[[List[str]], List[List[Dict]]]] = None) -> List[List[Dict]]:
+        batch_annotate = batch_annotate or model_service.batch_annotate
+        text_keys = [self._get_text_key(model_service, text) for text in texts]
+        results: List[Any] = [None] * len(texts)
+        owned: Dict[Tuple, Tuple[Future, List[int]]] = {}
+        awaited: Dict[Tuple, Tuple[Future, List[int]]] = {}
+        with self._lock:
+            keys = [self._get_key(model_service, text_key) for text_key in text_keys]
+            for idx, key in enumerate(keys):
+                if key in owned:
+                    owned[key][1].append(idx)
+                    continue
+                if key in awaited:
+                    awaited[key][1].append(idx)
+                    continue
+                serialised = self._get(key)
+                if serialised is not None:
+                    results[idx] = json.loads(serialised)
+                elif key in self._in_flight:
+                    awaited[key] = (self._in_flight[key], [idx])
+                else:
+                    future: Future = Future()
+                    self._in_flight[key] = future
+                    owned[key] = (future, [idx])
+
+        if owned:
+            cms_annotation_cache_misses.inc(len(owned))
+            miss_texts = [texts[indices[0]] for _, indices in owned.values()]
+            try:
+                annotations_list = batch_annotate(miss_texts)
+                if len(annotations_list) != len(miss_texts):
+                    raise RuntimeError(f"Expected {len(miss_texts)} annotation lists but got {len(annotations_list)}")
+                serialised_list = [self._serialise(annotations) for annotations in annotations_list]
+            except Exception as e:
+                for key, (future, _) in owned.items():
+                    self._fail(key, future, e)
+                raise
+            for (key, (future, indices)), annotations, serialised in zip(owned.items(), annotations_list, serialised_list):
+                self._complete(key, future, serialised)
+                results[indices[0]] = annotations
+                for idx in indices[1:]:
+                    results[idx] = json.loads(serialised)
+
+        if awaited:
+            cms_annotation_cache_hits.inc(len(awaited))
+            for future, indices in awaited.values():
+                awaited_serialised = future.result()
+                for idx in indices:
+                    results[idx] = json.loads(awaited_serialised)
+
+        return results
+
+    def invalidate(self, model_service: AbstractModelService) -> None:
+        service_id = id(model_service)
+        with self._lock:
+            self._generations[service_id] = self._generations.get(service_id, 0) + 1
+            stale_keys = [key for key in self._entries.keys() if key[0] == service_id]
+            for key in stale_keys:
+                self._size -= len(self._entries.pop(key)) + _ENTRY_OVERHEAD_BYTES
+            cms_annotation_cache_size.set(self._size)
+        logger.debug(f"Invalidated {len(stale_keys)} cached annotation entries")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            cms_annotation_cache_size.set(self._size)
+
+    def _get_key(self, model_service: AbstractModelService, text_key: Tuple) -> Tuple:
+        # called with the lock held as invalidate() bumps the generation under it
+        service_id = id(model_service)
+        return (service_id, self._generations.get(service_id, 0), *text_key)
+
+    def _get_text_key(self, model_service: AbstractModelService, text: str) -> Tuple:
+        return (
+            str(model_service.model_version),
+            self._config.INCLUDE_SPAN_TEXT,
+            self._config.CONCAT_SIMILAR_ENTITIES,
+            self._config.TYPE_UNIQUE_ID_WHITELIST,
+            hashlib.sha256(text.encode("utf-8")).hexdigest(),
+        )
+
+    def _get(self, key: Tuple) -> Optional[bytes]:
+        serialised = self._entries.get(key)
+        if serialised is not None:
+            self._entries.move_to_end(key)
+            cms_annotation_cache_hits.inc()
+        return serialised
+
+    def _put(self, key: Tuple, serialised: bytes) -> None:
+        entry_size = len(serialised) + _ENTRY_OVERHEAD_BYTES
+        if entry_size > self._max_bytes or key[1] != self._generations.get(key[0], 0):
+            return
+        if key in self._entries:
+            self._size -= len(self._entries.pop(key)) + _ENTRY_OVERHEAD_BYTES
+        while self._entries and self._size + entry_size > self._max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted) + _ENTRY_OVERHEAD_BYTES
+            cms_annotation_cache_evictions.inc()
+        self._entries[key] = serialised
+        self._size += entry_size
+        cms_annotation_cache_size.set(self._size)
+
+    def _complete(self, key: Tuple, future: Future, serialised: bytes) -> None:
+        with self._lock:
+            self._put(key, serialised)
+            self._in_flight.pop(key, None)
+        future.set_result(serialised)
+
+    def _fail(self, key: Tuple, future: Future, exception: Exception) -> None:
+        with self._lock:
+            self._in_flight.pop(key, None)
+        future.set_exception(exception)
+
+    @staticmethod
+    def _serialise(annotations: List[Dict]) -> bytes:
+        return json.dumps(annotations, default=_to_json_native).encode("utf-8")
+
+
+def _to_json_native(obj: Any) -> Any:
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    return str(obj)
+
+
+@lru_cache()
+def get_annotation_cache() -> AnnotationCache:
+    config = get_settings()
+    return AnnotationCache(config.ANNOTATION_CACHE_MAX_BYTES, config)
@@ -0,0 +1,87 @@
+import json
+import logging
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, final
+from utils import get_rss_bytes
+
+logger = logging.getLogger("cms")
+
+
+def get_corpus(file_path: str) -> List[str]:
+    texts = []
+    with open(file_path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                line_obj = json.loads(line)
+                texts.append(line_obj["text"] if isinstance(line_obj, dict) else line.strip())
+            except (json.JSONDecodeError, KeyError):
+                texts.append(line.strip())
+    return texts
+
+
+def get_percentile(values: List[float], percentile: float) -> float:
+    if not values:
+        return 0.0
+    sorted_values = sorted(values)
+    return sorted_values[max(math.ceil(percentile / 100 * len(sorted_values)) - 1, 0)]
+
+
+@final
+class Benchmark(object):
+
+    def __init__(self, texts: List[str], concurrency: int = 1, repeats: int = 1, rss_sample_interval: float = 0.05) -> None:
+        if not texts:
+            raise ValueError("The benchmark corpus is empty")
+        self._texts = texts * max(repeats, 1)
+        self._concurrency = max(concurrency, 1)
+        self._rss_sample_interval = rss_sample_interval
+
+    def run(self, scenario: str, func: Callable[[List[str]], Any], batch_size: int = 1) -> Dict[str, float]:
+        batches = [self._texts[i:i + batch_size] for i in range(0, len(self._texts), max(batch_size, 1))]
+        latencies: List[float] = []
+        latencies_lock = threading.Lock()
+
+        def call(batch: List[str]) -> None:
+            start = time.perf_counter()
+            func(batch)
+            latency = time.perf_counter() - start
+            with latencies_lock:
+                latencies.append(latency)
+
+        peak_rss = [get_rss_bytes()]
+        sampled = threading.Event()
+
+        def sample_rss() -> None:
+            while not sampled.wait(self._rss_sample_interval):
+                peak_rss[0] = max(peak_rss[0], get_rss_bytes())
+
+        logger.info(f"Benchmarking {scenario} with {len(self._texts)} doc(s) in {len(batches)} call(s) and a concurrency of {self._concurrency}")
+        sampler = threading.Thread(target=sample_rss, name="cms-benchmark-rss", daemon=True)
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=self._concurrency, thread_name_prefix="cms-benchmark") as executor:
+                for future in [executor.submit(call, batch) for batch in batches]:
+                    future.result()
+        finally:
+            duration = time.perf_counter() - start
+            sampled.set()
+            sampler.join()
+        peak_rss[0] = max(peak_rss[0], get_rss_bytes())
+
+        return {
+            "docs": len(self._texts),
+            "calls": len(batches),
+            "duration_seconds": duration,
+            "docs_per_second": len(self._texts) / duration if duration else 0.0,
+            "chars_per_second": sum(len(text) for text in self._texts) / duration if duration else 0.0,
+            "latency_p50_seconds": get_percentile(latencies, 50),
+            "latency_p95_seconds": get_percentile(latencies, 95),
+            "latency_p99_seconds": get_percentile(latencies, 99),
+            "peak_rss_bytes": peak_rss[0],
+        }
@@ -0,0 +1,173 @@
+import logging
+import queue
+import threading
+from collections import deque
+from functools import lru_cache
+from typing import Deque, Dict, List, Optional, Tuple, final
+from utils import get_settings
+from management.prometheus_metrics import (
+    cms_avg_anno_acc_per_doc,
+    cms_avg_anno_acc_per_concept,
+    cms_avg_meta_anno_conf_per_doc,
+    cms_anno_acc_per_doc_quantile,
+    cms_meta_anno_conf_per_doc_quantile,
+)
+
+logger = logging.getLogger("cms")
+
+QUANTILES = (0.05, 0.5, 0.95)
+
+_DocSummary = Tuple[str, Optional[float], Optional[float], Tuple[Tuple[str, float], ...]]
+
+
+@final
+class SpaceSavingSketch(object):
+
+    def __init__(self, capacity: int) -> None:
+        self._capacity = max(capacity, 1)
+        self._counts: Dict[str, int] = {}
+        self._errors: Dict[str, int] = {}
+
+    def add(self, item: str) -> Optional[str]:
+        if item in self._counts:
+            self._counts[item] += 1
+            return None
+        if len(self._counts) < self._capacity:
+            self._counts[item] = 1
+            self._errors[item] = 0
+            return None
+        evicted = min(self._counts, key=self._counts.__getitem__)
+        min_count = self._counts.pop(evicted)
+        self._errors.pop(evicted)
+        self._counts[item] = min_count + 1
+        self._errors[item] = min_count
+        return evicted
+
+    def __contains__(self, item: str) -> bool:
+        return item in self._counts
+
+    def top(self, k: Optional[int] = None) -> List[Tuple[str, int, int]]:
+        items = sorted(self._counts.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(item, count, self._errors[item]) for item, count in items]
+
+
+class _HandlerWindow(object):
+
+    def __init__(self, window_size: int, top_k: int) -> None:
+        self.doc_accuracies: Deque[float] = deque(maxlen=window_size)
+        self.doc_meta_confidences: Deque[float] = deque(maxlen=window_size)
+        self.concepts = SpaceSavingSketch(top_k)
+        self.concept_accuracies: Dict[str, Tuple[float, int]] = {}
+        self.evicted_concepts: List[str] = []
+
+
+@final
+class QualityMetricsAggregator(object):
+
+    def __init__(self,
+                 window_size: int = 1000,
+                 interval_seconds: float = 5.0,
+                 top_k: int = 100,
+                 per_concept: bool = False,
+                 start: bool = True) -> None:
+        self._window_size = max(window_size, 1)
+        self._interval = interval_seconds
+        self._top_k = top_k
+        self._per_concept = per_concept
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._windows: Dict[str, _HandlerWindow] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        if start:
+            threading.Thread(target=self._run, name="cms-metrics-aggregator", daemon=True).start()
+
+    def record(self, handler: str, annotations: List[Dict]) -> None:
+        if not annotations:
+            return
+        doc_accuracy = None
+        concept_accuracies: Tuple[Tuple[str, float], ...] = ()
+        if annotations[0].get("accuracy", None) is not None:
+            accuracies = [annotation["accuracy"] for annotation in annotations]
+            doc_accuracy = sum(accuracies) / len(accuracies)
+            if self._per_concept:
+                concept_accuracies = tuple((annotation["label_id"], annotation["accuracy"]) for annotation in annotations)
+        doc_meta_confidence = None
+        if annotations[0].get("meta_anns", None):
+            confidences = [meta_value["confidence"] for annotation in annotations for meta_value in annotation["meta_anns"].values()]
+            doc_meta_confidence = sum(confidences) / len(confidences)
+        if doc_accuracy is not None or doc_meta_confidence is not None:
+            self._queue.put((handler, doc_accuracy, doc_meta_confidence, concept_accuracies))
+
+    def flush(self) -> None:
+        with self._lock:
+            updated = set()
+            while True:
+                try:
+                    summary: _DocSummary = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                self._aggregate(summary)
+                updated.add(summary[0])
+            for handler in updated:
+                self._export(handler, self._windows[handler])
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self._interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to aggregate annotation quality metrics")
+
+    def _aggregate(self, summary: _DocSummary) -> None:
+        handler, doc_accuracy, doc_meta_confidence, concept_accuracies = summary
+        window = self._windows.get(handler)
+        if window is None:
+            window = self._windows[handler] = _HandlerWindow(self._window_size, self._top_k)
+        if doc_accuracy is not None:
+            window.doc_accuracies.append(doc_accuracy)
+        if doc_meta_confidence is not None:
+            window.doc_meta_confidences.append(doc_meta_confidence)
+        for concept, accuracy in concept_accuracies:
+            evicted = window.concepts.add(concept)
+            if evicted is not None:
+                window.concept_accuracies.pop(evicted, None)
+                window.evicted_concepts.append(evicted)
+            accuracy_sum, count = window.concept_accuracies.get(concept, (0.0, 0))
+            window.concept_accuracies[concept] = (accuracy_sum + accuracy, count + 1)
+
+    @staticmethod
+    def _export(handler: str, window: _HandlerWindow) -> None:
+        if window.doc_accuracies:
+            cms_avg_anno_acc_per_doc.labels(handler=handler).set(sum(window.doc_accuracies) / len(window.doc_accuracies))
+            for quantile, value in zip(QUANTILES, _get_quantiles(window.doc_accuracies)):
+                cms_anno_acc_per_doc_quantile.labels(handler=handler, quantile=str(quantile)).set(value)
+        if window.doc_meta_confidences:
+            cms_avg_meta_anno_conf_per_doc.labels(handler=handler).set(sum(window.doc_meta_confidences) / len(window.doc_meta_confidences))
+            for quantile, value in zip(QUANTILES, _get_quantiles(window.doc_meta_confidences)):
+                cms_meta_anno_conf_per_doc_quantile.labels(handler=handler, quantile=str(quantile)).set(value)
+        for concept in window.evicted_concepts:
+            if concept not in window.concepts:
+                try:
+                    cms_avg_anno_acc_per_concept.remove(handler, concept)
+                except KeyError:
+                    pass
+        window.evicted_concepts.clear()
+        for concept, (accuracy_sum, count) in window.concept_accuracies.items():
+            cms_avg_anno_acc_per_concept.labels(handler=handler, concept=concept).set(accuracy_sum / count)
+
+
+def _get_quantiles(values: Deque[float]) -> List[float]:
+    ordered = sorted(values)
+    return [ordered[min(int(quantile * len(ordered)), len(ordered) - 1)] for quantile in QUANTILES]
+
+
+@lru_cache()
+def get_metrics_aggregator() -> QualityMetricsAggregator:
+    config = get_settings()
+    return QualityMetricsAggregator(window_size=config.METRICS_WINDOW_SIZE,
+                                    interval_seconds=config.METRICS_AGGREGATION_INTERVAL_SECONDS,
+                                    top_k=config.PER_CONCEPT_ACCURACIES_TOP_K,
+                                    per_concept=config.LOG_PER_CONCEPT_ACCURACIES == "true")
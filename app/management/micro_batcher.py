@@ -0,0 +1,152 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Any, Optional, Tuple, final
+from weakref import WeakKeyDictionary, ref
+from model_services.base import AbstractModelService
+from config import Settings
+from management.prometheus_metrics import (
+    cms_micro_batch_size,
+    cms_micro_batch_window,
+    cms_micro_batch_queue_wait,
+)
+
+logger = logging.getLogger("cms")
+
+
+@final
+class MicroBatcher(object):
+
+    def __init__(self,
+                 model_service: AbstractModelService,
+                 max_wait_ms: int = 10,
+                 max_docs: int = 32,
+                 max_chars: int = 100000) -> None:
+        self._model_service_ref = ref(model_service)
+        self._max_wait = max(max_wait_ms, 0) / 1000
+        self._max_docs = max(max_docs, 1)
+        self._max_chars = max(max_chars, 1)
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._carried_over: Optional[Tuple[str, Future, float]] = None
+        self._closed = False
+        self._closed_lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name="cms-micro-batcher", daemon=True)
+        self._worker.start()
+
+    def annotate(self, text: str) -> List[Dict[str, Any]]:
+        future: Future = Future()
+        with self._closed_lock:
+            if self._closed:
+                raise RuntimeError("The micro-batcher has been closed")
+            self._queue.put((text, future, time.perf_counter()))
+        return future.result()
+
+    def close(self) -> None:
+        with self._closed_lock:
+            if self._closed:
+                return
+            self._closed = True
+            # documents queued before the sentinel are still annotated
+            self._queue.put(None)
+
+    def _run(self) -> None:
+        stopped = False
+        while not stopped:
+            batch, stopped = self._collect_batch()
+            if batch:
+                self._process_batch(batch)
+
+    def _collect_batch(self) -> Tuple[List[Tuple[str, Future, float]], bool]:
+        if self._carried_over is not None:
+            first, self._carried_over = self._carried_over, None
+        else:
+            first = self._queue.get()
+            if first is None:
+                return [], True
+        batch = [first]
+        char_num = len(first[0])
+        window_start = time.perf_counter()
+        deadline = window_start + self._max_wait
+
+        while len(batch) < self._max_docs and char_num < self._max_chars:
+            timeout = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return self._observe_batch(batch, window_start), True
+            if char_num + len(item[0]) > self._max_chars:
+                self._carried_over = item
+                break
+            batch.append(item)
+            char_num += len(item[0])
+
+        return self._observe_batch(batch, window_start), False
+
+    def _observe_batch(self, batch: List[Tuple[str, Future, float]], window_start: float) -> List[Tuple[str, Future, float]]:
+        cms_micro_batch_window.observe(time.perf_counter() - window_start)
+        cms_micro_batch_size.observe(len(batch))
+        return batch
+
+    def _process_batch(self, batch: List[Tuple[str, Future, float]]) -> None:
+        dispatched_at = time.perf_counter()
+        futures = []
+        texts = []
+        for text, future, enqueued_at in batch:
+            cms_micro_batch_queue_wait.observe(dispatched_at - enqueued_at)
+            if future.set_running_or_notify_cancel():
+                texts.append(text)
+                futures.append(future)
+        if not futures:
+            return
+
+        try:
+            model_service = self._model_service_ref()
+            if model_service is None:
+                raise RuntimeError("The model service has been released")
+            elif len(texts) == 1:
+                annotations_list = [model_service.annotate(texts[0])]
+            else:
+                annotations_list = model_service.batch_annotate(texts)
+        except Exception as e:
+            logger.exception("Failed to annotate the micro-batch")
+            for future in futures:
+                future.set_exception(e)
+            return
+
+        if len(annotations_list) != len(futures):
+            error = RuntimeError(f"Expected {len(futures)} annotation lists but got {len(annotations_list)}")
+            for future in futures:
+                future.set_exception(error)
+            return
+
+        for future, annotations in zip(futures, annotations_list):
+            future.set_result(annotations)
+
+
+_micro_batchers: WeakKeyDictionary = WeakKeyDictionary()
+_micro_batchers_lock = threading.Lock()
+
+
+def get_micro_batcher(model_service: AbstractModelService, config: Settings) -> MicroBatcher:
+    with _micro_batchers_lock:
+        micro_batcher = _micro_batchers.get(model_service)
+        if micro_batcher is None:
+            micro_batcher = MicroBatcher(model_service,
+                                         max_wait_ms=config.MICRO_BATCH_MAX_WAIT_MS,
+                                         max_docs=config.MICRO_BATCH_MAX_DOCS,
+                                         max_chars=config.MICRO_BATCH_MAX_CHARS)
+            _micro_batchers[model_service] = micro_batcher
+            logger.info(f"Micro-batching enabled with a window of {config.MICRO_BATCH_MAX_WAIT_MS}ms, "
+                        f"up to {config.MICRO_BATCH_MAX_DOCS} documents or {config.MICRO_BATCH_MAX_CHARS} characters")
+        return micro_batcher
+
+
+def close_micro_batcher(model_service: AbstractModelService) -> None:
+    with _micro_batchers_lock:
+        micro_batcher = _micro_batchers.pop(model_service, None)
+    if micro_batcher is not None:
+        micro_batcher.close()
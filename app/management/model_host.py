@@ -0,0 +1,162 @@
+import gc
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, final
+from model_services.base import AbstractModelService
+from management.micro_batcher import close_micro_batcher
+from management.prometheus_metrics import cms_hosted_model_resident, cms_hosted_model_load_duration, cms_hosted_model_memory
+from config import Settings
+from registry import model_service_registry
+from utils import get_rss_bytes
+
+logger = logging.getLogger("cms")
+
+
+class _HostedModel(object):
+
+    def __init__(self, model_file_path: str, model_name: Optional[str]) -> None:
+        self.model_file_path = model_file_path
+        self.model_name = model_name
+        self.load_lock = threading.Lock()
+        self.model_service: Optional[AbstractModelService] = None
+        self.load_duration = 0.0
+        self.memory_bytes = 0
+        self.last_used = 0.0
+
+
+@final
+class ModelHost(object):
+
+    def __init__(self,
+                 config: Settings,
+                 memory_budget_bytes: int = 0,
+                 model_service_factory: Optional[Callable[[str, str, Optional[str]], AbstractModelService]] = None) -> None:
+        self._config = config
+        self._memory_budget = memory_budget_bytes
+        self._model_service_factory = model_service_factory or self._create_model_service
+        self._hosted: Dict[str, _HostedModel] = {}
+        self._resident: OrderedDict = OrderedDict()
+        self._leases: Dict[int, int] = {}
+        self._retired: Dict[int, AbstractModelService] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def model_types(self) -> List[str]:
+        return list(self._hosted.keys())
+
+    def register(self, model_type: str, model_file_path: str, model_name: Optional[str] = None) -> None:
+        self._hosted[model_type] = _HostedModel(model_file_path, model_name)
+        cms_hosted_model_resident.labels(model_type=model_type).set(0)
+
+    def get_model_service(self, model_type: str, lease: bool = False) -> AbstractModelService:
+        hosted = self._hosted[model_type]
+        with self._lock:
+            if hosted.model_service is not None:
+                return self._touch(model_type, hosted, lease)
+        with hosted.load_lock:
+            with self._lock:
+                if hosted.model_service is not None:
+                    return self._touch(model_type, hosted, lease)
+            model_service = self._load(model_type, hosted)
+            with self._lock:
+                hosted.model_service = model_service
+                self._touch(model_type, hosted, lease)
+                for evicted_type in self._get_evictable(model_type):
+                    self._resident.pop(evicted_type)
+                    evicted_service = self._unload(evicted_type, self._hosted[evicted_type])
+                    self._retired[id(evicted_service)] = evicted_service
+                closable = self._pop_closable()
+        self._close(closable)
+        return model_service
+
+    def release(self, model_service: AbstractModelService) -> None:
+        with self._lock:
+            key = id(model_service)
+            self._leases[key] -= 1
+            if self._leases[key] > 0:
+                return
+            del self._leases[key]
+            closable = self._pop_closable()
+        self._close(closable)
+
+    def close(self) -> None:
+        with self._lock:
+            model_services = [self._unload(model_type, hosted) for model_type, hosted in self._hosted.items() if hosted.model_service is not None]
+            model_services.extend(self._retired.values())
+            self._resident.clear()
+            self._retired.clear()
+        self._close(model_services)
+
+    def _touch(self, model_type: str, hosted: _HostedModel, lease: bool) -> AbstractModelService:
+        hosted.last_used = time.time()
+        self._resident[model_type] = hosted
+        self._resident.move_to_end(model_type)
+        if lease:
+            self._leases[id(hosted.model_service)] = self._leases.get(id(hosted.model_service), 0) + 1
+        closable = self._pop_closable() if self._retired else []
+        if closable:
+            threading.Thread(target=self._close, args=(closable,), name="cms-model-host-close", daemon=True).start()
+        return hosted.model_service
+
+    def _pop_closable(self) -> List[AbstractModelService]:
+        # evicted services are closed only after their last in-flight request and training finish
+        closable = [model_service for key, model_service in self._retired.items() if key not in self._leases and not model_service.training_in_progress]
+        for model_service in closable:
+            del self._retired[id(model_service)]
+        return closable
+
+    @staticmethod
+    def _close(model_services: List[AbstractModelService]) -> None:
+        for model_service in model_services:
+            close_micro_batcher(model_service)
+            model_service.close()
+        if model_services:
+            del model_services[:]
+            gc.collect()
+
+    def _load(self, model_type: str, hosted: _HostedModel) -> AbstractModelService:
+        logger.info(f"Loading the hosted model {model_type} from {hosted.model_file_path}")
+        rss_before = get_rss_bytes()
+        start = time.perf_counter()
+        model_service = self._model_service_factory(model_type, hosted.model_file_path, hosted.model_name)
+        hosted.load_duration = time.perf_counter() - start
+        hosted.memory_bytes = max(get_rss_bytes() - rss_before, 0)
+        cms_hosted_model_resident.labels(model_type=model_type).set(1)
+        cms_hosted_model_load_duration.labels(model_type=model_type).set(hosted.load_duration)
+        cms_hosted_model_memory.labels(model_type=model_type).set(hosted.memory_bytes)
+        logger.info(f"Hosted model {model_type} loaded in {hosted.load_duration:.2f} seconds taking about {hosted.memory_bytes / 1024 ** 2:.0f} MB")
+        return model_service
+
+    def _unload(self, model_type: str, hosted: _HostedModel) -> AbstractModelService:
+        model_service = hosted.model_service
+        hosted.model_service = None
+        cms_hosted_model_resident.labels(model_type=model_type).set(0)
+        cms_hosted_model_memory.labels(model_type=model_type).set(0)
+        logger.info(f"Hosted model {model_type} unloaded after being idle since {time.ctime(hosted.last_used)}")
+        return model_service
+
+    def _get_evictable(self, keep: str) -> List[str]:
+        if self._memory_budget <= 0:
+            return []
+        evictable = []
+        memory_used = sum(hosted.memory_bytes for hosted in self._resident.values())
+        for model_type, hosted in self._resident.items():
+            if memory_used <= self._memory_budget:
+                break
+            if model_type == keep:
+                continue
+            evictable.append(model_type)
+            memory_used -= hosted.memory_bytes
+        return evictable
+
+    def _create_model_service(self, model_type: str, model_file_path: str, model_name: Optional[str]) -> AbstractModelService:
+        model_service = model_service_registry[model_type](self._config,
+                                                           model_parent_dir=os.path.dirname(os.path.abspath(model_file_path)),
+                                                           base_model_file=os.path.basename(model_file_path))
+        if model_name is not None:
+            model_service.model_name = model_name
+        model_service.init_model()
+        return model_service
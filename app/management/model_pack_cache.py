@@ -0,0 +1,155 @@
+import glob
+import logging
+import mmap
+import os
+import pickle
+import shutil
+import struct
+import time
+from typing import Any, Callable, Dict, Optional, final
+from medcat import __version__ as medcat_version
+from medcat.cat import CAT
+from medcat.cdb import CDB
+from medcat.meta_cat import MetaCAT
+from medcat.ner.transformers_ner import TransformersNER
+from medcat.utils.saving.serializer import ONE2MANY, SPECIALITY_NAMES
+from medcat.vocab import Vocab
+from management.prometheus_metrics import cms_model_load_duration
+from utils import get_cached_file_sha256
+
+logger = logging.getLogger("cms")
+
+SNAPSHOT_MAGIC = b"CMSSNAP1"
+SNAPSHOT_ALIGNMENT = 64
+SNAPSHOT_MIN_BUFFER_BYTES = 1024
+
+
+def save_snapshot(obj: Any, snapshot_path: str) -> None:
+    buffers = []
+
+    def buffer_callback(buffer: pickle.PickleBuffer) -> bool:
+        if buffer.raw().nbytes < SNAPSHOT_MIN_BUFFER_BYTES:
+            return True
+        buffers.append(buffer)
+        return False
+
+    payload = pickle.dumps(obj, protocol=5, buffer_callback=buffer_callback)
+    header_size = len(SNAPSHOT_MAGIC) + 16 + 16 * len(buffers)
+    offset = _align(header_size + len(payload))
+    index = []
+    for buffer in buffers:
+        index.append((offset, buffer.raw().nbytes))
+        offset = _align(offset + buffer.raw().nbytes)
+
+    tmp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(struct.pack("<QQ", len(payload), len(buffers)))
+        for buffer_offset, buffer_size in index:
+            f.write(struct.pack("<QQ", buffer_offset, buffer_size))
+        f.write(payload)
+        for (buffer_offset, _), buffer in zip(index, buffers):
+            f.write(b"\0" * (buffer_offset - f.tell()))
+            f.write(buffer.raw())
+    os.replace(tmp_path, snapshot_path)
+
+
+def load_snapshot(snapshot_path: str) -> Any:
+    with open(snapshot_path, "rb") as f:
+        # pages are shared with the file until written to
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    view = memoryview(mapped)
+    if bytes(view[:len(SNAPSHOT_MAGIC)]) != SNAPSHOT_MAGIC:
+        raise ValueError(f"{snapshot_path} is not a model snapshot")
+    position = len(SNAPSHOT_MAGIC)
+    payload_size, buffer_num = struct.unpack_from("<QQ", view, position)
+    position += 16
+    buffers = []
+    for _ in range(buffer_num):
+        buffer_offset, buffer_size = struct.unpack_from("<QQ", view, position)
+        buffers.append(view[buffer_offset:buffer_offset + buffer_size])
+        position += 16
+    return pickle.loads(view[position:position + payload_size], buffers=buffers)
+
+
+@final
+class ModelPackCache(object):
+
+    def __init__(self, cache_dir: str) -> None:
+        self._cache_dir = os.path.abspath(cache_dir)
+
+    def get_unpacked_path(self, model_file_path: str) -> str:
+        unpacked_path = os.path.join(self._cache_dir, get_cached_file_sha256(model_file_path, self._cache_dir))
+        if os.path.isdir(unpacked_path):
+            logger.info(f"Found the unpacked model pack at {unpacked_path}")
+            return unpacked_path
+        os.makedirs(self._cache_dir, exist_ok=True)
+        tmp_path = f"{unpacked_path}.{os.getpid()}.tmp"
+        shutil.unpack_archive(model_file_path, extract_dir=tmp_path, format="zip")
+        try:
+            os.rename(tmp_path, unpacked_path)
+        except OSError:
+            # another process has unpacked the same model pack
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        logger.info(f"Model pack unpacked to {unpacked_path}")
+        return unpacked_path
+
+    def load_model_pack(self, model_file_path: str, meta_cat_config_dict: Optional[Dict] = None) -> CAT:
+        timings: Dict[str, float] = {}
+        model_pack_path = _timed(timings, "unpack", lambda: self.get_unpacked_path(model_file_path))
+
+        json_path = model_pack_path if len(glob.glob(os.path.join(model_pack_path, "*.json"))) >= len(SPECIALITY_NAMES) - len(ONE2MANY) else None
+        cdb = _timed(timings, "cdb", lambda: self._load_with_snapshot(model_pack_path, "cdb", lambda: CDB.load(os.path.join(model_pack_path, "cdb.dat"), json_path)))
+        cdb.config.general.spacy_model = os.path.join(model_pack_path, os.path.basename(cdb.config.general.spacy_model))
+
+        vocab_path = os.path.join(model_pack_path, "vocab.dat")
+        vocab = _timed(timings, "vocab", lambda: self._load_with_snapshot(model_pack_path, "vocab", lambda: Vocab.load(vocab_path))) if os.path.exists(vocab_path) else None
+
+        def load_addl_ners() -> list:
+            addl_ners = []
+            for path in sorted(os.listdir(model_pack_path)):
+                if path.startswith("trf_"):
+                    addl_ner = TransformersNER.load(save_dir_path=os.path.join(model_pack_path, path))
+                    addl_ner.cdb = cdb
+                    addl_ners.append(addl_ner)
+            return addl_ners
+
+        def load_meta_cats() -> list:
+            return [MetaCAT.load(save_dir_path=os.path.join(model_pack_path, path), config_dict=meta_cat_config_dict)
+                    for path in sorted(os.listdir(model_pack_path)) if path.startswith("meta_")]
+
+        addl_ner = _timed(timings, "addl_ner", load_addl_ners)
+        meta_cats = _timed(timings, "meta_cat", load_meta_cats)
+        cat = _timed(timings, "pipeline", lambda: CAT(cdb=cdb, config=cdb.config, vocab=vocab, meta_cats=meta_cats, addl_ner=addl_ner))
+
+        logger.info(f"Model pack loaded from {os.path.normpath(model_file_path)} in {sum(timings.values()):.2f} seconds "
+                    f"({', '.join(f'{phase}: {duration:.2f}s' for phase, duration in timings.items())})")
+        return cat
+
+    @staticmethod
+    def _load_with_snapshot(model_pack_path: str, name: str, load: Callable[[], Any]) -> Any:
+        snapshot_path = os.path.join(model_pack_path, f"{name}.medcat-{medcat_version}.snapshot")
+        if os.path.exists(snapshot_path):
+            try:
+                return load_snapshot(snapshot_path)
+            except Exception:
+                logger.exception(f"Failed to load the snapshot at {snapshot_path} and the original file will be loaded instead")
+        obj = load()
+        try:
+            save_snapshot(obj, snapshot_path)
+            logger.info(f"Snapshot saved to {snapshot_path}")
+        except Exception:
+            logger.exception(f"Failed to save the snapshot to {snapshot_path}")
+        return obj
+
+
+def _timed(timings: Dict[str, float], phase: str, func: Callable[[], Any]) -> Any:
+    start = time.perf_counter()
+    result = func()
+    timings[phase] = time.perf_counter() - start
+    cms_model_load_duration.labels(phase=phase).set(timings[phase])
+    return result
+
+
+def _align(offset: int) -> int:
+    return -(-offset // SNAPSHOT_ALIGNMENT) * SNAPSHOT_ALIGNMENT
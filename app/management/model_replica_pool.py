@@ -0,0 +1,366 @@
+import atexit
+import gc
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+from functools import partial
+from multiprocessing.connection import Connection
+from multiprocessing.process import BaseProcess
+from typing import Any, Callable, Dict, List, Optional, Tuple, final
+from model_services.base import AbstractModelService
+from domain import ModelCard
+from management.annotation_cache import get_annotation_cache
+from management.prometheus_metrics import cms_model_worker_restarts
+
+logger = logging.getLogger("cms")
+
+_WORKER_LOST = object()
+
+
+class _Worker(object):
+
+    def __init__(self, process: BaseProcess, conn: Connection, generation: int) -> None:
+        self.process = process
+        self.conn = conn
+        self.generation = generation
+        self.busy = False
+        self.retired = False
+
+
+@final
+class ModelReplicaPool(AbstractModelService):
+
+    def __init__(self,
+                 model_service: AbstractModelService,
+                 worker_num: int,
+                 health_check_interval: float = 5.0,
+                 call_timeout: Optional[float] = None) -> None:
+        self._model_service = model_service
+        self._config = model_service.service_config
+        self._worker_num = max(worker_num, 1)
+        self._call_timeout = call_timeout if call_timeout is not None else float(self._config.MODEL_WORKER_TIMEOUT_SECONDS)
+        self._context = multiprocessing.get_context("fork")
+        self._lock = threading.RLock()
+        self._idle: queue.Queue = queue.Queue()
+        self._workers: List[_Worker] = []
+        self._generation = 0
+        self._forked_model: Any = None
+        self._closed = False
+        self._controls: queue.Queue = queue.Queue()
+        with self._lock:
+            self._fork_workers()
+        # workers are (re)forked only by the supervisor so that forks never race with request threads
+        self._supervisor = threading.Thread(target=self._supervise, args=(health_check_interval,), name="cms-replica-supervisor", daemon=True)
+        self._supervisor.start()
+        atexit.register(self.close)
+
+    @property
+    def model_service(self) -> AbstractModelService:
+        return self._model_service
+
+    @property
+    def model(self) -> Any:
+        return getattr(self._model_service, "model", None)
+
+    @model.setter
+    def model(self, model: Any) -> None:
+        setattr(self._model_service, "model", model)
+        self._refresh_if_model_changed()
+
+    @property
+    def model_name(self) -> str:
+        return self._model_service.model_name
+
+    @model_name.setter
+    def model_name(self, model_name: str) -> None:
+        self._model_service.model_name = model_name
+
+    @property
+    def model_version(self) -> str:
+        return self._model_service.model_version
+
+    @property
+    def training_in_progress(self) -> bool:
+        return self._model_service.training_in_progress
+
+    @staticmethod
+    def load_model(model_file_path: str, *args: Tuple, **kwargs: Dict[str, Any]) -> Any:
+        raise NotImplementedError("Load the model with the model service being replicated")
+
+    def info(self) -> ModelCard:
+        return self._model_service.info()
+
+    def init_model(self) -> None:
+        self._model_service.init_model()
+        self._refresh_if_model_changed()
+
+    def annotate(self, text: str) -> List[Dict[str, Any]]:
+        return self._call("annotate", text)
+
+    def batch_annotate(self, texts: List[str]) -> List[List[Dict[str, Any]]]:
+        if len(texts) <= 1:
+            return self._call("batch_annotate", texts) if texts else []
+
+        workers = [self._acquire()]
+        while len(workers) < min(len(texts), self._worker_num):
+            try:
+                workers.append(self._acquire(block=False))
+            except queue.Empty:
+                break
+        shards = _get_shards(texts, len(workers))
+
+        results: List[Any] = []
+        for worker, shard in zip(workers, shards):
+            try:
+                worker.conn.send(("batch_annotate", (shard,)))
+                results.append(None)
+            except (OSError, ValueError):
+                results.append(_WORKER_LOST)
+        for idx, worker in enumerate(workers):
+            if results[idx] is None:
+                try:
+                    results[idx] = self._recv(worker)
+                except (EOFError, OSError):
+                    results[idx] = _WORKER_LOST
+                except TimeoutError as e:
+                    results[idx] = (False, e)
+                    self._replace(worker)
+                    continue
+            if results[idx] is _WORKER_LOST:
+                self._replace(worker)
+            else:
+                self._release(worker)
+
+        annotations_list = []
+        for shard, result in zip(shards, results):
+            if result is _WORKER_LOST:
+                annotations_list.extend(self._call("batch_annotate", shard))
+            elif not result[0]:
+                raise result[1]
+            else:
+                annotations_list.extend(result[1])
+        return annotations_list
+
+    def warm_up(self, texts: List[str]) -> Dict[str, float]:
+        workers = [self._acquire() for _ in range(self._worker_num)]
+        sent = []
+        for worker in workers:
+            try:
+                worker.conn.send(("warm_up", (texts,)))
+                sent.append(worker)
+            except (OSError, ValueError):
+                self._replace(worker)
+
+        timings: Dict[str, float] = {}
+        error = None
+        for worker in sent:
+            try:
+                succeeded, result = self._recv(worker)
+            except (EOFError, OSError, TimeoutError):
+                self._replace(worker)
+                continue
+            self._release(worker)
+            if not succeeded:
+                error = result
+                continue
+            for phase, duration in result.items():
+                timings[phase] = max(timings.get(phase, 0.0), duration)
+        if error is not None:
+            raise error
+        return timings
+
+    def train_supervised(self, *args: Tuple, **kwargs: Dict[str, Any]) -> bool:
+        return self._model_service.train_supervised(*args, **kwargs)
+
+    def train_unsupervised(self, *args: Tuple, **kwargs: Dict[str, Any]) -> bool:
+        return self._model_service.train_unsupervised(*args, **kwargs)
+
+    def train_metacat(self, *args: Tuple, **kwargs: Dict[str, Any]) -> bool:
+        return self._model_service.train_metacat(*args, **kwargs)
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            for worker in self._workers:
+                self._terminate(worker)
+            self._workers.clear()
+        self._controls.put(None)
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("__") or name == "_model_service":
+            raise AttributeError(name)
+        return getattr(self._model_service, name)
+
+    def _call(self, method: str, *args: Any, retried: bool = False) -> Any:
+        worker = self._acquire()
+        try:
+            worker.conn.send((method, args))
+            succeeded, result = self._recv(worker)
+        except TimeoutError:
+            self._replace(worker)
+            raise
+        except (EOFError, OSError, ValueError):
+            self._replace(worker)
+            if retried:
+                raise RuntimeError("The model worker exited unexpectedly")
+            return self._call(method, *args, retried=True)
+        self._release(worker)
+        if not succeeded:
+            raise result
+        return result
+
+    def _acquire(self, block: bool = True) -> _Worker:
+        self._refresh_if_model_changed()
+        while True:
+            worker = self._idle.get(block=block)
+            if worker.retired:
+                continue
+            if not worker.process.is_alive():
+                self._replace(worker)
+                continue
+            worker.busy = True
+            return worker
+
+    def _release(self, worker: _Worker) -> None:
+        worker.busy = False
+        if worker.retired:
+            self._terminate(worker)
+        else:
+            self._idle.put(worker)
+
+    def _replace(self, worker: _Worker) -> None:
+        with self._lock:
+            worker.busy = False
+            if worker.retired:
+                self._terminate(worker)
+                return
+            worker.retired = True
+            self._terminate(worker)
+            if worker in self._workers:
+                self._workers.remove(worker)
+            if self._closed or worker.generation != self._generation:
+                return
+            logger.warning(f"Restarting the model worker {worker.process.pid} (exit code: {worker.process.exitcode})")
+            cms_model_worker_restarts.inc()
+        self._control(partial(self._refork_worker, worker.generation))
+
+    def _refork_worker(self, generation: int) -> None:
+        with self._lock:
+            if not self._closed and generation == self._generation:
+                self._fork_worker()
+
+    def _refresh_if_model_changed(self) -> None:
+        if self.model is self._forked_model or self._closed:
+            return
+        self._control(self._refresh, wait=True)
+
+    def _refresh(self) -> None:
+        with self._lock:
+            if self.model is self._forked_model or self._closed:
+                return
+            logger.info("The model being served has changed and model workers will be re-forked")
+            for worker in self._workers:
+                worker.retired = True
+                if not worker.busy:
+                    self._terminate(worker)
+            self._workers.clear()
+            self._generation += 1
+            self._fork_workers()
+        get_annotation_cache().invalidate(self)
+
+    def _fork_workers(self) -> None:
+        self._forked_model = self.model
+        if self._generation > 0:
+            # let the previous model be collected now that workers sharing it are retired
+            gc.unfreeze()
+        # the loaded model is moved to the permanent generation to stay shared with the workers
+        gc.collect()
+        gc.freeze()
+        for _ in range(self._worker_num):
+            self._fork_worker()
+        logger.info(f"Forked {self._worker_num} model worker(s) sharing the loaded model")
+
+    def _fork_worker(self) -> None:
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=_serve, args=(self._model_service, child_conn), name="cms-model-worker")
+        process.start()
+        child_conn.close()
+        worker = _Worker(process, parent_conn, self._generation)
+        self._workers.append(worker)
+        self._idle.put(worker)
+
+    def _control(self, action: Callable[[], None], wait: bool = False) -> None:
+        if threading.current_thread() is self._supervisor:
+            action()
+            return
+        done = threading.Event()
+        self._controls.put((action, done))
+        while wait and not done.wait(1) and not self._closed:
+            pass
+
+    def _supervise(self, interval: float) -> None:
+        while not self._closed:
+            try:
+                control = self._controls.get(timeout=interval)
+            except queue.Empty:
+                with self._lock:
+                    dead_workers = [worker for worker in self._workers if not worker.busy and not worker.process.is_alive()]
+                for worker in dead_workers:
+                    self._replace(worker)
+                continue
+            if control is None:
+                break
+            action, done = control
+            try:
+                action()
+            except Exception:
+                logger.exception("Failed to fork model workers")
+            finally:
+                done.set()
+
+    def _recv(self, worker: _Worker) -> Any:
+        if self._call_timeout > 0 and not worker.conn.poll(self._call_timeout):
+            logger.error(f"The model worker {worker.process.pid} did not respond in {self._call_timeout} seconds and will be restarted")
+            raise TimeoutError(f"The model worker did not respond in {self._call_timeout} seconds")
+        return worker.conn.recv()
+
+    @staticmethod
+    def _terminate(worker: _Worker) -> None:
+        worker.conn.close()
+        if worker.process.is_alive():
+            worker.process.terminate()
+        worker.process.join(timeout=1)
+
+
+def _serve(model_service: AbstractModelService, conn: Connection) -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while True:
+        try:
+            method, args = conn.recv()
+        except (EOFError, OSError):
+            break
+        try:
+            result: Tuple[bool, Any] = (True, getattr(model_service, method)(*args))
+        except Exception as e:
+            result = (False, e)
+        try:
+            conn.send(result)
+        except Exception as e:
+            conn.send((False, RuntimeError(f"Failed to return the result of {method}: {e}")))
+
+
+def _get_shards(texts: List[str], shard_num: int) -> List[List[str]]:
+    char_budget = sum(len(text) for text in texts) / shard_num
+    shards: List[List[str]] = [[]]
+    char_num = 0
+    for idx, text in enumerate(texts):
+        remaining_texts = len(texts) - idx
+        remaining_shards = shard_num - len(shards)
+        if shards[-1] and remaining_shards > 0 and (char_num >= char_budget or remaining_texts <= remaining_shards):
+            shards.append([])
+            char_num = 0
+        shards[-1].append(text)
+        char_num += len(text)
+    return shards
@@ -0,0 +1,87 @@
+import gc
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, final
+from model_services.base import AbstractModelService
+from management.prometheus_metrics import cms_model_swap_duration, cms_model_warm_up_duration
+
+logger = logging.getLogger("cms")
+
+
+@final
+class ModelSwapper(object):
+
+    def __init__(self, release_timeout: float = 300.0) -> None:
+        self._refs: Dict[int, int] = {}
+        self._retired: Dict[int, Any] = {}
+        self._release_timeout = release_timeout
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+        self._swap_lock = threading.Lock()
+        self._local = threading.local()
+
+    def get_model(self, default: Any) -> Any:
+        leased = getattr(self._local, "model", None)
+        return default if leased is None else leased
+
+    @contextmanager
+    def lease(self, model_service: AbstractModelService) -> Iterator[None]:
+        if getattr(self._local, "model", None) is not None:
+            yield
+            return
+        with self._lock:
+            model = getattr(model_service, "model")
+            self._refs[id(model)] = self._refs.get(id(model), 0) + 1
+        self._local.model = model
+        try:
+            yield
+        finally:
+            self._local.model = None
+            self._release(model)
+
+    def swap(self,
+             model_service: AbstractModelService,
+             model: Any,
+             warm_up_service: AbstractModelService,
+             warm_up_texts: List[str]) -> Dict[str, float]:
+        with self._swap_lock:
+            start = time.perf_counter()
+            warm_up_duration = sum(warm_up_service.warm_up(warm_up_texts).values())
+            cms_model_warm_up_duration.observe(warm_up_duration)
+            logger.info(f"The new model was warmed up with {len(warm_up_texts)} text(s) in {warm_up_duration:.3f} seconds")
+
+            with self._lock:
+                previous_model = getattr(model_service, "model")
+                setattr(model_service, "model", model)
+                in_flight = self._refs.get(id(previous_model), 0)
+                if in_flight:
+                    self._retired[id(previous_model)] = previous_model
+            swap_duration = time.perf_counter() - start
+            cms_model_swap_duration.observe(swap_duration)
+
+            logger.info(f"Model swapped in {swap_duration:.3f} seconds")
+            if in_flight:
+                # the previous model is collected here rather than on the thread serving its last in-flight call
+                logger.info(f"The previous model will be released after {in_flight} in-flight call(s) finish")
+                key = id(previous_model)
+                with self._released:
+                    if not self._released.wait_for(lambda: key not in self._retired, self._release_timeout):
+                        logger.warning(f"In-flight calls did not finish within {self._release_timeout} seconds and the previous model will be released once they finish")
+            del previous_model
+            gc.collect()
+        return {
+            "model_warm_up_duration_seconds": warm_up_duration,
+            "model_swap_duration_seconds": swap_duration,
+        }
+
+    def _release(self, model: Any) -> None:
+        with self._lock:
+            key = id(model)
+            self._refs[key] -= 1
+            if self._refs[key] > 0:
+                return
+            del self._refs[key]
+            if self._retired.pop(key, None) is not None:
+                self._released.notify_all()
@@ -0,0 +1,125 @@
+import os
+import glob
+import logging
+import numpy as np
+import torch
+from typing import Any, Optional, final
+from transformers import PreTrainedModel, PreTrainedTokenizerBase
+from transformers.modeling_outputs import TokenClassifierOutput
+from config import Settings
+from utils import get_cached_file_sha256
+
+logger = logging.getLogger("cms")
+
+PARITY_CHECK_TEXT = "Mr John Smith (NHS number 943 476 5919) was seen by Dr Jones at 12 High Street, London NW1 2DA on 12/03/2020."
+
+
+@final
+class OnnxTokenClassificationModel(object):
+
+    def __init__(self, session: Any, model: PreTrainedModel) -> None:
+        self._session = session
+        self._model = model
+        self._input_names = [session_input.name for session_input in session.get_inputs()]
+
+    @property
+    def model(self) -> PreTrainedModel:
+        return self._model
+
+    def __call__(self,
+                 input_ids: torch.Tensor,
+                 attention_mask: Optional[torch.Tensor] = None,
+                 **kwargs: Any) -> TokenClassifierOutput:
+        inputs = {"input_ids": input_ids, "attention_mask": attention_mask, **kwargs}
+        feeds = {name: inputs[name].cpu().numpy().astype(np.int64) for name in self._input_names if inputs.get(name) is not None}
+        logits = self._session.run(["logits"], feeds)[0]
+        return TokenClassifierOutput(logits=torch.from_numpy(logits))
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("__") or name in ("_session", "_model", "_input_names"):
+            raise AttributeError(name)
+        return getattr(self._model, name)
+
+
+class _LogitsOnly(torch.nn.Module):
+
+    def __init__(self, model: PreTrainedModel) -> None:
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        return self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+
+
+def is_onnx_runtime_applicable(config: Settings) -> bool:
+    return config.ENABLE_ONNX_RUNTIME == "true" and not config.DEVICE.startswith(("cuda", "mps"))
+
+
+def get_onnx_model_path(model_file_path: str, model_name: str, hash_cache_dir: Optional[str] = None) -> str:
+    model_file_stem = os.path.splitext(model_file_path)[0]
+    sha256 = get_cached_file_sha256(model_file_path, hash_cache_dir or os.path.dirname(os.path.abspath(model_file_path)))
+    return f"{model_file_stem}.{sha256[:16]}.{model_name}.onnx"
+
+
+def export_token_classification_model(model: PreTrainedModel, tokenizer: PreTrainedTokenizerBase, onnx_model_path: str) -> None:
+    sample = tokenizer(PARITY_CHECK_TEXT, return_tensors="pt")
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in ["input_ids", "attention_mask", "logits"]}
+    tmp_model_path = f"{onnx_model_path}.{os.getpid()}.tmp"
+    with torch.inference_mode():
+        torch.onnx.export(_LogitsOnly(model.cpu().eval()),
+                          (sample["input_ids"], sample["attention_mask"]),
+                          tmp_model_path,
+                          input_names=["input_ids", "attention_mask"],
+                          output_names=["logits"],
+                          dynamic_axes=dynamic_axes,
+                          opset_version=14)
+    os.replace(tmp_model_path, onnx_model_path)
+    logger.info(f"Exported the token classification model to {onnx_model_path}")
+
+
+def get_onnx_model(model: PreTrainedModel,
+                   tokenizer: PreTrainedTokenizerBase,
+                   model_file_path: str,
+                   model_name: str,
+                   config: Settings,
+                   overwrite: bool = False) -> Optional[OnnxTokenClassificationModel]:
+    try:
+        import onnxruntime as ort
+    except ImportError:
+        logger.warning("ONNX Runtime is not installed and the PyTorch backend will be used")
+        return None
+
+    try:
+        # the hash of the model pack shares the sidecar with the model pack cache when it is enabled
+        onnx_model_path = get_onnx_model_path(model_file_path, model_name, config.MODEL_PACK_CACHE_DIR or None)
+        if overwrite or not os.path.exists(onnx_model_path):
+            for stale_model_path in glob.glob(f"{os.path.splitext(model_file_path)[0]}.*.{model_name}.onnx"):
+                os.remove(stale_model_path)
+            export_token_classification_model(model, tokenizer, onnx_model_path)
+        session_options = ort.SessionOptions()
+        session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if config.ONNX_INTRA_OP_THREADS > 0:
+            session_options.intra_op_num_threads = config.ONNX_INTRA_OP_THREADS
+        session = ort.InferenceSession(onnx_model_path, sess_options=session_options, providers=["CPUExecutionProvider"])
+        onnx_model = OnnxTokenClassificationModel(session, model)
+        if not has_prediction_parity(model, onnx_model, tokenizer):
+            logger.warning("Predictions from ONNX Runtime differ from those from PyTorch and the PyTorch backend will be used")
+            return None
+    except Exception:
+        logger.exception("Failed to set up ONNX Runtime and the PyTorch backend will be used")
+        return None
+    logger.info(f"The token classification model will be run with ONNX Runtime from {onnx_model_path}")
+    return onnx_model
+
+
+def has_prediction_parity(model: PreTrainedModel,
+                          onnx_model: OnnxTokenClassificationModel,
+                          tokenizer: PreTrainedTokenizerBase,
+                          text: str = PARITY_CHECK_TEXT) -> bool:
+    sample = tokenizer(text, return_tensors="pt")
+    with torch.inference_mode():
+        expected = model(input_ids=sample["input_ids"], attention_mask=sample["attention_mask"]).logits
+    actual = onnx_model(sample["input_ids"], sample["attention_mask"]).logits
+    max_diff = (expected - actual).abs().max().item()
+    logger.debug(f"The maximum absolute difference between PyTorch and ONNX Runtime logits is {max_diff}")
+    return bool(torch.equal(expected.argmax(dim=-1), actual.argmax(dim=-1)))
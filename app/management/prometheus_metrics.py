@@ -1,7 +1,30 @@
-from prometheus_client import Histogram, Gauge
+from prometheus_client import Histogram, Gauge, Counter
 
 cms_doc_annotations = Histogram("cms_doc_annotations", "Number of annotations extracted from a document", ["handler"])
 cms_avg_anno_acc_per_doc = Gauge("cms_avg_anno_acc_per_doc", "The average accuracy of annotations extracted from a document", ["handler"])
 cms_avg_anno_acc_per_concept = Gauge("cms_avg_anno_acc_per_concept", "The average accuracy of annotations for a specific concept", ["handler", "concept"])
 cms_avg_meta_anno_conf_per_doc = Gauge("cms_avg_meta_anno_conf_per_doc", "The average confidence of meta annotations extracted from a document", ["handler"])
+cms_anno_acc_per_doc_quantile = Gauge("cms_anno_acc_per_doc_quantile", "The quantile of the average annotation accuracy per document over the recent window", ["handler", "quantile"])
+cms_meta_anno_conf_per_doc_quantile = Gauge("cms_meta_anno_conf_per_doc_quantile", "The quantile of the average meta annotation confidence per document over the recent window", ["handler", "quantile"])
 cms_bulk_processed_docs = Histogram("cms_bulk_processed_docs", "Number of bulk-processed documents", ["handler"])
+cms_micro_batch_size = Histogram("cms_micro_batch_size", "Number of documents coalesced into a micro-batch", buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+cms_micro_batch_window = Histogram("cms_micro_batch_window_seconds", "Time for which a micro-batch window was kept open", buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+cms_micro_batch_queue_wait = Histogram("cms_micro_batch_queue_wait_seconds", "Time a document waited in the queue before its micro-batch was dispatched", buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+cms_annotation_cache_hits = Counter("cms_annotation_cache_hits", "Number of annotation requests served from the cache or a shared in-flight computation")
+cms_annotation_cache_misses = Counter("cms_annotation_cache_misses", "Number of annotation requests not found in the cache")
+cms_annotation_cache_evictions = Counter("cms_annotation_cache_evictions", "Number of entries evicted from the annotation cache")
+cms_annotation_cache_size = Gauge("cms_annotation_cache_size_bytes", "Estimated size of the annotation cache in bytes")
+cms_model_worker_restarts = Counter("cms_model_worker_restarts", "Number of model worker processes restarted after exiting unexpectedly")
+cms_batch_pool_utilisation = Gauge("cms_batch_pool_utilisation", "Ratio of busy workers in the batch annotation pool")
+cms_batch_annotation_duration = Histogram("cms_batch_annotation_duration_seconds", "Time taken to annotate a batch of documents with the worker pool", buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0))
+cms_batch_annotation_shards = Histogram("cms_batch_annotation_shards", "Number of shards a batch of documents was split into", buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+cms_auth_duration = Histogram("cms_auth_duration_seconds", "Time taken to authenticate a request with a bearer token", ["cache"], buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1))
+cms_model_warm_up_duration = Histogram("cms_model_warm_up_duration_seconds", "Time taken to warm up a model before it takes traffic", buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0))
+cms_model_swap_duration = Histogram("cms_model_swap_duration_seconds", "Time taken to warm up and swap in a new model", buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0))
+cms_model_load_duration = Gauge("cms_model_load_duration_seconds", "Time taken by each phase of the latest model pack load", ["phase"])
+cms_start_up_warm_up_duration = Gauge("cms_start_up_warm_up_duration_seconds", "Time taken by each phase of warming up the model on start-up", ["phase"])
+cms_hosted_model_resident = Gauge("cms_hosted_model_resident", "Whether a hosted model is loaded in memory", ["model_type"])
+cms_hosted_model_load_duration = Gauge("cms_hosted_model_load_duration_seconds", "Time taken by the latest load of a hosted model", ["model_type"])
+cms_hosted_model_memory = Gauge("cms_hosted_model_memory_bytes", "Estimated memory taken by a resident hosted model", ["model_type"])
+cms_stage_latency = Histogram("cms_stage_latency_seconds", "Time spent by a request in each stage of the annotation pipeline", ["handler", "stage"], buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+cms_model_quantisation = Gauge("cms_model_quantisation", "Size, annotation latency and F1 of a model measured before and after dynamic quantisation", ["model", "measure"])
@@ -0,0 +1,91 @@
+import io
+import logging
+import time
+import torch
+from typing import Any, Dict, List, Optional, Tuple
+from model_services.base import AbstractModelService
+from management.prometheus_metrics import cms_model_quantisation
+from processors.metrics_collector import sanity_check_model_with_trainer_export
+from config import Settings
+
+logger = logging.getLogger("cms")
+
+LATENCY_CHECK_TEXT = "Mr John Smith was seen at the clinic on 12/03/2020 with chest pain and shortness of breath and was started on aspirin."
+QUANTISABLE_MODULE_TYPES = {torch.nn.Linear, torch.nn.LSTM, torch.nn.GRU}
+
+
+def is_quantisation_applicable(config: Settings) -> bool:
+    return config.ENABLE_DYNAMIC_QUANTISATION == "true" and not config.DEVICE.startswith(("cuda", "mps"))
+
+
+def get_module_size(module: torch.nn.Module) -> int:
+    buffer = io.BytesIO()
+    torch.save(module.state_dict(), buffer)
+    return buffer.tell()
+
+
+def apply_dynamic_quantisation(model_service: AbstractModelService,
+                               targets: List[Tuple[Any, str]],
+                               config: Settings,
+                               latency_check_repeats: int = 3) -> Optional[Dict[str, float]]:
+    originals = [(owner, name, getattr(owner, name)) for owner, name in targets if isinstance(getattr(owner, name), torch.nn.Module)]
+    if not originals:
+        logger.warning("No networks were found for dynamic quantisation")
+        return None
+    modules = {id(module): module for _, _, module in originals}
+
+    size_before = sum(get_module_size(module) for module in modules.values())
+    latency_before = _get_latency(model_service, latency_check_repeats)
+    f1_before = _get_f1(model_service, config.QUANTISATION_SANITY_CHECK_EXPORT)
+
+    quantised_modules = {module_id: torch.ao.quantization.quantize_dynamic(module, QUANTISABLE_MODULE_TYPES, dtype=torch.qint8)
+                         for module_id, module in modules.items()}
+    for owner, name, module in originals:
+        setattr(owner, name, quantised_modules[id(module)])
+
+    size_after = sum(get_module_size(module) for module in quantised_modules.values())
+    latency_after = _get_latency(model_service, latency_check_repeats)
+    f1_after = _get_f1(model_service, config.QUANTISATION_SANITY_CHECK_EXPORT)
+    report = {
+        "size_before_mb": size_before / 1024 ** 2,
+        "size_after_mb": size_after / 1024 ** 2,
+        "latency_before_ms": latency_before * 1000,
+        "latency_after_ms": latency_after * 1000,
+    }
+    logger.info(f"Dynamic int8 quantisation changed the size of {len(modules)} network(s) from {report['size_before_mb']:.1f} MB "
+                f"to {report['size_after_mb']:.1f} MB and the annotation latency from {report['latency_before_ms']:.1f} ms "
+                f"to {report['latency_after_ms']:.1f} ms")
+
+    if f1_before is not None and f1_after is not None:
+        report["f1_before"] = f1_before
+        report["f1_after"] = f1_after
+        if f1_before - f1_after > config.QUANTISATION_MAX_F1_DROP:
+            logger.warning(f"Dynamic quantisation dropped F1 from {f1_before:.4f} to {f1_after:.4f} which exceeds the tolerance "
+                           f"of {config.QUANTISATION_MAX_F1_DROP} and the original networks will be used")
+            for owner, name, module in originals:
+                setattr(owner, name, module)
+            _send_report(model_service, report, applied=False)
+            return None
+        logger.info(f"Dynamic quantisation changed F1 from {f1_before:.4f} to {f1_after:.4f}")
+    _send_report(model_service, report, applied=True)
+    return report
+
+
+def _send_report(model_service: AbstractModelService, report: Dict[str, float], applied: bool) -> None:
+    for measure, value in {**report, "applied": float(applied)}.items():
+        cms_model_quantisation.labels(model=model_service.model_name, measure=measure).set(value)
+
+
+def _get_latency(model_service: AbstractModelService, repeats: int) -> float:
+    model_service.annotate(LATENCY_CHECK_TEXT)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        model_service.annotate(LATENCY_CHECK_TEXT)
+    return (time.perf_counter() - start) / max(repeats, 1)
+
+
+def _get_f1(model_service: AbstractModelService, trainer_export_path: str) -> Optional[float]:
+    if not trainer_export_path:
+        return None
+    _, _, f1, *_ = sanity_check_model_with_trainer_export(trainer_export_path, model_service)
+    return f1
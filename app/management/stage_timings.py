@@ -0,0 +1,113 @@
+import threading
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar, Token
+from typing import Any, Callable, ContextManager, Dict, List, Optional, TypeVar, final
+
+STAGE_QUEUEING = "queueing"
+STAGE_NER_LINKING = "ner_linking"
+STAGE_META_CAT = "meta_cat"
+STAGE_RECORDS = "get_records_from_doc"
+STAGE_VALIDATION = "validation"
+STAGE_SERIALISATION = "serialisation"
+
+T = TypeVar("T")
+
+
+@final
+class StageTimings(object):
+
+    def __init__(self) -> None:
+        self._durations: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def durations(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._durations)
+
+    def add(self, stage: str, duration: float) -> None:
+        with self._lock:
+            self._durations[stage] = self._durations.get(stage, 0.0) + duration
+
+    def enter(self, stage: str) -> None:
+        # time spent in a nested stage is not counted towards the enclosing one
+        stack = self._get_stack()
+        now = time.perf_counter()
+        if stack:
+            self.add(stack[-1][0], now - stack[-1][1])
+        stack.append([stage, now])
+
+    def exit(self) -> None:
+        stack = self._get_stack()
+        now = time.perf_counter()
+        stage, start = stack.pop()
+        self.add(stage, now - start)
+        if stack:
+            stack[-1][1] = now
+
+    def to_server_timing(self, total: Optional[float] = None) -> str:
+        durations = self.durations
+        if total is not None:
+            durations["total"] = total
+        return ", ".join(f"{stage};dur={duration * 1000:.3f}" for stage, duration in durations.items())
+
+    def _get_stack(self) -> List[List[Any]]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+
+class _TimedStage(object):
+
+    __slots__ = ("_timings", "_stage")
+
+    def __init__(self, timings: StageTimings, stage: str) -> None:
+        self._timings = timings
+        self._stage = stage
+
+    def __enter__(self) -> None:
+        self._timings.enter(self._stage)
+
+    def __exit__(self, *args: Any) -> None:
+        self._timings.exit()
+
+
+_stage_timings: ContextVar[Optional[StageTimings]] = ContextVar("cms_stage_timings", default=None)
+_untimed_stage: ContextManager = nullcontext()
+
+
+def get_stage_timings() -> Optional[StageTimings]:
+    return _stage_timings.get()
+
+
+def set_stage_timings(timings: Optional[StageTimings]) -> Token:
+    return _stage_timings.set(timings)
+
+
+def reset_stage_timings(token: Token) -> None:
+    _stage_timings.reset(token)
+
+
+def timed_stage(stage: str) -> ContextManager:
+    timings = _stage_timings.get()
+    return _untimed_stage if timings is None else _TimedStage(timings, stage)
+
+
+def bind_stage_timings(func: Callable[..., T]) -> Callable[..., T]:
+    timings = _stage_timings.get()
+    if timings is None:
+        return func
+    submitted = time.perf_counter()
+
+    def run(*args: Any, **kwargs: Any) -> T:
+        timings.add(STAGE_QUEUEING, time.perf_counter() - submitted)
+        token = _stage_timings.set(timings)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _stage_timings.reset(token)
+
+    return run
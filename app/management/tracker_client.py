@@ -200,6 +200,30 @@ class TrackerClient(object):
             TrackerClient.log_exceptions(e)
             TrackerClient.end_with_failure()
 
+    @staticmethod
+    def save_benchmark_results(model_name: str,
+                               run_name: str,
+                               benchmark_params: Dict,
+                               benchmark_results: Dict[str, Dict[str, float]]) -> str:
+        experiment_name = TrackerClient.get_experiment_name(model_name, "benchmark")
+        experiment_id = TrackerClient._get_experiment_id(experiment_name)
+        active_run = mlflow.start_run(experiment_id=experiment_id)
+        try:
+            mlflow.set_tags({
+                MLFLOW_SOURCE_NAME: socket.gethostname(),
+                "mlflow.runName": run_name,
+                "benchmark.mlflow.run_id": active_run.info.run_id,
+            })
+            mlflow.log_params(benchmark_params)
+            for scenario, metrics in benchmark_results.items():
+                TrackerClient.send_model_stats({f"{scenario}_{key}": val for key, val in metrics.items()}, 0)
+            TrackerClient.end_with_success()
+        except Exception as e:
+            logger.exception(e)
+            TrackerClient.log_exceptions(e)
+            TrackerClient.end_with_failure()
+        return active_run.info.run_id
+
     @staticmethod
     def get_experiment_name(model_name: str, training_type: Optional[str] = "") -> str:
         return f"{model_name} {training_type}".replace(" ", "_") if training_type else model_name.replace(" ", "_")
@@ -0,0 +1,72 @@
+import logging
+import threading
+import time
+from functools import lru_cache
+from typing import List, final
+from model_services.base import AbstractModelService
+from management.prometheus_metrics import cms_start_up_warm_up_duration
+
+logger = logging.getLogger("cms")
+
+_SAMPLE_SENTENCES = [
+    "Mr John Smith was seen at the clinic on 12/03/2020 with chest pain and shortness of breath and was started on aspirin.",
+    "The patient has a history of type 2 diabetes mellitus, hypertension and chronic kidney disease and denies any allergies.",
+    "No evidence of pneumonia or pleural effusion on the chest X-ray.",
+]
+# the last text is long enough to be split into chunks by the DeID models
+DEFAULT_WARM_UP_TEXTS = _SAMPLE_SENTENCES + [" ".join(_SAMPLE_SENTENCES * 20)]
+
+
+@final
+class Readiness(object):
+
+    def __init__(self) -> None:
+        self._warmed_up = threading.Event()
+        self._warmed_up.set()
+
+    @property
+    def ready(self) -> bool:
+        return self._warmed_up.is_set()
+
+    def set_warming_up(self) -> None:
+        self._warmed_up.clear()
+
+    def set_warmed_up(self) -> None:
+        self._warmed_up.set()
+
+
+@lru_cache()
+def get_readiness() -> Readiness:
+    return Readiness()
+
+
+def get_warm_up_texts(file_path: str) -> List[str]:
+    if not file_path:
+        return DEFAULT_WARM_UP_TEXTS
+    with open(file_path, "r") as f:
+        texts = [line.strip() for line in f if line.strip()]
+    return texts or DEFAULT_WARM_UP_TEXTS
+
+
+def start_warm_up(model_service: AbstractModelService, texts: List[str]) -> threading.Thread:
+    readiness = get_readiness()
+    readiness.set_warming_up()
+
+    def warm_up() -> None:
+        start = time.perf_counter()
+        try:
+            timings = model_service.warm_up(texts)
+            # the model card is cached so that probes do not have to compute it
+            model_service.info()
+            for phase, duration in timings.items():
+                cms_start_up_warm_up_duration.labels(phase=phase).set(duration)
+            logger.info(f"Model warmed up with {len(texts)} text(s) in {time.perf_counter() - start:.2f} seconds "
+                        f"({', '.join(f'{phase}: {duration:.2f}s' for phase, duration in timings.items())})")
+        except Exception:
+            logger.exception("Failed to warm up the model and the first requests may be slower")
+        finally:
+            readiness.set_warmed_up()
+
+    thread = threading.Thread(target=warm_up, name="cms-warm-up", daemon=True)
+    thread.start()
+    return thread
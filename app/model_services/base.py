@@ -1,4 +1,5 @@
 import asyncio
+import time
 from abc import ABC, abstractmethod
 from typing import Any, List, Iterable, Tuple, Dict, final
 from config import Settings
@@ -25,6 +26,14 @@ class AbstractModelService(ABC):
     def model_name(self, model_name: str) -> None:
         self._model_name = model_name
 
+    @property
+    def model_version(self) -> str:
+        return ""
+
+    @property
+    def training_in_progress(self) -> bool:
+        return False
+
     @staticmethod
     @abstractmethod
     def load_model(model_file_path: str, *args: Tuple, **kwargs: Dict[str, Any]) -> Any:
@@ -56,6 +65,22 @@ class AbstractModelService(ABC):
     def init_model(self) -> None:
         raise NotImplementedError
 
+    def warm_up(self, texts: List[str]) -> Dict[str, float]:
+        start = time.perf_counter()
+        for text in texts:
+            self.annotate(text)
+        timings = {"annotate": time.perf_counter() - start}
+        start = time.perf_counter()
+        self.batch_annotate(texts)
+        timings["batch_annotate"] = time.perf_counter() - start
+        return timings
+
+    def swap_model(self, model: Any) -> Dict[str, float]:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
     def train_supervised(self, *args: Tuple, **kwargs: Dict[str, Any]) -> bool:
         return False
 
@@ -1,10 +1,16 @@
 import os
+import gc
 import logging
 import torch
-import pandas as pd
 
-from multiprocessing import cpu_count
-from typing import Dict, List, Optional, TextIO, Tuple, Any
+import math
+import threading
+import time
+import weakref
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO, Tuple, Any
 from medcat.cat import CAT
 from model_services.base import AbstractModelService
 from trainers.medcat_trainer import MedcatSupervisedTrainer, MedcatUnsupervisedTrainer
@@ -13,12 +19,25 @@ from domain import ModelCard
 from config import Settings
 from utils import get_settings, TYPE_ID_TO_NAME_PATCH
 from exception import ConfigurationException
+from management.prometheus_metrics import cms_batch_pool_utilisation, cms_batch_annotation_duration, cms_batch_annotation_shards
+from management.quantisation import apply_dynamic_quantisation, is_quantisation_applicable
+from management.model_swapper import ModelSwapper
+from management.warm_up import get_warm_up_texts
+from management.model_pack_cache import ModelPackCache
+from management.micro_batcher import close_micro_batcher
+from management.stage_timings import STAGE_META_CAT, STAGE_NER_LINKING, STAGE_RECORDS, timed_stage
 
 logger = logging.getLogger("cms")
 
+_ADDL_INFO = ["cui2icd10", "cui2ontologies", "cui2snomed", "cui2athena_ids"]
+_BATCH_SIZE_CHARS = 500000
+
 
 class MedCATModel(AbstractModelService):
 
+    COLUMN_NAMES = {"pretty_name": "label_name", "cui": "label_id", "types": "categories", "acc": "accuracy"}
+    SPAN_TEXT_COLUMN_NAMES = {**COLUMN_NAMES, "source_value": "text"}
+
     def __init__(self,
                  config: Settings,
                  model_parent_dir: Optional[str] = None,
@@ -34,11 +53,20 @@ class MedCATModel(AbstractModelService):
         self._unsupervised_trainer = None
         self._metacat_trainer = None
         self._whitelisted_tuis = set([tui.strip() for tui in config.TYPE_UNIQUE_ID_WHITELIST.split(",")])
+        self._batch_pool: Optional[ProcessPoolExecutor] = None
+        self._batch_pool_enabled = False
+        self._batch_pool_model: Optional[CAT] = None
+        self._batch_pool_pid: Optional[int] = None
+        self._batch_pool_size = 0
+        self._batch_pool_busy = 0
+        self._batch_pool_lock = threading.RLock()
+        self._model_swapper = ModelSwapper()
+        self._model_card: Optional[Tuple[weakref.ref, Dict]] = None
         self.model_name = model_name or "MedCAT model"
 
     @property
     def model(self) -> CAT:
-        return self._model
+        return self._model_swapper.get_model(self._model)
 
     @model.setter
     def model(self, model: CAT) -> None:
@@ -52,6 +80,10 @@ class MedCATModel(AbstractModelService):
     def api_version(self) -> str:
         return "0.0.1"
 
+    @property
+    def model_version(self) -> str:
+        return str(self._model.config.version.id) if self._model is not None else ""
+
     @classmethod
     def from_model(cls, model: CAT) -> "MedCATModel":
         model_service = cls(get_settings(), enable_trainer=False)
@@ -65,16 +97,13 @@ class MedCATModel(AbstractModelService):
         return cat
 
     @staticmethod
-    def _retrieve_meta_annotations(df: pd.DataFrame) -> pd.DataFrame:
-        meta_annotations = []
-        for i, r in df.iterrows():
-            meta_dict = {}
-            for k, v in r.meta_anns.items():
-                meta_dict[k] = v["value"]
-            meta_annotations.append(meta_dict)
-
-        df["new_meta_anns"] = meta_annotations
-        return pd.concat([df.drop(["new_meta_anns"], axis=1), df["new_meta_anns"].apply(pd.Series)], axis=1)
+    def _get_record_from_entity(entity: Dict, column_names: Dict[str, str]) -> Dict:
+        record = {column_names.get(key, key): value for key, value in entity.items()}
+        if record.get("athena_ids"):
+            record["athena_ids"] = [athena_id["code"] for athena_id in record["athena_ids"]]
+        for meta_name, meta_ann in entity.get("meta_anns", {}).items():
+            record[meta_name] = meta_ann["value"]
+        return record
 
     def init_model(self) -> None:
         if hasattr(self, "_model") and isinstance(self._model, CAT):
@@ -83,11 +112,15 @@ class MedCATModel(AbstractModelService):
             if (get_settings().DEVICE.startswith("cuda") and torch.cuda.is_available()) or \
                (get_settings().DEVICE.startswith("mps") and torch.backends.mps.is_available()) or \
                (get_settings().DEVICE.startswith("cpu")):
-                self._model = self.load_model(self._model_pack_path, meta_cat_config_dict={"general": {"device": get_settings().DEVICE}})
+                self._model = self._load_served_model(meta_cat_config_dict={"general": {"device": get_settings().DEVICE}})
                 self._model.config.general["device"] = get_settings().DEVICE
             else:
-                self._model = self.load_model(self._model_pack_path)
-            self._set_tuis_filtering()
+                self._model = self._load_served_model()
+            self._prepare_served_model()
+            if self._config.BATCH_POOL_PROCESSES > 0 and not self._config.DEVICE.startswith(("cuda", "mps")) and self._config.MODEL_WORKER_PROCESSES <= 0:
+                # the pool is forked on warm-up so that neither requests nor training and registration pay for it
+                self._batch_pool_enabled = True
+                self._batch_pool_pid = os.getpid()
             if self._enable_trainer:
                 self._supervised_trainer = MedcatSupervisedTrainer(self)
                 self._unsupervised_trainer = MedcatUnsupervisedTrainer(self)
@@ -96,21 +129,111 @@ class MedCATModel(AbstractModelService):
     def info(self) -> ModelCard:
         raise NotImplementedError
 
-    def annotate(self, text: str) -> Dict:
-        doc = self.model.get_entities(text,
-                                      addl_info=["cui2icd10", "cui2ontologies", "cui2snomed", "cui2athena_ids"])
-        return self.get_records_from_doc(doc)
-
-    def batch_annotate(self, texts: List[str]) -> List[Dict]:
-        batch_size_chars = 500000
-
-        docs = self.model.multiprocessing(self._data_iterator(texts),
-                                          batch_size_chars=batch_size_chars,
-                                          nproc=max(int(cpu_count() / 2), 1),
-                                          addl_info=["cui2icd10", "cui2ontologies", "cui2snomed", "cui2athena_ids"])
-        annotations_list = []
-        for _, doc in docs.items():
-            annotations_list.append(self.get_records_from_doc(doc))
+    def _get_model_card(self) -> Dict:
+        model = self.model
+        model_card = self._model_card
+        if model_card is None or model_card[0]() is not model:
+            model_card = self._model_card = (weakref.ref(model), model.get_model_card(as_dict=True))
+        return model_card[1]
+
+    def _load_served_model(self, meta_cat_config_dict: Optional[Dict] = None) -> CAT:
+        if self._config.MODEL_PACK_CACHE_DIR:
+            model = ModelPackCache(self._config.MODEL_PACK_CACHE_DIR).load_model_pack(self._model_pack_path, meta_cat_config_dict=meta_cat_config_dict)
+        elif meta_cat_config_dict is None:
+            model = self.load_model(self._model_pack_path)
+        else:
+            model = self.load_model(self._model_pack_path, meta_cat_config_dict=meta_cat_config_dict)
+        if self._config.ENABLE_STAGE_TIMING == "true":
+            _time_meta_cat_stages(model)
+        return model
+
+    def _prepare_served_model(self, retrained: bool = False) -> None:
+        self._set_tuis_filtering()
+        if is_quantisation_applicable(self._config):
+            apply_dynamic_quantisation(self, self._get_quantisation_targets(), self._config)
+
+    def _get_quantisation_targets(self) -> List[Tuple[Any, str]]:
+        return [(meta_cat, "model") for meta_cat in self._model._meta_cats]
+
+    def annotate(self, text: str) -> List[Dict]:
+        with self._model_swapper.lease(self):
+            with timed_stage(STAGE_NER_LINKING):
+                doc = self.model.get_entities(text, addl_info=_ADDL_INFO)
+            with timed_stage(STAGE_RECORDS):
+                return self.get_records_from_doc(doc)
+
+    def batch_annotate(self, texts: List[str]) -> List[List[Dict]]:
+        if not texts:
+            return []
+        with self._model_swapper.lease(self):
+            return self._batch_annotate(texts)
+
+    def warm_up(self, texts: List[str]) -> Dict[str, float]:
+        timings = super().warm_up(texts)
+        if self._batch_pool_enabled and self._batch_pool_pid == os.getpid():
+            start = time.perf_counter()
+            previous_pool = self._batch_pool
+            # the pool workers are forked after the warm-up so that they inherit what has been lazily initialised in this process
+            self._start_batch_pool()
+            if previous_pool is not None:
+                # shards submitted by requests already being served are drained from the previous workers
+                previous_pool.shutdown(wait=True)
+            if texts:
+                self.batch_annotate(texts)
+            timings["batch_pool"] = time.perf_counter() - start
+        return timings
+
+    def swap_model(self, model: CAT) -> Dict[str, float]:
+        if self._config.ENABLE_STAGE_TIMING == "true":
+            _time_meta_cat_stages(model)
+        warm_up_service = self.__class__(self._config,
+                                         model_parent_dir=self._model_parent_dir,
+                                         enable_trainer=False,
+                                         base_model_file=os.path.basename(self._model_pack_path))
+        warm_up_service.model = model
+        # the retrained model is optimised in the same way as the one loaded on start-up before it gets served
+        warm_up_service._prepare_served_model(retrained=True)
+        swap_stats = self._model_swapper.swap(self, model, warm_up_service, get_warm_up_texts(self._config.WARM_UP_SAMPLE_TEXTS_FILE))
+        if self._batch_pool_enabled and self._batch_pool_pid == os.getpid():
+            # the pool is re-forked on the swapping thread for the new model
+            self._start_batch_pool()
+        self._get_model_card()
+        return swap_stats
+
+    @property
+    def training_in_progress(self) -> bool:
+        trainers = [self._supervised_trainer, self._unsupervised_trainer, self._metacat_trainer]
+        return any(trainer is not None and trainer.training_in_progress for trainer in trainers)
+
+    def close(self) -> None:
+        close_micro_batcher(self)
+        with self._batch_pool_lock:
+            self._batch_pool_enabled = False
+            if self._batch_pool is not None:
+                self._batch_pool.shutdown(wait=False, cancel_futures=True)
+                self._batch_pool = None
+
+    def _batch_annotate(self, texts: List[str]) -> List[List[Dict]]:
+        batch_pool = self._get_batch_pool()
+        if batch_pool is None:
+            with timed_stage(STAGE_NER_LINKING):
+                docs = self.model.get_entities_multi_texts(texts, addl_info=_ADDL_INFO)
+            with timed_stage(STAGE_RECORDS):
+                return [self.get_records_from_doc(doc) for doc in docs]
+
+        start = time.perf_counter()
+        shards = _get_char_budgeted_shards(texts, max(min(_BATCH_SIZE_CHARS, math.ceil(sum(len(text) for text in texts) / self._batch_pool_size)), 1))
+        for attempt in range(2):
+            try:
+                futures = [self._submit_shard(batch_pool, shard) for shard in shards]
+                annotations_list = [annotations for future in futures for annotations in future.result()]
+                break
+            except BrokenProcessPool:
+                if attempt:
+                    raise
+                batch_pool = self._restart_broken_batch_pool(batch_pool)
+        cms_batch_annotation_shards.observe(len(shards))
+        cms_batch_annotation_duration.observe(time.perf_counter() - start)
         return annotations_list
 
     def train_supervised(self,
@@ -155,22 +278,60 @@ class MedCATModel(AbstractModelService):
             raise ConfigurationException("The metacat trainer is not enabled")
         return self._metacat_trainer.train(data_file, epochs, log_frequency, training_id, input_file_name, raw_data_files, description, synchronised, **hyperparams)
 
-    def get_records_from_doc(self, doc: Dict) -> Dict:
-        df = pd.DataFrame(doc["entities"].values())
+    def get_records_from_doc(self, doc: Dict) -> List[Dict]:
+        column_names = self.SPAN_TEXT_COLUMN_NAMES if self._config.INCLUDE_SPAN_TEXT == "true" else self.COLUMN_NAMES
+        return [self._get_record_from_entity(entity, column_names) for entity in doc["entities"].values()]
 
-        if df.empty:
-            df = pd.DataFrame(columns=["label_name", "label_id", "start", "end", "accuracy"])
-        else:
-            for _, row in df.iterrows():
-                if "athena_ids" in row and row["athena_ids"]:
-                    row["athena_ids"] = [athena_id["code"] for athena_id in row["athena_ids"]]
-            if self._config.INCLUDE_SPAN_TEXT == "true":
-                df.rename(columns={"pretty_name": "label_name", "cui": "label_id", "source_value": "text", "types": "categories", "acc": "accuracy", "athena_ids": "athena_ids"}, inplace=True)
-            else:
-                df.rename(columns={"pretty_name": "label_name", "cui": "label_id", "types": "categories", "acc": "accuracy", "athena_ids": "athena_ids"}, inplace=True)
-            df = self._retrieve_meta_annotations(df)
-        records = df.to_dict("records")
-        return records
+    def _start_batch_pool(self) -> ProcessPoolExecutor:
+        with self._batch_pool_lock:
+            if self._batch_pool is not None:
+                # shards already submitted by other callers are left to finish on the previous workers
+                self._batch_pool.shutdown(wait=False, cancel_futures=False)
+            self._batch_pool_size = self._config.BATCH_POOL_PROCESSES
+            # objects alive at the fork are kept out of collections so that their pages stay shared with the workers
+            gc.unfreeze()
+            gc.collect()
+            gc.freeze()
+            self._batch_pool = ProcessPoolExecutor(max_workers=self._batch_pool_size,
+                                                   mp_context=get_context("fork"),
+                                                   initializer=_set_batch_model_service,
+                                                   initargs=(self,))
+            self._batch_pool_model = self._model
+            self._batch_pool_busy = 0
+            self._batch_pool.submit(os.getpid).result()
+        logger.info(f"Batch annotation pool started with {self._batch_pool_size} worker(s)")
+        return self._batch_pool
+
+    def _get_batch_pool(self) -> Optional[ProcessPoolExecutor]:
+        if not self._batch_pool_enabled or self._batch_pool_pid != os.getpid():
+            return None
+        model = self.model
+        with self._batch_pool_lock:
+            if self._batch_pool is not None and self._batch_pool_model is model:
+                return self._batch_pool
+            # the pool is never forked from a request and calls are annotated in process until it is started for the model
+            return None
+
+    def _restart_broken_batch_pool(self, broken_pool: ProcessPoolExecutor) -> ProcessPoolExecutor:
+        with self._batch_pool_lock:
+            if not self._batch_pool_enabled:
+                raise BrokenProcessPool("The batch annotation pool has been closed")
+            if self._batch_pool is not broken_pool and self._batch_pool is not None:
+                # another caller has already restarted the pool
+                return self._batch_pool
+            logger.warning("The batch annotation pool is broken and will be restarted")
+            return self._start_batch_pool()
+
+    def _submit_shard(self, batch_pool: ProcessPoolExecutor, shard: List[str]) -> Future:
+        future = batch_pool.submit(_annotate_shard, shard)
+        self._update_batch_pool_busy(1)
+        future.add_done_callback(lambda _: self._update_batch_pool_busy(-1))
+        return future
+
+    def _update_batch_pool_busy(self, delta: int) -> None:
+        with self._batch_pool_lock:
+            self._batch_pool_busy = max(self._batch_pool_busy + delta, 0)
+            cms_batch_pool_utilisation.set(min(self._batch_pool_busy, self._batch_pool_size) / max(self._batch_pool_size, 1))
 
     def _set_tuis_filtering(self) -> None:
         # this patching may not be needed after the base 1.4.x model is fixed in the future
@@ -186,3 +347,57 @@ class MedCATModel(AbstractModelService):
         for tui in self._whitelisted_tuis:
             whitelisted_cuis.update(tuis2cuis.get(tui, {}))
         self._model.cdb.config.linking.filters = {"cuis": whitelisted_cuis}
+
+
+_batch_model_service: Optional[MedCATModel] = None
+
+
+def _set_batch_model_service(model_service: MedCATModel) -> None:
+    global _batch_model_service
+    _batch_model_service = model_service
+
+
+def _annotate_shard(texts: List[str]) -> List[List[Dict]]:
+    assert _batch_model_service is not None, "The batch annotation worker was not initialised"
+    docs = _batch_model_service.model.get_entities_multi_texts(texts, addl_info=_ADDL_INFO)
+    return [_batch_model_service.get_records_from_doc(doc) for doc in docs]
+
+
+def _time_meta_cat_stages(model: CAT) -> None:
+    for meta_cat in model._meta_cats:
+        meta_cat.pipe = _get_timed_meta_cat_pipe(meta_cat.pipe)
+
+
+def _get_timed_meta_cat_pipe(pipe: Any) -> Any:
+
+    def _get_upstream_docs(stream: Iterable[Any]) -> Iterator[Any]:
+        docs = iter(stream)
+        while True:
+            with timed_stage(STAGE_NER_LINKING):
+                doc = next(docs, None)
+            if doc is None:
+                return
+            yield doc
+
+    def timed_pipe(stream: Iterable[Any], *args: Any, **kwargs: Any) -> Iterator[Any]:
+        docs = pipe(_get_upstream_docs(stream), *args, **kwargs)
+        while True:
+            with timed_stage(STAGE_META_CAT):
+                doc = next(docs, None)
+            if doc is None:
+                return
+            yield doc
+
+    return timed_pipe
+
+
+def _get_char_budgeted_shards(texts: List[str], char_budget: int) -> List[List[str]]:
+    shards: List[List[str]] = []
+    char_num = 0
+    for text in texts:
+        if not shards or (char_num + len(text) > char_budget and shards[-1]):
+            shards.append([])
+            char_num = 0
+        shards[-1].append(text)
+        char_num += len(text)
+    return shards
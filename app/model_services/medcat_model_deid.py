@@ -1,13 +1,19 @@
 import logging
 import inspect
+import copy
 import threading
+from bisect import bisect_left
+from contextlib import contextmanager
 import torch
-from typing import Dict, List, TextIO, Optional, Any, final, Callable
+from typing import Dict, List, TextIO, Optional, Any, Iterator, Tuple, final
 from functools import partial
-from transformers import pipeline
+from transformers import pipeline, Pipeline, PreTrainedTokenizerBase
 from medcat.cat import CAT
 from config import Settings
 from model_services.medcat_model import MedCATModel
+from management.onnx_runtime import OnnxTokenClassificationModel, get_onnx_model, is_onnx_runtime_applicable
+from management.quantisation import apply_dynamic_quantisation, is_quantisation_applicable
+from management.stage_timings import STAGE_NER_LINKING, STAGE_RECORDS, timed_stage
 from trainers.medcat_deid_trainer import MedcatDeIdentificationSupervisedTrainer
 from domain import ModelCard, ModelType
 from exception import ConfigurationException
@@ -20,6 +26,7 @@ class MedCATModelDeIdentification(MedCATModel):
 
     CHUNK_SIZE = 500
     LEFT_CONTEXT_WORDS = 5
+    INFERENCE_BATCH_SIZE = 8
 
     def __init__(self,
                  config: Settings,
@@ -29,85 +36,56 @@ class MedCATModelDeIdentification(MedCATModel):
                  base_model_file: Optional[str] = None) -> None:
         super().__init__(config, model_parent_dir=model_parent_dir, enable_trainer=enable_trainer, model_name=model_name, base_model_file=base_model_file)
         self.model_name = model_name or "De-Identification MedCAT model"
-        self._lock = threading.RLock()
+        self._local = threading.local()
+
+    @property
+    def model(self) -> CAT:
+        return self._model_swapper.get_model(self._model)
+
+    @model.setter
+    def model(self, model: CAT) -> None:
+        self._model = model
+        _install_thread_local_ner_pipes(model)
+
+    @model.deleter
+    def model(self) -> None:
+        del self._model
 
     @property
     def api_version(self) -> str:
         return "0.0.1"
 
     def info(self) -> ModelCard:
-        model_card = self.model.get_model_card(as_dict=True)
+        model_card = copy.deepcopy(self._get_model_card())
         model_card["Basic CDB Stats"]["Average training examples per concept"] = 0
         return ModelCard(model_description=self.model_name,
                          model_type=ModelType.MEDCAT_DEID,
                          api_version=self.api_version,
                          model_card=model_card)
 
-    def annotate(self, text: str) -> Dict:
-        tokenizer = self.model._addl_ner[0].tokenizer.hf_tokenizer
-        leading_ws_len = len(text) - len(text.lstrip())
-        text = text.lstrip()
-        tokenized = self._with_lock(tokenizer, text, return_offsets_mapping=True, add_special_tokens=False)
-        input_ids = tokenized["input_ids"]
-        offset_mapping = tokenized["offset_mapping"]
-        chunk = []
-        aggregated_entities = {}
-        ent_key = 0
-        processed_char_len = leading_ws_len
-
-        for input_id, (start, end) in zip(input_ids, offset_mapping):
-            chunk.append((input_id, (start, end)))
-            if len(chunk) == MedCATModelDeIdentification.CHUNK_SIZE:
-                last_token_start_idx = 0
-                window_overlap_start_idx = 0
-                number_of_seen_words = 0
-                for i in range(MedCATModelDeIdentification.CHUNK_SIZE-1, -1, -1):
-                    if " " in tokenizer.decode([chunk[i][0]], skip_special_tokens=True):
-                        if last_token_start_idx == 0:
-                            last_token_start_idx = i
-                        if number_of_seen_words < MedCATModelDeIdentification.LEFT_CONTEXT_WORDS:
-                            window_overlap_start_idx = i
-                        else:
-                            break
-                        number_of_seen_words += 1
-                c_text = text[chunk[:last_token_start_idx][0][1][0]:chunk[:last_token_start_idx][-1][1][1]]
-                doc = self._with_lock(self.model.get_entities, c_text)
-                doc["entities"] = {_id: entity for _id, entity in doc["entities"].items() if entity["end"]+processed_char_len < chunk[window_overlap_start_idx][1][0]}
-                for entity in doc["entities"].values():
-                    entity["start"] += processed_char_len
-                    entity["end"] += processed_char_len
-                    entity["types"] = ["PII"]
-                    aggregated_entities[ent_key] = entity
-                    ent_key += 1
-                processed_char_len = chunk[:window_overlap_start_idx][-1][1][1] + leading_ws_len + 1
-                chunk = chunk[window_overlap_start_idx:]
-        if chunk:
-            c_text = text[chunk[0][1][0]:chunk[-1][1][1]]
-            doc = self.model.get_entities(c_text)
-            if doc["entities"]:
-                for entity in doc["entities"].values():
-                    entity["start"] += processed_char_len
-                    entity["end"] += processed_char_len
-                    entity["types"] = ["PII"]
-                    aggregated_entities[ent_key] = entity
-                    ent_key += 1
-            processed_char_len += len(c_text)
+    def annotate(self, text: str) -> List[Dict]:
+        return self.batch_annotate([text])[0]
 
-        assert processed_char_len == (len(text)+leading_ws_len), f"{len(text)+leading_ws_len-processed_char_len} characters were not processed:\n{text}"
+    def batch_annotate(self, texts: List[str]) -> List[List[Dict]]:
+        with self._model_swapper.lease(self):
+            return self._batch_annotate(texts)
 
-        return self.get_records_from_doc({"entities": aggregated_entities})
+    def _batch_annotate(self, texts: List[str]) -> List[List[Dict]]:
+        with timed_stage(STAGE_NER_LINKING):
+            tokenizer = self._get_tokenizer()
+            stripped_texts = [text.lstrip() for text in texts]
+            tokenized = tokenizer(stripped_texts, return_offsets_mapping=True, add_special_tokens=False) if texts else {"input_ids": [], "offset_mapping": []}
+            chunk_plans = [self._plan_chunks(text, len(text) - len(stripped_text), stripped_text, input_ids, offset_mapping)
+                           for text, stripped_text, input_ids, offset_mapping in zip(texts, stripped_texts, tokenized["input_ids"], tokenized["offset_mapping"])]
 
-    def batch_annotate(self, texts: List[str]) -> List[Dict]:
-        annotation_list = []
-        for text in texts:
-            annotation_list.append(self.annotate(text))
-        return annotation_list
+            with _prefetched_ner_results(self.model, [c_text for chunk_plan in chunk_plans for c_text, _, _ in chunk_plan[0]], self.INFERENCE_BATCH_SIZE):
+                return [self._annotate_chunks(text, *chunk_plan) for text, chunk_plan in zip(texts, chunk_plans)]
 
     def init_model(self) -> None:
-        if hasattr(self, "_model") and isinstance(self._model, CAT):    # type: ignore
+        if hasattr(self, "_model") and isinstance(self._model, CAT):
             logger.warning("Model service is already initialised and can be initialised only once")
         else:
-            self._model = self.load_model(self._model_pack_path)
+            self._model = self._load_served_model()
             self._model._addl_ner[0].tokenizer.hf_tokenizer._in_target_context_manager = getattr(self._model._addl_ner[0].tokenizer.hf_tokenizer, "_in_target_context_manager", False)
             self._model._addl_ner[0].tokenizer.hf_tokenizer.clean_up_tokenization_spaces = getattr(self._model._addl_ner[0].tokenizer.hf_tokenizer, "clean_up_tokenization_spaces", None)
             if (self._config.DEVICE.startswith("cuda") and torch.cuda.is_available()) or \
@@ -133,9 +111,37 @@ class MedCATModelDeIdentification(MedCATModel):
             _save_pretrained = self._model._addl_ner[0].model.save_pretrained
             if ("safe_serialization" in inspect.signature(_save_pretrained).parameters):
                 self._model._addl_ner[0].model.save_pretrained = partial(_save_pretrained, safe_serialization=(self._config.TRAINING_SAFE_MODEL_SERIALISATION == "true"))
+            self._prepare_served_model()
             if self._enable_trainer:
                 self._supervised_trainer = MedcatDeIdentificationSupervisedTrainer(self)
 
+    def _prepare_served_model(self, retrained: bool = False) -> None:
+        if is_onnx_runtime_applicable(self._config):
+            self._install_onnx_models(retrained)
+        if is_quantisation_applicable(self._config):
+            if any(isinstance(addl_ner.ner_pipe.model, OnnxTokenClassificationModel) for addl_ner in self._model._addl_ner):
+                logger.warning("Both ONNX Runtime and dynamic quantisation are enabled and the DeID transformers served with ONNX Runtime will not be quantised")
+            apply_dynamic_quantisation(self, self._get_quantisation_targets(), self._config)
+        _install_thread_local_ner_pipes(self._model)
+
+    def _install_onnx_models(self, retrained: bool = False) -> None:
+        for idx, addl_ner in enumerate(self._model._addl_ner):
+            # a retrained model is exported afresh instead of reusing the export of the model pack
+            onnx_model = get_onnx_model(addl_ner.model,
+                                        addl_ner.tokenizer.hf_tokenizer,
+                                        self._model_pack_path,
+                                        f"deid_{idx}_retrained" if retrained else f"deid_{idx}",
+                                        self._config,
+                                        overwrite=retrained)
+            if onnx_model is not None:
+                addl_ner.ner_pipe.model = onnx_model
+
+    def _get_quantisation_targets(self) -> List[Tuple[Any, str]]:
+        # the pipe and the NER component share the transformer and both are replaced so that the fp32 weights can be freed
+        return [(owner, "model")
+                for addl_ner in self._model._addl_ner if not isinstance(addl_ner.ner_pipe.model, OnnxTokenClassificationModel)
+                for owner in (addl_ner.ner_pipe, addl_ner)] + super()._get_quantisation_targets()
+
     def train_supervised(self,
                          data_file: TextIO,
                          epochs: int,
@@ -150,7 +156,134 @@ class MedCATModelDeIdentification(MedCATModel):
             raise ConfigurationException("Trainers are not enabled")
         return self._supervised_trainer.train(data_file, epochs, log_frequency, training_id, input_file_name, raw_data_files, description, synchronised, **hyperparams)
 
-    def _with_lock(self, func: Callable, *args: Any, **kwargs: Any) -> Any:
-        # Temporarily tackle https://github.com/huggingface/tokenizers/issues/537 but it reduces parallelism
-        with self._lock:
-            return func(*args, **kwargs)
+    def _get_tokenizer(self) -> PreTrainedTokenizerBase:
+        hf_tokenizer = self.model._addl_ner[0].tokenizer.hf_tokenizer
+        if getattr(self._local, "source_tokenizer", None) is not hf_tokenizer:
+            self._local.source_tokenizer = hf_tokenizer
+            self._local.tokenizer = copy.deepcopy(hf_tokenizer)
+            self._local.word_starts = {}
+        return self._local.tokenizer
+
+    def _get_word_start_indices(self, input_ids: List[int]) -> List[int]:
+        tokenizer = self._get_tokenizer()
+        word_starts = self._local.word_starts
+        indices = []
+        for idx, input_id in enumerate(input_ids):
+            is_word_start = word_starts.get(input_id)
+            if is_word_start is None:
+                is_word_start = word_starts[input_id] = " " in tokenizer.decode([input_id], skip_special_tokens=True)
+            if is_word_start:
+                indices.append(idx)
+        return indices
+
+    def _plan_chunks(self,
+                     text: str,
+                     leading_ws_len: int,
+                     stripped_text: str,
+                     input_ids: List[int],
+                     offset_mapping: List[Tuple[int, int]]) -> Tuple[List[Tuple[str, int, Optional[int]]], int]:
+        word_start_indices = self._get_word_start_indices(input_ids)
+        chunks: List[Tuple[str, int, Optional[int]]] = []
+        processed_char_len = leading_ws_len
+        chunk_start = 0
+
+        while len(input_ids) - chunk_start >= self.CHUNK_SIZE:
+            chunk_end = chunk_start + self.CHUNK_SIZE
+            upper = bisect_left(word_start_indices, chunk_end)
+            word_num = upper - bisect_left(word_start_indices, chunk_start)
+            last_token_start_idx = word_start_indices[upper - 1] - chunk_start if word_num else 0
+            window_overlap_start_idx = word_start_indices[upper - min(word_num, self.LEFT_CONTEXT_WORDS)] - chunk_start if word_num else 0
+            chunk = offset_mapping[chunk_start:chunk_start + last_token_start_idx]
+            c_text = stripped_text[chunk[0][0]:chunk[-1][1]]
+            chunks.append((c_text, processed_char_len, offset_mapping[chunk_start + window_overlap_start_idx][0]))
+            processed_char_len = offset_mapping[chunk_start:chunk_start + window_overlap_start_idx][-1][1] + leading_ws_len + 1
+            chunk_start += window_overlap_start_idx
+
+        if chunk_start < len(input_ids):
+            c_text = stripped_text[offset_mapping[chunk_start][0]:offset_mapping[-1][1]]
+            chunks.append((c_text, processed_char_len, None))
+            processed_char_len += len(c_text)
+
+        return chunks, processed_char_len
+
+    def _annotate_chunks(self, text: str, chunks: List[Tuple[str, int, Optional[int]]], processed_char_len: int) -> List[Dict]:
+        aggregated_entities = {}
+        ent_key = 0
+        for c_text, offset, overlap_start in chunks:
+            doc = self.model.get_entities(c_text)
+            for entity in doc["entities"].values():
+                if overlap_start is not None and entity["end"] + offset >= overlap_start:
+                    continue
+                entity["start"] += offset
+                entity["end"] += offset
+                entity["types"] = ["PII"]
+                aggregated_entities[ent_key] = entity
+                ent_key += 1
+
+        assert processed_char_len == len(text), f"{len(text)-processed_char_len} characters were not processed:\n{text.lstrip()}"
+
+        with timed_stage(STAGE_RECORDS):
+            return self.get_records_from_doc({"entities": aggregated_entities})
+
+
+class _ThreadLocalNerPipe(object):
+
+    def __init__(self, ner_pipe: Pipeline) -> None:
+        self._ner_pipe = ner_pipe
+        self._local = threading.local()
+        self._version = 0
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        prefetched = getattr(self._local, "prefetched", None)
+        if prefetched and args and isinstance(args[0], str) and args[0] in prefetched:
+            return copy.deepcopy(prefetched[args[0]])
+        return self._get_ner_pipe()(*args, **kwargs)
+
+    def prefetch(self, texts: List[str], batch_size: int, **kwargs: Any) -> None:
+        texts = list(dict.fromkeys(text for text in texts if text.strip()))
+        if len(texts) > 1:
+            results = self._get_ner_pipe()(texts, batch_size=batch_size, **kwargs)
+            self._local.prefetched = dict(zip(texts, results))
+
+    def clear(self) -> None:
+        self._local.prefetched = None
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("__") or name in ("_ner_pipe", "_local", "_version"):
+            raise AttributeError(name)
+        return getattr(self._ner_pipe, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if name in ("_ner_pipe", "_local", "_version"):
+            object.__setattr__(self, name, value)
+        else:
+            # e.g. the model replaced by ONNX Runtime or quantisation and the per-thread copies are made afresh
+            setattr(self._ner_pipe, name, value)
+            self._version += 1
+
+    def _get_ner_pipe(self) -> Pipeline:
+        ner_pipe = getattr(self._local, "ner_pipe", None)
+        if ner_pipe is None or self._local.version != self._version:
+            ner_pipe = copy.copy(self._ner_pipe)
+            ner_pipe.tokenizer = copy.deepcopy(self._ner_pipe.tokenizer)
+            self._local.ner_pipe = ner_pipe
+            self._local.version = self._version
+        return ner_pipe
+
+
+def _install_thread_local_ner_pipes(model: Optional[CAT]) -> None:
+    for addl_ner in getattr(model, "_addl_ner", []):
+        if not isinstance(addl_ner.ner_pipe, _ThreadLocalNerPipe):
+            addl_ner.ner_pipe = _ThreadLocalNerPipe(addl_ner.ner_pipe)
+
+
+@contextmanager
+def _prefetched_ner_results(model: CAT, texts: List[str], batch_size: int) -> Iterator[None]:
+    addl_ners = [addl_ner for addl_ner in getattr(model, "_addl_ner", []) if isinstance(addl_ner.ner_pipe, _ThreadLocalNerPipe)]
+    try:
+        for addl_ner in addl_ners:
+            addl_ner.ner_pipe.prefetch(texts, batch_size, aggregation_strategy=addl_ner.config.general["ner_aggregation_strategy"])
+        yield
+    finally:
+        for addl_ner in addl_ners:
+            addl_ner.ner_pipe.clear()
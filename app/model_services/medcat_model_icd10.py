@@ -1,6 +1,5 @@
 import logging
-import pandas as pd
-from typing import Dict, Optional, final
+from typing import Dict, List, Optional, final
 from model_services.medcat_model import MedCATModel
 from config import Settings
 from domain import ModelCard, ModelType
@@ -30,38 +29,26 @@ class MedCATModelIcd10(MedCATModel):
         return ModelCard(model_description=self.model_name,
                          model_type=ModelType.MEDCAT_ICD10,
                          api_version=self.api_version,
-                         model_card=self.model.get_model_card(as_dict=True))
-
-    def get_records_from_doc(self, doc: Dict) -> Dict:
-        df = pd.DataFrame(doc["entities"].values())
-
-        if df.empty:
-            df = pd.DataFrame(columns=["label_name", "label_id", "start", "end", "accuracy"])
-        else:
-            new_rows = []
-            for _, row in df.iterrows():
-                if self.ICD10_KEY not in row or not row[self.ICD10_KEY]:
-                    logger.debug(f"No mapped ICD-10 code associated with the entity: {row}")
+                         model_card=self._get_model_card())
+
+    def get_records_from_doc(self, doc: Dict) -> List[Dict]:
+        column_names = {**self.COLUMN_NAMES, self.ICD10_KEY: "label_id"}
+        column_names.pop("cui")
+        records = []
+        for entity in doc["entities"].values():
+            if not entity.get(self.ICD10_KEY):
+                logger.debug(f"No mapped ICD-10 code associated with the entity: {entity}")
+                continue
+            for icd10 in entity[self.ICD10_KEY]:
+                output_entity = dict(entity)
+                if isinstance(icd10, str):
+                    output_entity[self.ICD10_KEY] = icd10
+                elif isinstance(icd10, dict):
+                    output_entity[self.ICD10_KEY] = icd10.get("code")
+                    output_entity["pretty_name"] = icd10.get("name")
+                elif isinstance(icd10, list) and icd10:
+                    output_entity[self.ICD10_KEY] = icd10[-1]
                 else:
-                    for icd10 in row[self.ICD10_KEY]:
-                        output_row = row.copy()
-                        if isinstance(icd10, str):
-                            output_row[self.ICD10_KEY] = icd10
-                        elif isinstance(icd10, dict):
-                            output_row[self.ICD10_KEY] = icd10.get("code")
-                            output_row["pretty_name"] = icd10.get("name")
-                        elif isinstance(icd10, list) and icd10:
-                            output_row[self.ICD10_KEY] = icd10[-1]
-                        else:
-                            logger.error(f"Unknown format for the ICD-10 code(s): {icd10}")
-                        if "athena_ids" in output_row and output_row["athena_ids"]:
-                            output_row["athena_ids"] = [athena_id["code"] for athena_id in output_row["athena_ids"]]
-                    new_rows.append(output_row)
-            if new_rows:
-                df = pd.DataFrame(new_rows)
-                df.rename(columns={"pretty_name": "label_name", self.ICD10_KEY: "label_id", "types": "categories", "acc": "accuracy", "athena_ids": "athena_ids"}, inplace=True)
-                df = self._retrieve_meta_annotations(df)
-            else:
-                df = pd.DataFrame(columns=["label_name", "label_id", "start", "end", "accuracy"])
-        records = df.to_dict("records")
+                    logger.error(f"Unknown format for the ICD-10 code(s): {icd10}")
+                records.append(self._get_record_from_entity(output_entity, column_names))
         return records
@@ -27,4 +27,4 @@ class MedCATModelSnomed(MedCATModel):
         return ModelCard(model_description=self.model_name,
                          model_type=ModelType.MEDCAT_SNOMED,
                          api_version=self.api_version,
-                         model_card=self.model.get_model_card(as_dict=True))
+                         model_card=self._get_model_card())
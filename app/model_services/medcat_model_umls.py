@@ -24,4 +24,4 @@ class MedCATModelUmls(MedCATModel):
         return ModelCard(model_description=self.model_name,
                          model_type=ModelType.MEDCAT_UMLS,
                          api_version=self.api_version,
-                         model_card=self.model.get_model_card(as_dict=True))
+                         model_card=self._get_model_card())
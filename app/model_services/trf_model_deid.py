@@ -4,10 +4,11 @@ import logging
 import torch
 import numpy as np
 from typing import Tuple, List, Dict, Iterable, Optional, final
-from scipy.special import softmax
 from transformers import AutoModelForTokenClassification, PreTrainedModel
 from medcat.tokenizers.transformers_ner import TransformersTokenizerNER
 from model_services.base import AbstractModelService
+from management.onnx_runtime import OnnxTokenClassificationModel, get_onnx_model, is_onnx_runtime_applicable
+from management.quantisation import apply_dynamic_quantisation, is_quantisation_applicable
 from domain import ModelCard, ModelType
 from config import Settings
 from utils import cls_deprecated
@@ -19,6 +20,8 @@ logger = logging.getLogger("cms")
 @final
 class TransformersModelDeIdentification(AbstractModelService):
 
+    INFERENCE_BATCH_SIZE = 16
+
     def __init__(self,
                  config: Settings,
                  model_parent_dir: Optional[str] = None,
@@ -35,8 +38,11 @@ class TransformersModelDeIdentification(AbstractModelService):
             self._device = torch.device(config.DEVICE)
         self.model_name = model_name or "De-identification model"
         self._model: PreTrainedModel
+        self._onnx_model: Optional[OnnxTokenClassificationModel] = None
         self._tokenizer: TransformersTokenizerNER
-        self._id2cui: Dict[str, str]
+        self._id2cui: Dict[int, str]
+        self._id2token: np.ndarray
+        self._skipped_token_ids: np.ndarray
 
     @property
     def model(self) -> PreTrainedModel:
@@ -45,6 +51,7 @@ class TransformersModelDeIdentification(AbstractModelService):
     @model.setter
     def model(self, model: PreTrainedModel) -> None:
         self._model = model
+        self._onnx_model = None
 
     @model.deleter
     def model(self) -> None:
@@ -79,85 +86,107 @@ class TransformersModelDeIdentification(AbstractModelService):
         else:
             self._tokenizer, self._model = self.load_model(self._model_file_path)
             self._id2cui = {cui_id: cui for cui, cui_id in self._tokenizer.label_map.items()}
+            self._id2token, self._skipped_token_ids = self._get_token_lookups(self._tokenizer)
             self._model.to(self._device)
+            self._model.eval()
+            if is_onnx_runtime_applicable(self._config):
+                self._onnx_model = get_onnx_model(self._model, self._tokenizer.hf_tokenizer, self._model_file_path, "trf_deid", self._config)
+            if is_quantisation_applicable(self._config):
+                if self._onnx_model is None:
+                    apply_dynamic_quantisation(self, [(self, "_model")], self._config)
+                else:
+                    logger.warning("Both ONNX Runtime and dynamic quantisation are enabled and the transformer served with ONNX Runtime will not be quantised")
 
     def annotate(self, text: str) -> List[Dict]:
-        return self._get_annotations(text)
+        return self.batch_annotate([text])[0]
 
     def batch_annotate(self, texts: List[str]) -> List[List[Dict]]:
-        annotation_list = []
-        for text in texts:
-            annotation_list.append(self._get_annotations(text))
+        doc_indices = [idx for idx, text in enumerate(texts) if text.strip()]
+        predictions_list = self._get_predictions([texts[idx] for idx in doc_indices])
+        annotation_list: List[List[Dict]] = [[] for _ in texts]
+        for doc_idx, predictions in zip(doc_indices, predictions_list):
+            annotation_list[doc_idx] = self._get_annotations(texts[doc_idx], predictions)
         return annotation_list
 
-    def _get_annotations(self, text: str) -> List[Dict]:
-        if not text.strip():
+    def _get_predictions(self, texts: List[str]) -> List[List[Tuple[np.ndarray, np.ndarray, List[Tuple]]]]:
+        if not texts:
             return []
-        self._model.eval()
-        device = self._config.DEVICE
+        tokens_list = self._tokenizer.hf_tokenizer(texts, return_offsets_mapping=True, add_special_tokens=False)
+        chunks = []
+        for doc_idx in range(len(texts)):
+            for input_ids, offset_mappings in self._get_chunked_tokens(tokens_list["input_ids"][doc_idx],
+                                                                       tokens_list["offset_mapping"][doc_idx]):
+                chunks.append((doc_idx, input_ids, offset_mappings))
+
+        predictions_list: List[List[Tuple[np.ndarray, np.ndarray, List[Tuple]]]] = [[] for _ in texts]
+        chunk_predictions: List[Optional[np.ndarray]] = [None] * len(chunks)
+        pad_token_id = self._tokenizer.hf_tokenizer.pad_token_id
+        model = self._onnx_model if self._onnx_model is not None else self._model
+        with torch.inference_mode():
+            for batch in self._get_length_bucketed_batches([len(chunk[1]) for chunk in chunks], self.INFERENCE_BATCH_SIZE):
+                max_length = max(len(chunks[chunk_idx][1]) for chunk_idx in batch)
+                batch_input_ids = np.full((len(batch), max_length), pad_token_id, dtype=np.int64)
+                attention_mask = np.zeros((len(batch), max_length), dtype=np.int64)
+                for row, chunk_idx in enumerate(batch):
+                    batch_input_ids[row, :len(chunks[chunk_idx][1])] = chunks[chunk_idx][1]
+                    attention_mask[row, :len(chunks[chunk_idx][1])] = 1
+                logits = model(torch.from_numpy(batch_input_ids).to(self._device),
+                               torch.from_numpy(attention_mask).to(self._device)).logits
+                predictions = logits.argmax(dim=-1).cpu().numpy()
+                for row, chunk_idx in enumerate(batch):
+                    chunk_predictions[chunk_idx] = predictions[row, :len(chunks[chunk_idx][1])]
+
+        for (doc_idx, input_ids, offset_mappings), predictions in zip(chunks, chunk_predictions):
+            predictions_list[doc_idx].append((np.asarray(input_ids, dtype=np.int64), predictions, offset_mappings))
+        return predictions_list
+
+    def _get_annotations(self, text: str, predictions: List[Tuple[np.ndarray, np.ndarray, List[Tuple]]]) -> List[Dict]:
         cas = self._config.CONCAT_SIMILAR_ENTITIES == "true"
         ist = self._config.INCLUDE_SPAN_TEXT == "true"
         annotations: List[Dict] = []
 
-        for dataset, offset_mappings in self._get_chunked_tokens(text):
-            predictions = self._model(torch.tensor([dataset["input_ids"]]).to(device),
-                                      torch.tensor([dataset["attention_mask"]]).to(device))
-            predictions = softmax(predictions.logits.detach().numpy()[0], axis=-1)
-            predictions = np.argmax(predictions, axis=-1)
-
-            input_ids = dataset["input_ids"]
-            for t_idx, cur_cui_id in enumerate(predictions):
-                if cur_cui_id not in [0, -100]:
-                    t_text = self._tokenizer.hf_tokenizer.decode(input_ids[t_idx])
-                    if t_text.strip() in ["", "[PAD]"]:
+        for input_ids, cui_ids, offset_mappings in predictions:
+            t_indices = np.flatnonzero((cui_ids != 0) & ~self._skipped_token_ids[input_ids])
+            t_texts = self._id2token[input_ids[t_indices]]
+            for t_idx, t_text in zip(t_indices.tolist(), t_texts):
+                cur_cui_id = int(cui_ids[t_idx])
+                annotation = {
+                    "label_name": self._tokenizer.cui2name.get(self._id2cui[cur_cui_id]),
+                    "label_id": self._id2cui[cur_cui_id],
+                    "start": offset_mappings[t_idx][0],
+                    "end": offset_mappings[t_idx][1],
+                }
+                if ist:
+                    annotation["text"] = t_text
+                if annotations:
+                    token_type = self._tokenizer.id2type.get(int(input_ids[t_idx]))
+                    if (self._should_expand_with_partial(cur_cui_id, token_type, annotation, annotations) or
+                            self._should_expand_with_whole(cas, annotation, annotations)):
+                        annotations[-1]["end"] = annotation["end"]
+                        if ist:
+                            annotations[-1]["text"] = text[annotations[-1]["start"]:annotations[-1]["end"]]
                         continue
-                    annotation = {
-                        "label_name": self._tokenizer.cui2name.get(self._id2cui[cur_cui_id]),
-                        "label_id": self._id2cui[cur_cui_id],
-                        "start": offset_mappings[t_idx][0],
-                        "end": offset_mappings[t_idx][1],
-                    }
-                    if ist:
-                        annotation["text"] = t_text
-                    if annotations:
-                        token_type = self._tokenizer.id2type.get(input_ids[t_idx])
-                        if (self._should_expand_with_partial(cur_cui_id, token_type, annotation, annotations) or
-                                self._should_expand_with_whole(cas, annotation, annotations)):
-                            annotations[-1]["end"] = annotation["end"]
-                            if ist:
-                                annotations[-1]["text"] = text[annotations[-1]["start"]:annotations[-1]["end"]]
-                            del annotation
-                            continue
-                        elif cur_cui_id != 1:
-                            annotations.append(annotation)
-                            continue
-                    else:
-                        if cur_cui_id != 1:
-                            annotations.append(annotation)
-                            continue
+                if cur_cui_id != 1:
+                    annotations.append(annotation)
 
         return annotations
 
-    def _get_chunked_tokens(self, text: str) -> Iterable[Tuple[Dict, List[Tuple]]]:
-        tokens = self._tokenizer.hf_tokenizer(text, return_offsets_mapping=True, add_special_tokens=False)
+    def _get_chunked_tokens(self, input_ids: List[int], offset_mappings: List[Tuple]) -> Iterable[Tuple[List[int], List[Tuple]]]:
         model_max_length = self._tokenizer.max_len
-        pad_token_id = self._tokenizer.hf_tokenizer.pad_token_id
-        partial = len(tokens["input_ids"]) % model_max_length
-        for i in range(0, len(tokens["input_ids"]) - partial, model_max_length):
-            dataset = {
-                "input_ids": tokens["input_ids"][i:i+model_max_length],
-                "attention_mask": tokens["attention_mask"][i:i+model_max_length],
-            }
-            offset_mappings = tokens["offset_mapping"][i:i+model_max_length]
-            yield dataset, offset_mappings
-        if partial:
-            dataset = {
-                "input_ids": tokens["input_ids"][-partial:] + [pad_token_id]*(model_max_length-partial),
-                "attention_mask": tokens["attention_mask"][-partial:] + [0]*(model_max_length-partial),
-            }
-            offset_mappings = (tokens["offset_mapping"][-partial:] +
-                               [(tokens["offset_mapping"][-1][1]+i, tokens["offset_mapping"][-1][1]+i+1) for i in range(model_max_length-partial)])
-            yield dataset, offset_mappings
+        for i in range(0, len(input_ids), model_max_length):
+            yield input_ids[i:i+model_max_length], offset_mappings[i:i+model_max_length]
+
+    @staticmethod
+    def _get_length_bucketed_batches(lengths: List[int], batch_size: int) -> List[List[int]]:
+        indices = sorted(range(len(lengths)), key=lambda idx: lengths[idx], reverse=True)
+        return [indices[i:i+batch_size] for i in range(0, len(indices), batch_size)]
+
+    @staticmethod
+    def _get_token_lookups(tokenizer: TransformersTokenizerNER) -> Tuple[np.ndarray, np.ndarray]:
+        tokens = tokenizer.hf_tokenizer.batch_decode([[token_id] for token_id in range(len(tokenizer.hf_tokenizer))])
+        id2token = np.array(tokens, dtype=object)
+        skipped_token_ids = np.array([token.strip() in ["", "[PAD]"] for token in tokens], dtype=bool)
+        return id2token, skipped_token_ids
 
     @staticmethod
     def _should_expand_with_partial(cur_cui_id: int,
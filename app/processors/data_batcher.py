@@ -1,4 +1,7 @@
-from typing import Iterable, List, Any
+import asyncio
+from collections import deque
+from typing import Iterable, List, Any, AsyncIterable, AsyncIterator, Callable, Deque, Optional, Tuple
+from management.stage_timings import bind_stage_timings
 
 
 def mini_batch(data: Iterable[Any], batch_size: Any) -> Iterable[List[Any]]:
@@ -16,3 +19,106 @@ def mini_batch(data: Iterable[Any], batch_size: Any) -> Iterable[List[Any]]:
     if batch:
         yield batch
         batch.clear()
+
+
+async def get_lines_from_byte_stream(byte_stream: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    buffer = bytearray()
+    async for chunk in byte_stream:
+        if not chunk:
+            continue
+        search_start = len(buffer)
+        buffer.extend(chunk)
+        line_start = 0
+        while True:
+            line_end = buffer.find(b"\n", search_start)
+            if line_end == -1:
+                break
+            yield bytes(buffer[line_start:line_end])
+            line_start = search_start = line_end + 1
+        if line_start:
+            del buffer[:line_start]
+    if buffer:
+        yield bytes(buffer)
+
+
+async def process_in_batches(data: AsyncIterable[Any],
+                             process: Callable[[List[Any]], List[Any]],
+                             get_char_num: Callable[[Any], int],
+                             max_docs: int,
+                             max_chars: int,
+                             max_in_flight: int = 2,
+                             max_wait_ms: int = 10) -> AsyncIterator[Tuple[Any, Any]]:
+    loop = asyncio.get_running_loop()
+    batches: asyncio.Queue = asyncio.Queue(maxsize=max(max_in_flight, 1))
+    end_of_data = object()
+    max_wait = max(max_wait_ms, 0) / 1000
+
+    async def _batch() -> None:
+        items = data.__aiter__()
+        batch: List = []
+        char_num = 0
+        deadline = 0.0
+        next_item: Optional[asyncio.Future] = None
+        try:
+            while True:
+                if next_item is None:
+                    next_item = asyncio.ensure_future(items.__anext__())
+                if batch:
+                    # a partial batch is flushed once it has waited long enough for more items
+                    done, _ = await asyncio.wait({next_item}, timeout=max(deadline - loop.time(), 0))
+                    if not done:
+                        await batches.put(batch)
+                        batch = []
+                        char_num = 0
+                        continue
+                try:
+                    item = await next_item
+                except StopAsyncIteration:
+                    break
+                finally:
+                    next_item = None
+                if not batch:
+                    deadline = loop.time() + max_wait
+                batch.append(item)
+                char_num += get_char_num(item)
+                if len(batch) >= max_docs or char_num >= max_chars:
+                    await batches.put(batch)
+                    batch = []
+                    char_num = 0
+            if batch:
+                await batches.put(batch)
+            await batches.put(end_of_data)
+        except Exception as e:
+            await batches.put(e)
+        finally:
+            if next_item is not None:
+                next_item.cancel()
+
+    batching = asyncio.create_task(_batch())
+    pending: Deque[Tuple[List, asyncio.Future]] = deque()
+    exhausted = False
+    try:
+        while pending or not exhausted:
+            while not exhausted and len(pending) < max(max_in_flight, 1):
+                if pending:
+                    try:
+                        batch = batches.get_nowait()
+                    except asyncio.QueueEmpty:
+                        break
+                else:
+                    batch = await batches.get()
+                if batch is end_of_data:
+                    exhausted = True
+                elif isinstance(batch, Exception):
+                    raise batch
+                else:
+                    pending.append((batch, loop.run_in_executor(None, bind_stage_timings(process), batch)))
+            if pending:
+                batch, future = pending.popleft()
+                results = await future
+                for item, result in zip(batch, results):
+                    yield item, result
+    finally:
+        batching.cancel()
+        for _, future in pending:
+            future.cancel()
@@ -36,6 +36,10 @@ class TrainerCommon(object):
     def model_name(self, model_name: str) -> None:
         self._model_name = model_name
 
+    @property
+    def training_in_progress(self) -> bool:
+        return self._training_in_progress
+
     @final
     def start_training(self,
                        run: Callable,
@@ -13,6 +13,7 @@ from medcat import __version__ as medcat_version
 from medcat.cat import CAT
 from management.log_captor import LogCaptor
 from management.model_manager import ModelManager
+from management.annotation_cache import get_annotation_cache
 from model_services.base import AbstractModelService
 from trainers.base import SupervisedTrainer, UnsupervisedTrainer
 from processors.data_batcher import mini_batch
@@ -51,13 +52,13 @@ class _MedcatTrainerCommon(object):
     @staticmethod
     def deploy_model(model_service: AbstractModelService,
                      model: CAT,
-                     skip_save_model: bool) -> None:
+                     skip_save_model: bool) -> Dict[str, float]:
         if skip_save_model:
             model._versioning()
-        del model_service.model
-        gc.collect()
-        model_service.model = model
+        swap_stats = model_service.swap_model(model)
+        get_annotation_cache().invalidate(model_service)
         logger.info("Retrained model deployed")
+        return swap_stats
 
     @staticmethod
     def save_model_pack(model: CAT, model_dir: str, description: Optional[str] = None) -> str:
@@ -172,7 +173,8 @@ class MedcatSupervisedTrainer(SupervisedTrainer, _MedcatTrainerCommon):
                 else:
                     logger.info("Skipped saving on the retrained model")
                 if redeploy:
-                    trainer.deploy_model(trainer._model_service, model, skip_save_model)
+                    swap_stats = trainer.deploy_model(trainer._model_service, model, skip_save_model)
+                    trainer._tracker_client.send_model_stats(swap_stats, 0)
                 else:
                     del model
                     gc.collect()
@@ -366,7 +368,8 @@ class MedcatUnsupervisedTrainer(UnsupervisedTrainer, _MedcatTrainerCommon):
             else:
                 logger.info("Skipped saving on the retrained model")
             if redeploy:
-                trainer.deploy_model(trainer._model_service, model, skip_save_model)
+                swap_stats = trainer.deploy_model(trainer._model_service, model, skip_save_model)
+                trainer._tracker_client.send_model_stats(swap_stats, 0)
             else:
                 del model
                 gc.collect()
@@ -103,7 +103,8 @@ class MetacatTrainer(MedcatSupervisedTrainer):
                 else:
                     logger.info("Skipped saving on the retrained model")
                 if redeploy:
-                    trainer.deploy_model(trainer._model_service, model, skip_save_model)
+                    swap_stats = trainer.deploy_model(trainer._model_service, model, skip_save_model)
+                    trainer._tracker_client.send_model_stats(swap_stats, 0)
                 else:
                     del model
                     gc.collect()
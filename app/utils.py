@@ -1,4 +1,6 @@
 import json
+import math
+import hashlib
 import socket
 import random
 import struct
@@ -6,6 +8,7 @@ import inspect
 import os
 import copy
 import functools
+import sys
 import warnings
 import torch
 import pandas as pd
@@ -74,6 +77,66 @@ def get_func_params_as_dict(func: Callable) -> Dict:
     return params
 
 
+def get_cpu_count() -> int:
+    cpu_count = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    quota = None
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            cpu_max = f.read().split()
+        if cpu_max[0] != "max":
+            quota = int(cpu_max[0]) / int(cpu_max[1])
+    except (OSError, ValueError, IndexError):
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                cfs_quota = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                cfs_period = int(f.read())
+            if cfs_quota > 0 and cfs_period > 0:
+                quota = cfs_quota / cfs_period
+        except (OSError, ValueError):
+            pass
+    if quota is not None:
+        cpu_count = min(cpu_count, max(math.ceil(quota), 1))
+    return cpu_count
+
+
+def get_file_sha256(file_path: Union[str, os.PathLike], chunk_size: int = 1024 * 1024) -> str:
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def get_cached_file_sha256(file_path: Union[str, os.PathLike], cache_dir: Union[str, os.PathLike]) -> str:
+    # the content hash is reused until the file is replaced at the same path
+    stat = os.stat(file_path)
+    file_key = f"{os.path.abspath(file_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    sidecar_path = os.path.join(cache_dir, f"{hashlib.sha256(file_key.encode()).hexdigest()}.sha256")
+    try:
+        with open(sidecar_path, "r") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
+    sha256 = get_file_sha256(file_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{sidecar_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(sha256)
+    os.replace(tmp_path, sidecar_path)
+    return sha256
+
+
+def get_rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        # falls back to the peak RSS which is reported in bytes on macOS and in kilobytes elsewhere
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
 def json_normalize_trainer_export(trainer_export: Dict) -> pd.DataFrame:
     return pd.json_normalize(trainer_export,
                              record_path=["projects", "documents", "annotations"],
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "app")))
+
+from config import Settings    # noqa: E402
+from model_services.medcat_model_deid import MedCATModelDeIdentification    # noqa: E402
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "-m",
+        "--model-pack-path",
+        type=str,
+        default="",
+        help="The path to the DeID model pack"
+    )
+    parser.add_argument(
+        "-t",
+        "--text-file-path",
+        type=str,
+        default=os.path.join(os.path.dirname(__file__), "..", "tests", "resources", "fixture", "sample_text.txt"),
+        help="The path to the plain text file to be annotated repeatedly"
+    )
+    parser.add_argument(
+        "-n",
+        "--thread-nums",
+        type=str,
+        default="1,2,4,8",
+        help="The comma-separated numbers of concurrent threads"
+    )
+    parser.add_argument(
+        "-r",
+        "--requests",
+        type=int,
+        default=32,
+        help="The number of annotation requests sent for each number of threads"
+    )
+    FLAGS, unparsed = parser.parse_known_args()
+
+    if FLAGS.model_pack_path == "":
+        print("ERROR: The path to the model pack is empty. Use '-m' to pass in the model pack path.")
+        sys.exit(1)
+
+    config = Settings()
+    model_service = MedCATModelDeIdentification(config,
+                                                model_parent_dir=os.path.dirname(os.path.abspath(FLAGS.model_pack_path)),
+                                                enable_trainer=False,
+                                                base_model_file=os.path.basename(FLAGS.model_pack_path))
+    model_service.init_model()
+    with open(FLAGS.text_file_path) as f:
+        text = f.read()
+    model_service.annotate(text)
+
+    print(f"{'threads':>10}{'seconds':>12}{'docs/s':>12}{'scaling':>12}")
+    baseline = None
+    for thread_num in [int(num) for num in FLAGS.thread_nums.split(",")]:
+        with ThreadPoolExecutor(max_workers=thread_num) as executor:
+            start = time.perf_counter()
+            list(executor.map(model_service.annotate, [text] * FLAGS.requests))
+            elapsed = time.perf_counter() - start
+        throughput = FLAGS.requests / elapsed
+        baseline = baseline or throughput
+        print(f"{thread_num:>10}{elapsed:>12.2f}{throughput:>12.2f}{throughput / baseline:>11.2f}x")
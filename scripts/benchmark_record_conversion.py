@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import timeit
+from argparse import ArgumentParser
+from typing import Dict, List
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "app")))
+
+from config import Settings    # noqa: E402
+from model_services.medcat_model import MedCATModel    # noqa: E402
+
+
+def get_doc(entity_num: int) -> Dict:
+    entities = {}
+    for idx in range(entity_num):
+        entities[idx] = {
+            "pretty_name": f"pretty_name_{idx}",
+            "cui": f"cui_{idx}",
+            "type_ids": ["type_id"],
+            "types": ["type"],
+            "source_value": f"source_value_{idx}",
+            "detected_name": f"detected_name_{idx}",
+            "acc": 0.9,
+            "context_similarity": 0.9,
+            "start": idx * 20,
+            "end": idx * 20 + 15,
+            "athena_ids": [{"name": "name_1", "code": "code_1"}, {"name": "name_2", "code": "code_2"}],
+            "id": idx,
+            "meta_anns": {
+                "Presence": {"value": "True", "confidence": 0.99, "name": "Presence"},
+                "Subject": {"value": "Patient", "confidence": 0.99, "name": "Subject"},
+                "Time": {"value": "Recent", "confidence": 0.99, "name": "Time"},
+            },
+        }
+    return {"entities": entities}
+
+
+def get_records_with_pandas(doc: Dict) -> List[Dict]:
+    df = pd.DataFrame(doc["entities"].values())
+    if df.empty:
+        df = pd.DataFrame(columns=["label_name", "label_id", "start", "end", "accuracy"])
+    else:
+        df.rename(columns={"pretty_name": "label_name", "cui": "label_id", "source_value": "text", "types": "categories", "acc": "accuracy"}, inplace=True)
+        meta_annotations = []
+        for _, row in df.iterrows():
+            meta_annotations.append({key: value["value"] for key, value in row.meta_anns.items()})
+        df["new_meta_anns"] = meta_annotations
+        df = pd.concat([df.drop(["new_meta_anns"], axis=1), df["new_meta_anns"].apply(pd.Series)], axis=1)
+    return df.to_dict("records")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "-e",
+        "--entity-nums",
+        type=str,
+        default="0,1,10,100,1000",
+        help="The comma-separated numbers of entities per document"
+    )
+    parser.add_argument(
+        "-r",
+        "--repeats",
+        type=int,
+        default=200,
+        help="The number of conversions timed for each entity number"
+    )
+    FLAGS, unparsed = parser.parse_known_args()
+
+    config = Settings()
+    config.INCLUDE_SPAN_TEXT = "true"
+    model_service = MedCATModel(config, enable_trainer=False)
+
+    print(f"{'entities':>10}{'pandas (ms)':>15}{'dict (ms)':>15}{'speed-up':>12}")
+    for entity_num in [int(num) for num in FLAGS.entity_nums.split(",")]:
+        doc = get_doc(entity_num)
+        pandas_time = timeit.timeit(lambda: get_records_with_pandas(doc), number=FLAGS.repeats) / FLAGS.repeats * 1000
+        dict_time = timeit.timeit(lambda: model_service.get_records_from_doc(doc), number=FLAGS.repeats) / FLAGS.repeats * 1000
+        print(f"{entity_num:>10}{pandas_time:>15.3f}{dict_time:>15.3f}{pandas_time / dict_time:>11.1f}x")
@@ -0,0 +1,68 @@
+import time
+import uuid
+import hashlib
+import pytest
+from unittest.mock import AsyncMock, Mock, patch
+from fastapi_users.jwt import generate_jwt
+from api.auth.backends import _CachedJWTStrategy
+from api.auth.token_cache import TokenCache
+
+
+def test_put_and_get():
+    token_cache = TokenCache(60)
+
+    token_cache.put("token", "user_id", time.time() + 3600, "user")
+    cached_token = token_cache.get("token")
+
+    assert cached_token.user == "user"
+    assert cached_token.user_id == "user_id"
+    assert cached_token.limiter_key == hashlib.sha256("user_id".encode()).hexdigest()
+    assert token_cache.get("another_token") is None
+
+
+def test_expiry_follows_token_exp():
+    token_cache = TokenCache(60)
+
+    token_cache.put("token", "user_id", time.time() - 1, "user")
+
+    assert token_cache.get("token") is None
+
+
+def test_invalidate_user():
+    token_cache = TokenCache(60)
+    token_cache.put("token_1", "user_id_1", None, "user_1")
+    token_cache.put("token_2", "user_id_1", None, "user_1")
+    token_cache.put("token_3", "user_id_2", None, "user_2")
+
+    token_cache.invalidate_user("user_id_1")
+
+    assert token_cache.get("token_1") is None
+    assert token_cache.get("token_2") is None
+    assert token_cache.get("token_3").user == "user_2"
+
+
+def test_disabled_cache():
+    token_cache = TokenCache(0)
+
+    cached_token = token_cache.put("token", "user_id", None, "user")
+
+    assert cached_token.limiter_key == hashlib.sha256("user_id".encode()).hexdigest()
+    assert token_cache.get("token") is None
+
+
+@pytest.mark.asyncio
+async def test_read_token_from_cache():
+    user_id = uuid.uuid4()
+    user = Mock(id=user_id)
+    user_manager = Mock()
+    user_manager.parse_id.return_value = user_id
+    user_manager.get = AsyncMock(return_value=user)
+    strategy = _CachedJWTStrategy(secret="secret", lifetime_seconds=3600)
+    token = generate_jwt({"sub": str(user_id), "aud": strategy.token_audience}, "secret", 3600)
+
+    with patch("api.auth.backends.get_token_cache", return_value=TokenCache(60)):
+        assert await strategy.read_token(token, user_manager) is user
+        assert await strategy.read_token(token, user_manager) is user
+        assert await strategy.read_token("invalid", user_manager) is None
+
+    user_manager.get.assert_awaited_once_with(user_id)
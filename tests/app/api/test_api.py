@@ -33,7 +33,10 @@ def test_get_model_server():
     assert "/process_bulk" in paths
     assert "/process_bulk_file" in paths
     assert "/redact" in paths
+    assert "/redact_bulk" in paths
+    assert "/redact_jsonl" in paths
     assert "/redact_with_encryption" in paths
+    assert "/redact_bulk_with_encryption" in paths
     assert "/preview" in paths
     assert "/preview_trainer_export" in paths
     assert "/train_supervised" in paths
@@ -1,5 +1,10 @@
-from api.dependencies import ModelServiceDep
+from unittest.mock import Mock, patch
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from api.dependencies import ModelServiceDep, ModelManagerDep, MultiModelServiceDep
+from api.utils import ModelRoutingMiddleware
 from config import Settings
+from management.model_host import ModelHost
 from model_services.medcat_model import MedCATModel
 from model_services.medcat_model_icd10 import MedCATModelIcd10
 from model_services.medcat_model_umls import MedCATModelUmls
@@ -30,3 +35,53 @@ def test_medcat_deid_dep():
 def test_transformer_deid_dep():
     model_service_dep = ModelServiceDep("transformers_deid", Settings())
     assert isinstance(model_service_dep(), TransformersModelDeIdentification)
+
+
+def test_multi_model_service_dep_routing():
+    model_host = ModelHost(Settings(), model_service_factory=lambda model_type, model_file_path, model_name: Mock(model_type=model_type))
+    model_host.register("medcat_snomed", "snomed.zip")
+    model_host.register("medcat_umls", "umls.zip")
+    model_service_dep = MultiModelServiceDep(model_host, "medcat_snomed", Settings())
+    app = FastAPI()
+    app.add_middleware(ModelRoutingMiddleware, model_types=model_service_dep.model_types)
+
+    @app.get("/info")
+    def info(model_service=Depends(model_service_dep)):
+        return {"model_type": model_service.model_type}
+
+    client = TestClient(app)
+
+    assert client.get("/info").json() == {"model_type": "medcat_snomed"}
+    assert client.get("/models/medcat_umls/info").json() == {"model_type": "medcat_umls"}
+    assert client.get("/info", headers={"X-CMS-Model-Type": "medcat_umls"}).json() == {"model_type": "medcat_umls"}
+    assert client.get("/info", headers={"X-CMS-Model-Type": "medcat_icd10"}).status_code == 404
+    assert client.get("/models/medcat_icd10/info").status_code == 404
+    assert model_service_dep.model_service.model_type == "medcat_snomed"
+
+
+def test_multi_model_service_dep_lease():
+    model_host = ModelHost(Settings(), model_service_factory=lambda model_type, model_file_path, model_name: Mock(model_type=model_type))
+    model_host.register("medcat_snomed", "snomed.zip")
+    model_service_dep = MultiModelServiceDep(model_host, "medcat_snomed", Settings())
+    app = FastAPI()
+    app.add_middleware(ModelRoutingMiddleware, model_types=model_service_dep.model_types)
+
+    @app.get("/info")
+    def info(model_service=Depends(model_service_dep)):
+        return {"model_type": model_service.model_type}
+
+    with patch.object(model_host, "release", wraps=model_host.release) as release:
+        response = TestClient(app).get("/info")
+
+    assert response.json() == {"model_type": "medcat_snomed"}
+    release.assert_called_once_with(model_service_dep.model_service)
+
+
+def test_model_manager_dep_resolves_model_service_per_call():
+    model_service_dep = ModelServiceDep("medcat_snomed", Settings())
+    model_manager_dep = ModelManagerDep(model_service_dep)
+    model_service_dep.model_service = MedCATModel(Settings())
+
+    assert model_manager_dep().model_service is model_service_dep.model_service
+    model_service_dep.model_service = MedCATModel(Settings())
+    assert model_manager_dep().model_service is model_service_dep.model_service
@@ -6,12 +6,13 @@ import json
 import pytest
 import api.globals as cms_globals
 from fastapi.testclient import TestClient
+from api.dependencies import ModelServiceDep
 from api.api import get_model_server, get_stream_server
 from utils import get_settings
 from model_services.medcat_model import MedCATModel
 from domain import ModelCard, ModelType
-from management.model_manager import ModelManager
-from unittest.mock import create_autospec
+from management.warm_up import get_readiness
+from unittest.mock import create_autospec, patch
 
 model_service = create_autospec(MedCATModel)
 config = get_settings()
@@ -38,14 +39,23 @@ def test_healthz():
 
 
 def test_readyz():
-    model_card = ModelCard.parse_obj({
-        "api_version": "0.0.1",
-        "model_description": "medcat_model_description",
-        "model_type": ModelType.MEDCAT_SNOMED,
-        "model_card": None,
-    })
-    model_service.info.return_value = model_card
-    assert client.get("/readyz").content.decode("utf-8") == ModelType.MEDCAT_SNOMED
+    model_service_dep = ModelServiceDep(ModelType.MEDCAT_SNOMED, config)
+    model_service.info.reset_mock()
+
+    with patch.object(cms_globals, "model_service_dep", model_service_dep):
+        assert client.get("/readyz").content.decode("utf-8") == ModelType.MEDCAT_SNOMED
+    model_service.info.assert_not_called()
+
+
+def test_readyz_while_warming_up():
+    get_readiness().set_warming_up()
+    try:
+        response = client.get("/readyz")
+    finally:
+        get_readiness().set_warmed_up()
+
+    assert response.status_code == 503
+    assert response.text == "Warming up"
 
 
 def test_info():
@@ -85,6 +95,71 @@ def test_process():
     }
 
 
+def test_process_with_stage_timing():
+    model_service.annotate.return_value = [{"label_name": "Spinal stenosis", "label_id": "76107001", "start": 0, "end": 15}]
+    config.ENABLE_STAGE_TIMING = "true"
+    try:
+        stage_timed_app = get_model_server(msd_overwritten=lambda: model_service)
+    finally:
+        config.ENABLE_STAGE_TIMING = "false"
+    stage_timed_app.dependency_overrides[cms_globals.props.current_active_user] = lambda: None
+
+    response = TestClient(stage_timed_app).post("/process",
+                                                data="Spinal stenosis",
+                                                headers={"Content-Type": "text/plain"})
+
+    assert response.json()["annotations"] == model_service.annotate.return_value
+    assert "validation;dur=" in response.headers["Server-Timing"]
+    assert "serialisation;dur=" in response.headers["Server-Timing"]
+    assert "Server-Timing" not in client.post("/process", data="Spinal stenosis", headers={"Content-Type": "text/plain"}).headers
+
+
+def test_process_with_micro_batching():
+    annotations = [{
+        "label_name": "Spinal stenosis",
+        "label_id": "76107001",
+        "start": 0,
+        "end": 15,
+        "accuracy": 1.0,
+    }]
+    model_service.annotate.return_value = annotations
+    config.ENABLE_MICRO_BATCHING = "true"
+    try:
+        response = client.post("/process",
+                               data="Spinal stenosis",
+                               headers={"Content-Type": "text/plain"})
+    finally:
+        config.ENABLE_MICRO_BATCHING = "false"
+
+    assert response.json() == {
+        "text": "Spinal stenosis",
+        "annotations": annotations
+    }
+
+
+def test_process_with_annotation_cache():
+    annotations = [{
+        "label_name": "Spinal stenosis",
+        "label_id": "76107001",
+        "start": 0,
+        "end": 15,
+        "accuracy": 1.0,
+    }]
+    model_service.annotate.reset_mock()
+    model_service.annotate.return_value = annotations
+    config.ENABLE_ANNOTATION_CACHE = "true"
+    try:
+        responses = [client.post("/process", data="Cached spinal stenosis", headers={"Content-Type": "text/plain"}) for _ in range(2)]
+    finally:
+        config.ENABLE_ANNOTATION_CACHE = "false"
+
+    assert responses[0].json() == responses[1].json() == {
+        "text": "Cached spinal stenosis",
+        "annotations": annotations
+    }
+    model_service.annotate.assert_called_once_with("Cached spinal stenosis")
+
+
 def test_process_jsonl():
     annotations = [{
         "label_name": "Spinal stenosis",
@@ -100,10 +175,7 @@ def test_process_jsonl():
             }
         },
     }]
-    model_service.annotate.return_value = annotations
-    model_manager = ModelManager(None, None)
-    model_manager.model_service = model_service
-    cms_globals.model_manager_dep = lambda: model_manager
+    model_service.batch_annotate.return_value = [annotations, annotations]
     response = client.post("/process_jsonl",
                            data='{"name": "doc1", "text": "Spinal stenosis"}\n{"name": "doc2", "text": "Spinal stenosis"}',
                            headers={"Content-Type": "application/x-ndjson"})
@@ -114,6 +186,26 @@ def test_process_jsonl():
     assert json.loads(jsonlines[1]) == {"doc_name": "doc2", **annotations[0]}
 
 
+def test_process_jsonl_with_invalid_line_after_first():
+    annotations = [{
+        "label_name": "Spinal stenosis",
+        "label_id": "76107001",
+        "start": 0,
+        "end": 15,
+        "accuracy": 1.0,
+    }]
+    model_service.batch_annotate.return_value = [annotations, annotations]
+    response = client.post("/process_jsonl",
+                           data='{"text": "Spinal stenosis"}\n\n{"name": "doc2", "text": Spinal stenosis}\n{"text": "Spinal stenosis"}\n',
+                           headers={"Content-Type": "application/x-ndjson"})
+
+    jsonlines = response.text[:-1].split("\n")
+    assert response.status_code == 200
+    assert json.loads(jsonlines[0]) == {"doc_name": "0", **annotations[0]}
+    assert json.loads(jsonlines[1])["error"] == "Invalid JSON Line"
+    assert json.loads(jsonlines[2]) == {"doc_name": "2", **annotations[0]}
+
+
 def test_process_invalid_jsonl():
     annotations = [{
         "label_name": "Spinal stenosis",
@@ -129,10 +221,7 @@ def test_process_invalid_jsonl():
             }
         },
     }]
-    model_service.annotate.return_value = annotations
-    model_manager = ModelManager(None, None)
-    model_manager.model_service = model_service
-    cms_globals.model_manager_dep = lambda: model_manager
+    model_service.batch_annotate.return_value = [annotations, annotations]
 
     response = client.post("/process_jsonl",
                            data="invalid json lines",
@@ -156,10 +245,7 @@ def test_process_unknown_jsonl_properties():
             }
         },
     }]
-    model_service.annotate.return_value = annotations
-    model_manager = ModelManager(None, None)
-    model_manager.model_service = model_service
-    cms_globals.model_manager_dep = lambda: model_manager
+    model_service.batch_annotate.return_value = [annotations, annotations]
 
     response = client.post("/process_jsonl",
                            data='{"unknown": "doc1", "text": "Spinal stenosis"}\n{"unknown": "doc2", "text": "Spinal stenosis"}',
@@ -184,10 +270,7 @@ async def test_stream_process():
             }
         },
     }]
-    model_service.annotate.return_value = annotations
-    model_manager = ModelManager(None, None)
-    model_manager.model_service = model_service
-    cms_globals.model_manager_dep = lambda: model_manager
+    model_service.batch_annotate.return_value = [annotations, annotations]
 
     async with httpx.AsyncClient(app=app2, base_url="http://test") as ac:
         response = await ac.post("/stream/process",
@@ -198,7 +281,29 @@ async def test_stream_process():
     jsonlines = b""
     async for chunk in response.aiter_bytes():
         jsonlines += chunk
-    assert json.loads(jsonlines.decode("utf-8").splitlines()[-1]) == {"doc_name": "doc2", **annotations[0]}
+    assert [json.loads(line) for line in jsonlines.decode("utf-8").splitlines()] == [
+        {"doc_name": "doc1", **annotations[0]},
+        {"doc_name": "doc2", **annotations[0]},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_stream_process_in_order_with_invalid_line():
+    model_service.batch_annotate.return_value = [[{"label_name": "Spinal stenosis", "label_id": "76107001", "start": 0, "end": 15}]] * 3
+
+    async with httpx.AsyncClient(app=app2, base_url="http://test") as ac:
+        response = await ac.post("/stream/process",
+                                 data='{"name": "doc1", "text": "Spinal stenosis"}\n{"name": "doc2", "text": Spinal stenosis}\n{"text": "Spinal stenosis"}\n'.encode("utf-8"),
+                                 headers={"Content-Type": "application/x-ndjson"})
+
+    assert response.status_code == 200
+    jsonlines = b""
+    async for chunk in response.aiter_bytes():
+        jsonlines += chunk
+    items = [json.loads(line) for line in jsonlines.decode("utf-8").splitlines()]
+    assert items[0]["doc_name"] == "doc1"
+    assert items[1]["error"] == "Invalid JSON Line"
+    assert items[2]["doc_name"] == "2"
 
 
 @pytest.mark.asyncio
@@ -387,6 +492,67 @@ def test_redact_with_hash():
     assert response.text == "4c86af83314100034ad83fae3227e595fc54cb864c69ea912cd5290b8d0f41a4"
 
 
+def test_redact_bulk():
+    annotations = [{
+        "label_name": "Spinal stenosis",
+        "label_id": "76107001",
+        "start": 0,
+        "end": 15,
+        "accuracy": 1.0,
+    }]
+    model_service.batch_annotate.side_effect = lambda texts: [annotations if text.startswith("Spinal") else [] for text in texts]
+    response = client.post("/redact_bulk",
+                           json=["Spinal stenosis and back pain", "Nothing to redact"])
+    assert response.json() == ["[Spinal stenosis] and back pain", "Nothing to redact"]
+    model_service.batch_annotate.side_effect = None
+
+
+def test_redact_bulk_with_mask_and_warning():
+    annotations = [{
+        "label_name": "Spinal stenosis",
+        "label_id": "76107001",
+        "start": 0,
+        "end": 15,
+        "accuracy": 1.0,
+    }]
+    model_service.batch_annotate.side_effect = lambda texts: [annotations if text.startswith("Spinal") else [] for text in texts]
+    response = client.post("/redact_bulk?mask=***&warn_on_no_redaction=true",
+                           json=["Spinal stenosis and back pain", "Nothing to redact"])
+    assert response.json() == ["*** and back pain", "WARNING: No entities were detected for redaction."]
+    model_service.batch_annotate.side_effect = None
+
+
+def test_redact_jsonl():
+    annotations = [{
+        "label_name": "Spinal stenosis",
+        "label_id": "76107001",
+        "start": 0,
+        "end": 15,
+        "accuracy": 1.0,
+    }]
+    model_service.batch_annotate.side_effect = lambda texts: [annotations if text.startswith("Spinal") else [] for text in texts]
+    with patch("api.routers.invocation.get_metrics_aggregator") as get_metrics_aggregator:
+        response = client.post("/redact_jsonl?hash=true&warn_on_no_redaction=true",
+                               data='{"name": "doc1", "text": "Spinal stenosis and back pain"}\n{"text": Nothing}\n{"name": "doc3", "text": "Nothing to redact"}\n',
+                               headers={"Content-Type": "application/x-ndjson"})
+
+    jsonlines = response.text[:-1].split("\n")
+    assert response.status_code == 200
+    get_metrics_aggregator.return_value.record.assert_any_call("/redact_jsonl", annotations)
+    assert json.loads(jsonlines[0]) == {"doc_name": "doc1", "text": "4c86af83314100034ad83fae3227e595fc54cb864c69ea912cd5290b8d0f41a4 and back pain"}
+    assert json.loads(jsonlines[1])["error"] == "Invalid JSON Line"
+    assert json.loads(jsonlines[2]) == {"doc_name": "doc3", "message": "WARNING: No entities were detected for redaction."}
+    model_service.batch_annotate.side_effect = None
+
+
+def test_redact_invalid_jsonl():
+    response = client.post("/redact_jsonl",
+                           data='{"name": "doc1", "text": Spinal stenosis}\n',
+                           headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 400
+    assert response.json() == {"message": "Invalid JSON Lines."}
+
+
 def test_redact_with_encryption():
     annotations = [{
         "label_name": "Spinal stenosis",
@@ -417,6 +583,75 @@ def test_redact_with_encryption():
     assert len(response.json()["encryptions"][0]["encryption"]) > 0
 
 
+def test_redact_with_envelope_encryption():
+    annotations = [{
+        "label_name": "Spinal stenosis",
+        "label_id": "76107001",
+        "start": 0,
+        "end": 15,
+        "accuracy": 1.0,
+    }]
+    body = {
+      "text": "Spinal stenosis and back pain",
+      "public_key_pem": "-----BEGIN PUBLIC KEY-----\nMIIBIjANBgkqhkiG9w0BAQEFAAOCAQ8AMIIBCgKCAQEA3ITkTP8Tm/5FygcwY2EQ7LgVsuCF0OH7psUqvlXnOPNCfX86CobHBiSFjG9o5ZeajPtTXaf1thUodgpJZVZSqpVTXwGKo8r0COMO87IcwYigkZZgG/WmZgoZART+AA0+JvjFGxflJAxSv7puGlf82E+u5Wz2psLBSDO5qrnmaDZTvPh5eX84cocahVVI7X09/kI+sZiKauM69yoy1bdx16YIIeNm0M9qqS3tTrjouQiJfZ8jUKSZ44Na/81LMVw5O46+5GvwD+OsR43kQ0TexMwgtHxQQsiXLWHCDNy2ZzkzukDYRwA3V2lwVjtQN0WjxHg24BTBDBM+v7iQ7cbweQIDAQAB\n-----END PUBLIC KEY-----"
+    }
+    model_service.annotate.return_value = annotations
+    response = client.post("/redact_with_encryption?envelope=true",
+                           json=body,
+                           headers={"Content-Type": "application/json"})
+    assert response.json()["redacted_text"] == "[REDACTED_0] and back pain"
+    assert response.json()["encryptions"][0]["label"] == "[REDACTED_0]"
+    assert len(response.json()["encryptions"][0]["encryption"]) > 0
+    assert len(response.json()["encrypted_data_key"]) > 0
+
+
+def test_redact_bulk_with_encryption():
+    annotations = [{
+        "label_name": "Spinal stenosis",
+        "label_id": "76107001",
+        "start": 0,
+        "end": 15,
+        "accuracy": 1.0,
+    }]
+    body = {
+      "texts": ["Spinal stenosis and back pain", "Nothing to redact"],
+      "public_key_pem": "-----BEGIN PUBLIC KEY-----\nMIIBIjANBgkqhkiG9w0BAQEFAAOCAQ8AMIIBCgKCAQEA3ITkTP8Tm/5FygcwY2EQ7LgVsuCF0OH7psUqvlXnOPNCfX86CobHBiSFjG9o5ZeajPtTXaf1thUodgpJZVZSqpVTXwGKo8r0COMO87IcwYigkZZgG/WmZgoZART+AA0+JvjFGxflJAxSv7puGlf82E+u5Wz2psLBSDO5qrnmaDZTvPh5eX84cocahVVI7X09/kI+sZiKauM69yoy1bdx16YIIeNm0M9qqS3tTrjouQiJfZ8jUKSZ44Na/81LMVw5O46+5GvwD+OsR43kQ0TexMwgtHxQQsiXLWHCDNy2ZzkzukDYRwA3V2lwVjtQN0WjxHg24BTBDBM+v7iQ7cbweQIDAQAB\n-----END PUBLIC KEY-----"
+    }
+    model_service.batch_annotate.return_value = [annotations, []]
+    response = client.post("/redact_bulk_with_encryption?warn_on_no_redaction=true",
+                           json=body,
+                           headers={"Content-Type": "application/json"})
+    results = response.json()["results"]
+    assert "encrypted_data_key" not in response.json()
+    assert results[0]["redacted_text"] == "[REDACTED_0] and back pain"
+    assert results[0]["encryptions"][0]["label"] == "[REDACTED_0]"
+    assert len(results[0]["encryptions"][0]["encryption"]) > 0
+    assert results[1] == {"message": "WARNING: No entities were detected for redaction."}
+
+
+def test_redact_bulk_with_envelope_encryption():
+    annotations = [{
+        "label_name": "Spinal stenosis",
+        "label_id": "76107001",
+        "start": 0,
+        "end": 15,
+        "accuracy": 1.0,
+    }]
+    body = {
+      "texts": ["Spinal stenosis and back pain", "Nothing to redact"],
+      "public_key_pem": "-----BEGIN PUBLIC KEY-----\nMIIBIjANBgkqhkiG9w0BAQEFAAOCAQ8AMIIBCgKCAQEA3ITkTP8Tm/5FygcwY2EQ7LgVsuCF0OH7psUqvlXnOPNCfX86CobHBiSFjG9o5ZeajPtTXaf1thUodgpJZVZSqpVTXwGKo8r0COMO87IcwYigkZZgG/WmZgoZART+AA0+JvjFGxflJAxSv7puGlf82E+u5Wz2psLBSDO5qrnmaDZTvPh5eX84cocahVVI7X09/kI+sZiKauM69yoy1bdx16YIIeNm0M9qqS3tTrjouQiJfZ8jUKSZ44Na/81LMVw5O46+5GvwD+OsR43kQ0TexMwgtHxQQsiXLWHCDNy2ZzkzukDYRwA3V2lwVjtQN0WjxHg24BTBDBM+v7iQ7cbweQIDAQAB\n-----END PUBLIC KEY-----"
+    }
+    model_service.batch_annotate.return_value = [annotations, []]
+    response = client.post("/redact_bulk_with_encryption?warn_on_no_redaction=true&envelope=true",
+                           json=body,
+                           headers={"Content-Type": "application/json"})
+    results = response.json()["results"]
+    assert len(response.json()["encrypted_data_key"]) > 0
+    assert results[0]["redacted_text"] == "[REDACTED_0] and back pain"
+    assert results[0]["encryptions"][0]["label"] == "[REDACTED_0]"
+    assert results[1] == {"message": "WARNING: No entities were detected for redaction."}
+
+
 def test_warning_on_no_encrypted_redaction():
     annotations = []
     body = {
@@ -672,3 +907,21 @@ def test_extract_entities_from_text_list_file_as_json_file():
             }]
         }
     ] * 15
+
+
+def test_extract_entities_from_text_list_file_in_order():
+    batch_indices = iter(range(100))
+
+    def batch_annotate(texts):
+        batch_idx = next(batch_indices)
+        return [[{"label_name": "Spinal stenosis", "label_id": f"{batch_idx}_{idx}", "start": 0, "end": 15}] for idx in range(len(texts))]
+
+    model_service.batch_annotate.side_effect = batch_annotate
+    try:
+        with open(MULTI_TEXTS_FILE_PATH, "rb") as f:
+            response = client.post("/process_bulk_file", files=[("multi_text_file", f)])
+    finally:
+        model_service.batch_annotate.side_effect = None
+
+    label_ids = [item["annotations"][0]["label_id"] for item in json.loads(response.content)]
+    assert label_ids == [f"{batch_idx}_{idx}" for batch_idx in range(3) for idx in range(5)]
@@ -1,9 +1,10 @@
 import api.globals as cms_globals
 from fastapi.testclient import TestClient
+from api.dependencies import ModelServiceDep
 from api.api import get_model_server
 from utils import get_settings
 from model_services.trf_model_deid import TransformersModelDeIdentification
-from unittest.mock import create_autospec
+from unittest.mock import create_autospec, patch
 from domain import ModelCard, ModelType
 
 model_service = create_autospec(TransformersModelDeIdentification)
@@ -19,14 +20,12 @@ def test_healthz():
 
 
 def test_readyz():
-    model_card = ModelCard.parse_obj({
-        "api_version": "0.0.1",
-        "model_description": "deid_model_description",
-        "model_type": ModelType.TRANSFORMERS_DEID,
-        "model_card": None,
-    })
-    model_service.info.return_value = model_card
-    assert client.get("/readyz").content.decode("utf-8") == ModelType.TRANSFORMERS_DEID
+    model_service_dep = ModelServiceDep(ModelType.TRANSFORMERS_DEID, config)
+    model_service.info.reset_mock()
+
+    with patch.object(cms_globals, "model_service_dep", model_service_dep):
+        assert client.get("/readyz").content.decode("utf-8") == ModelType.TRANSFORMERS_DEID
+    model_service.info.assert_not_called()
 
 
 def test_info():
@@ -1,4 +1,11 @@
+import asyncio
+import anyio
+import pytest
+from anyio import CapacityLimiter
 from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
 from utils import get_settings
 from api.utils import (
     add_exception_handlers,
@@ -6,7 +13,18 @@ from api.utils import (
     get_rate_limiter,
     encrypt,
     decrypt,
+    envelope_decrypt,
+    get_public_key,
+    EnvelopeEncryptor,
+    LocalStreamingResponse,
+    StageTimingMiddleware,
+    StageTimedCapacityLimiter,
+    annotate_docs,
+    get_docs,
 )
+from management.prometheus_metrics import cms_stage_latency
+from management.stage_timings import StageTimings, set_stage_timings, reset_stage_timings, timed_stage
+from tests.app.helper import get_annotations, get_model_service
 
 
 def test_add_exception_handlers():
@@ -31,6 +49,46 @@ def test_add_middlewares():
     assert "Middleware(SlowAPIASGIMiddleware)" in middlewares
 
 
+def test_stage_timing_middleware():
+    app = FastAPI()
+    app.add_middleware(StageTimingMiddleware)
+
+    @app.get("/items/{item_id}")
+    def get_item(item_id: str):
+        with timed_stage("ner_linking"):
+            return {"item_id": item_id}
+
+    client = TestClient(app)
+    observations = cms_stage_latency.labels(handler="/items/{item_id}", stage="ner_linking")._sum.get()
+
+    response = client.get("/items/1")
+
+    assert response.json() == {"item_id": "1"}
+    server_timing = response.headers["Server-Timing"]
+    assert server_timing.startswith("ner_linking;dur=")
+    assert ", total;dur=" in server_timing
+    assert cms_stage_latency.labels(handler="/items/{item_id}", stage="ner_linking")._sum.get() > observations
+
+
+def test_stage_timed_capacity_limiter():
+    timings = StageTimings()
+
+    async def acquire():
+        limiter = StageTimedCapacityLimiter(CapacityLimiter(1))
+        token = set_stage_timings(timings)
+        try:
+            async with limiter:
+                assert limiter.borrowed_tokens == 1
+        finally:
+            reset_stage_timings(token)
+        return limiter
+
+    limiter = anyio.run(acquire)
+
+    assert limiter.borrowed_tokens == 0
+    assert "queueing" in timings.durations
+
+
 def test_get_per_address_rate_limiter():
     limiter = get_rate_limiter(get_settings(), auth_user_enabled=False)
     assert limiter._key_func.__name__ == "get_remote_address"
@@ -89,3 +147,105 @@ cExDsxcGU7ZcTO9WVwDhqF/9ofkXfLOFKxugLNEA5RA3gRcpCxMRLS4k6dfN9N9o
     encrypted = "TLlMBh4GDf3BSsO/RKlqG5H7Sxv7OXGbl8qE/6YLQPm3coBbnrRRReX7pLamnjLPUU0PtIRIg2H/hWBWE/3cRtXDPT7jMtmGHMIPO/95A0DkrndIkOeQ29J6TBPBBG6YqBNRb2dyhDBwDIEDjPTiRe68sYz4KkxzSOkcz31314kSkZvdIDtQOgeRDa0/7U0VrJePL2N7SJvEiHf4Xa3vW3/20S3O8s/Yp0Azb/kS9dFa54VO1fNNhJ46OtPpdekiFDR5yvQfHwFVeSDdY+eAuYLTWa6bz/LrQkRAdRi9EW5Iz/q8WgKhZXQJfcXtiKfVuFar2N2KodY7C/45vMOfvw=="
     decrypted = decrypt(encrypted, fake_private_key_pem)
     assert decrypted == "test"
+
+
+def test_get_public_key():
+    public_key_pem = _get_key_pair()[1]
+
+    assert get_public_key(public_key_pem) is get_public_key(public_key_pem + "\n")
+
+
+def test_envelope_encryption():
+    private_key_pem, public_key_pem = _get_key_pair()
+    encryptor = EnvelopeEncryptor(public_key_pem)
+
+    encrypted = [encryptor.encrypt("test"), encryptor.encrypt("test")]
+
+    assert encrypted[0] != encrypted[1]
+    assert envelope_decrypt(encrypted[0], encryptor.encrypted_data_key, private_key_pem) == "test"
+    assert envelope_decrypt(encrypted[1], encryptor.encrypted_data_key, private_key_pem) == "test"
+    assert EnvelopeEncryptor(public_key_pem).encrypted_data_key != encryptor.encrypted_data_key
+
+
+@pytest.mark.asyncio
+async def test_local_streaming_response_coalesces_writes():
+    async def content():
+        for line in ["line_1\n", "line_2\n", "line_3\n"]:
+            yield line
+
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    await LocalStreamingResponse(content(), media_type="application/x-ndjson")({}, None, send)
+
+    bodies = [message["body"] for message in messages if message["type"] == "http.response.body"]
+    assert messages[0]["type"] == "http.response.start"
+    assert b"".join(bodies) == b"line_1\nline_2\nline_3\n"
+    assert len(bodies) <= 3
+    assert messages[-1]["more_body"] is False
+
+
+@pytest.mark.asyncio
+async def test_local_streaming_response_respects_max_write_size():
+    async def content():
+        for _ in range(10):
+            yield "a" * 10
+
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+        await asyncio.sleep(0)
+
+    await LocalStreamingResponse(content(), max_write_size=25)({}, None, send)
+
+    bodies = [message["body"] for message in messages if message["type"] == "http.response.body" and message["body"]]
+    assert b"".join(bodies) == b"a" * 100
+    assert all(len(body) <= 30 for body in bodies)
+
+
+@pytest.mark.asyncio
+async def test_local_streaming_response_with_empty_content():
+    async def content():
+        return
+        yield
+
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    await LocalStreamingResponse(content())({}, None, send)
+
+    assert messages[0]["type"] == "http.response.start"
+    assert b"Empty stream" in messages[1]["body"]
+
+
+def _get_key_pair():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_key_pem = private_key.private_bytes(encoding=serialization.Encoding.PEM,
+                                                format=serialization.PrivateFormat.PKCS8,
+                                                encryption_algorithm=serialization.NoEncryption()).decode()
+    public_key_pem = private_key.public_key().public_bytes(encoding=serialization.Encoding.PEM,
+                                                           format=serialization.PublicFormat.SubjectPublicKeyInfo).decode()
+    return private_key_pem, public_key_pem
+
+
+def test_get_docs_and_annotate_docs():
+    async def lines():
+        for line in [b'{"name": "doc1", "text": "text_1"}', b"", b"invalid", b'{"text": "text_3"}']:
+            yield line
+
+    async def collect():
+        return [doc async for doc in get_docs(lines())]
+
+    docs = asyncio.run(collect())
+    model_service = get_model_service()
+
+    assert docs[0] == {"name": "doc1", "text": "text_1"}
+    assert docs[1]["error"] == "Invalid JSON Line"
+    assert docs[2] == {"name": "2", "text": "text_3"}
+    assert annotate_docs(model_service, docs, get_settings()) == [get_annotations("text_1"), None, get_annotations("text_3")]
+    model_service.batch_annotate.assert_called_once_with(["text_1", "text_3"])
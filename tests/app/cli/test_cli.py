@@ -1,6 +1,7 @@
 import os
+import json
 import pytest
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 from cli.cli import cmd_app
 from typer.testing import CliRunner
 
@@ -24,6 +25,42 @@ def test_serve_model():
     assert "Start serving model" in result.output
 
 
+def test_benchmark_help():
+    result = runner.invoke(cmd_app, ["benchmark", "--help"])
+    assert result.exit_code == 0
+    assert "This benchmarks the throughput and latency of various CogStack NLP models" in result.output
+
+
+def test_benchmark_model(tmp_path):
+    model_service = Mock()
+    model_service.annotate.return_value = [{"label_name": "Spinal stenosis", "start": 0, "end": 15}]
+    model_service.batch_annotate.side_effect = lambda texts: [[] for _ in texts]
+    output_path = os.path.join(tmp_path, "results.json")
+
+    model_service_type = Mock(return_value=model_service)
+    with patch.dict("cli.cli.model_service_registry", {"medcat_snomed": model_service_type}), patch("cli.cli.shutil.copy2") as copy2:
+        result = runner.invoke(cmd_app, ["benchmark", "--model-type", "medcat_snomed", "--model-path", "model.zip", "--concurrency", "2", "--output-path", output_path])
+
+    assert result.exit_code == 0
+    with open(output_path, "r") as f:
+        results = json.load(f)
+    assert list(results.keys()) == ["annotate", "batch_annotate", "redact", "stream", "redact_stream"]
+    assert all(scenario_results["docs"] == 4 for scenario_results in results.values())
+    assert results["annotate"]["calls"] == 4
+    assert results["batch_annotate"]["calls"] == 1
+    model_service.init_model.assert_called_once()
+    model_service.warm_up.assert_called_once()
+    model_dir = model_service_type.call_args.kwargs["model_parent_dir"]
+    assert copy2.call_args.args == ("model.zip", os.path.join(model_dir, "model.zip"))
+    assert not os.path.exists(model_dir)
+    model_service.close.assert_called_once()
+
+
+def test_benchmark_unknown_scenario():
+    result = runner.invoke(cmd_app, ["benchmark", "--model-type", "medcat_snomed", "--model-path", "model.zip", "--scenario", "unknown"])
+    assert result.exit_code == 1
+
+
 def test_register_help():
     result = runner.invoke(cmd_app, ["register", "--help"])
     assert result.exit_code == 0
@@ -1,5 +1,8 @@
 import time
 import mlflow
+from typing import Any, Dict, List
+from unittest.mock import Mock, create_autospec
+from model_services.base import AbstractModelService
 
 
 def ensure_no_active_run(timeout_seconds: int = 600) -> None:
@@ -20,3 +23,19 @@ def ensure_no_active_run(timeout_seconds: int = 600) -> None:
 class StringContains(str):
     def __eq__(self, other):
         return self in other
+
+
+def get_annotations(text: str) -> List[Dict]:
+    return [{"label_id": text, "start": 0, "end": len(text)}]
+
+
+def get_model_service(**attributes: Any) -> Mock:
+    model_service = create_autospec(AbstractModelService)
+    model_service.model_name = "test model"
+    model_service.model_version = "model_version"
+    model_service.training_in_progress = False
+    model_service.annotate.side_effect = get_annotations
+    model_service.batch_annotate.side_effect = lambda texts: [get_annotations(text) for text in texts]
+    for name, value in attributes.items():
+        setattr(model_service, name, value)
+    return model_service
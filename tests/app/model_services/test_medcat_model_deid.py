@@ -1,10 +1,15 @@
 import os
+import re
 import tempfile
+import threading
 import pytest
-from unittest.mock import Mock
+import torch
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import Mock, patch
 from medcat.cat import CAT
 from config import Settings
-from model_services.medcat_model_deid import MedCATModelDeIdentification
+from management.onnx_runtime import OnnxTokenClassificationModel
+from model_services.medcat_model_deid import MedCATModelDeIdentification, _ThreadLocalNerPipe
 
 
 MODEL_PARENT_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "resources", "model")
@@ -31,6 +36,75 @@ def test_from_model(medcat_model):
     assert new_model_service.model == medcat_model.model
 
 
+class _StubTokenizer(object):
+    pass
+
+
+class _StubNerPipe(object):
+
+    def __init__(self):
+        self.tokenizer = _StubTokenizer()
+        self.task = "ner"
+        self.calls = []
+
+    def __call__(self, text, **kwargs):
+        self.calls.append((text, kwargs))
+        if isinstance(text, list):
+            return [[{"word": t, "tokenizer_id": id(self.tokenizer)}] for t in text]
+        return [{"word": text, "tokenizer_id": id(self.tokenizer)}]
+
+
+def test_thread_local_ner_pipe():
+    ner_pipe = _StubNerPipe()
+    model = Mock()
+    model._addl_ner = [Mock(ner_pipe=ner_pipe)]
+    medcat_model = MedCATModelDeIdentification(Settings(), MODEL_PARENT_DIR, False)
+    medcat_model.model = model
+    thread_local_ner_pipe = model._addl_ner[0].ner_pipe
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        barrier = threading.Barrier(2)
+
+        def call(text):
+            barrier.wait()
+            return thread_local_ner_pipe(text)[0]
+
+        results = list(executor.map(call, ["text_1", "text_2"]))
+
+    assert isinstance(thread_local_ner_pipe, _ThreadLocalNerPipe)
+    assert thread_local_ner_pipe.task == "ner"
+    assert [result["word"] for result in results] == ["text_1", "text_2"]
+    assert results[0]["tokenizer_id"] != results[1]["tokenizer_id"]
+    assert id(ner_pipe.tokenizer) not in [result["tokenizer_id"] for result in results]
+
+
+def test_info_leaves_cached_model_card_unchanged(medcat_model):
+    cached_model_card = {"Basic CDB Stats": {"Average training examples per concept": 10}}
+
+    with patch.object(medcat_model, "_get_model_card", return_value=cached_model_card):
+        model_card = medcat_model.info()
+
+    assert model_card.model_card["Basic CDB Stats"]["Average training examples per concept"] == 0
+    assert cached_model_card["Basic CDB Stats"]["Average training examples per concept"] == 10
+
+
+def test_prepare_served_model_warns_on_onnx_with_quantisation(medcat_model, caplog):
+    medcat_model._config.ENABLE_ONNX_RUNTIME = "true"
+    medcat_model._config.ENABLE_DYNAMIC_QUANTISATION = "true"
+    medcat_model._config.DEVICE = "cpu"
+    medcat_model._model = Mock()
+    medcat_model._model._addl_ner = [Mock(ner_pipe=Mock(model=Mock(spec=OnnxTokenClassificationModel)))]
+    medcat_model._model._meta_cats = []
+
+    with patch.object(medcat_model, "_install_onnx_models"), \
+         patch("model_services.medcat_model_deid.apply_dynamic_quantisation") as apply_dynamic_quantisation, \
+         patch("model_services.medcat_model_deid._install_thread_local_ner_pipes"):
+        medcat_model._prepare_served_model()
+
+    apply_dynamic_quantisation.assert_called_once()
+    assert "will not be quantised" in caplog.text
+
+
 @pytest.mark.skipif(not os.path.exists(os.path.join(MODEL_PARENT_DIR, "deid_model.zip")),
                     reason="requires the model file to be present in the resources folder")
 def test_init_model(medcat_model):
@@ -122,3 +196,143 @@ def test_train_supervised(medcat_model):
     with tempfile.TemporaryFile("r+") as f:
         medcat_model.train_supervised(f, 1, 1, "training_id", "input_file_name")
     medcat_model._supervised_trainer.train.assert_called()
+
+
+def test_thread_local_ner_pipe_prefetch():
+    ner_pipe = _StubNerPipe()
+    thread_local_ner_pipe = _ThreadLocalNerPipe(ner_pipe)
+
+    thread_local_ner_pipe.prefetch(["text_1", "text_2", "text_1", " "], 8, aggregation_strategy="simple")
+    results = [thread_local_ner_pipe("text_2"), thread_local_ner_pipe("text_1")]
+    thread_local_ner_pipe.clear()
+    thread_local_ner_pipe("text_1")
+
+    assert ner_pipe.calls[0] == (["text_1", "text_2"], {"batch_size": 8, "aggregation_strategy": "simple"})
+    assert [result[0]["word"] for result in results] == ["text_2", "text_1"]
+    assert ner_pipe.calls[1] == ("text_1", {})
+    assert len(ner_pipe.calls) == 2
+
+
+def test_thread_local_ner_pipe_forwards_attribute_writes():
+    ner_pipe = _StubNerPipe()
+    ner_pipe.model = "torch model"
+    thread_local_ner_pipe = _ThreadLocalNerPipe(ner_pipe)
+    thread_local_ner_pipe("text")
+
+    thread_local_ner_pipe.model = "onnx model"
+
+    assert ner_pipe.model == "onnx model"
+    assert thread_local_ner_pipe._get_ner_pipe().model == "onnx model"
+
+
+def test_swap_model_serves_onnx_model(medcat_model):
+    medcat_model._config.ENABLE_ONNX_RUNTIME = "true"
+    medcat_model._config.DEVICE = "cpu"
+    ner_pipe = _StubNerPipe()
+    ner_pipe.model = "torch model"
+    model = Mock()
+    model._addl_ner = [Mock(ner_pipe=ner_pipe)]
+    onnx_model = Mock(spec=OnnxTokenClassificationModel)
+
+    with patch("model_services.medcat_model_deid.get_onnx_model", return_value=onnx_model), \
+         patch.object(medcat_model._model_swapper, "swap", return_value={}), \
+         patch.object(medcat_model, "_get_model_card"):
+        medcat_model.swap_model(model)
+
+    served_ner_pipe = model._addl_ner[0].ner_pipe
+    assert isinstance(served_ner_pipe, _ThreadLocalNerPipe)
+    assert served_ner_pipe._get_ner_pipe().model is onnx_model
+
+
+def test_swap_model_serves_quantised_model(medcat_model):
+    medcat_model._config.ENABLE_DYNAMIC_QUANTISATION = "true"
+    medcat_model._config.DEVICE = "cpu"
+    ner_pipe = _StubNerPipe()
+    ner_pipe.model = torch.nn.Sequential(torch.nn.Linear(16, 16))
+    model = Mock()
+    model._addl_ner = [Mock(ner_pipe=ner_pipe, model=ner_pipe.model)]
+    model._meta_cats = []
+
+    with patch("management.quantisation._get_latency", return_value=0.0), \
+         patch.object(medcat_model._model_swapper, "swap", return_value={}), \
+         patch.object(medcat_model, "_get_model_card"):
+        medcat_model.swap_model(model)
+
+    assert isinstance(model._addl_ner[0].ner_pipe._get_ner_pipe().model[0], torch.ao.nn.quantized.dynamic.Linear)
+    assert model._addl_ner[0].model is ner_pipe.model
+
+
+class _StubWordPieceTokenizer(object):
+
+    def __init__(self):
+        self.vocab = {}
+
+    def encode(self, text):
+        input_ids = []
+        offset_mapping = []
+        for match in re.finditer(r"\S+", text):
+            for start in range(match.start(), match.end(), 3):
+                piece = (" " if start == match.start() else "") + text[start:min(start + 3, match.end())]
+                input_ids.append(self.vocab.setdefault(piece, len(self.vocab)))
+                offset_mapping.append((start, min(start + 3, match.end())))
+        return input_ids, offset_mapping
+
+    def decode(self, input_ids, skip_special_tokens=True):
+        pieces = {input_id: piece for piece, input_id in self.vocab.items()}
+        return "".join(pieces[input_id] for input_id in input_ids)
+
+
+def _plan_baseline_chunks(tokenizer, text, chunk_size, left_context_words):
+    # the chunking done by the original per-token loop of annotate
+    leading_ws_len = len(text) - len(text.lstrip())
+    text = text.lstrip()
+    input_ids, offset_mapping = tokenizer.encode(text)
+    chunks = []
+    chunk = []
+    processed_char_len = leading_ws_len
+    for input_id, (start, end) in zip(input_ids, offset_mapping):
+        chunk.append((input_id, (start, end)))
+        if len(chunk) == chunk_size:
+            last_token_start_idx = 0
+            window_overlap_start_idx = 0
+            number_of_seen_words = 0
+            for i in range(chunk_size - 1, -1, -1):
+                if " " in tokenizer.decode([chunk[i][0]], skip_special_tokens=True):
+                    if last_token_start_idx == 0:
+                        last_token_start_idx = i
+                    if number_of_seen_words < left_context_words:
+                        window_overlap_start_idx = i
+                    else:
+                        break
+                    number_of_seen_words += 1
+            c_text = text[chunk[:last_token_start_idx][0][1][0]:chunk[:last_token_start_idx][-1][1][1]]
+            chunks.append((c_text, processed_char_len, chunk[window_overlap_start_idx][1][0]))
+            processed_char_len = chunk[:window_overlap_start_idx][-1][1][1] + leading_ws_len + 1
+            chunk = chunk[window_overlap_start_idx:]
+    if chunk:
+        c_text = text[chunk[0][1][0]:chunk[-1][1][1]]
+        chunks.append((c_text, processed_char_len, None))
+        processed_char_len += len(c_text)
+    return chunks, processed_char_len
+
+
+@pytest.mark.parametrize("text", [
+    "  " + " ".join(f"Patient{i} John Smith was seen at St Mary's Hospital on 12/03/2020 by Dr Jones." for i in range(40)),
+    " ".join(f"w{i % 10}" for i in range(20)),
+    " ".join(f"w{i % 10}" for i in range(40)),
+    " ".join(f"w{i % 10}" for i in range(80)),
+])
+def test_plan_chunks_matches_baseline_chunking(medcat_model, text):
+    tokenizer = _StubWordPieceTokenizer()
+    medcat_model._model = Mock()
+    medcat_model._model._addl_ner = [Mock(tokenizer=Mock(hf_tokenizer=tokenizer))]
+    stripped_text = text.lstrip()
+    input_ids, offset_mapping = tokenizer.encode(stripped_text)
+
+    with patch.object(MedCATModelDeIdentification, "CHUNK_SIZE", 20):
+        chunks = medcat_model._plan_chunks(text, len(text) - len(stripped_text), stripped_text, input_ids, offset_mapping)
+        baseline_chunks = _plan_baseline_chunks(tokenizer, text, 20, MedCATModelDeIdentification.LEFT_CONTEXT_WORDS)
+
+    assert len(chunks[0]) > 1
+    assert chunks == baseline_chunks
+    assert chunks[1] == len(text)
@@ -57,6 +57,28 @@ def test_get_records_from_doc(medcat_model):
     assert records[0]["meta_anns"] == {}
 
 
+def test_get_records_from_doc_with_multiple_icd10_codes(medcat_model):
+    records = medcat_model.get_records_from_doc({
+        "entities":
+            {
+                "0": {
+                    "pretty_name": "pretty_name",
+                    "cui": "cui",
+                    "icd10": ["code_1", "code_2"],
+                    "meta_anns": {},
+                },
+                "1": {
+                    "pretty_name": "pretty_name",
+                    "cui": "cui",
+                    "icd10": [],
+                    "meta_anns": {},
+                },
+            }
+    })
+    assert [record["label_id"] for record in records] == ["code_1", "code_2"]
+    assert all(record["label_name"] == "pretty_name" for record in records)
+
+
 @pytest.mark.skipif(not os.path.exists(os.path.join(MODEL_PARENT_DIR, "icd10_model.zip")),
                     reason="requires the model file to be present in the resources folder")
 def test_init_model_with_no_tui_filter(medcat_model):
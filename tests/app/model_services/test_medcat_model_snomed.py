@@ -1,10 +1,13 @@
 import os
+import gc
 import tempfile
 import pytest
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 from medcat.cat import CAT
 from config import Settings
 from model_services.medcat_model_snomed import MedCATModelSnomed
+from model_services.medcat_model import _time_meta_cat_stages
+from management.stage_timings import StageTimings, set_stage_timings, reset_stage_timings
 
 
 MODEL_PARENT_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "resources", "model")
@@ -52,6 +55,151 @@ def test_get_records_from_doc(medcat_model):
     assert records[0]["meta_anns"] == {}
 
 
+def test_get_records_from_doc_with_meta_annotations_and_span_text(medcat_model):
+    medcat_model._config.INCLUDE_SPAN_TEXT = "true"
+    meta_anns = {"Status": {"value": "Affirmed", "confidence": 0.9, "name": "Status"}}
+    records = medcat_model.get_records_from_doc({
+        "entities": {
+            "0": {
+                "pretty_name": "pretty_name",
+                "cui": "cui",
+                "source_value": "source_value",
+                "acc": 1.0,
+                "start": 0,
+                "end": 12,
+                "meta_anns": meta_anns,
+            }
+        }
+    })
+    assert records == [{
+        "label_name": "pretty_name",
+        "label_id": "cui",
+        "text": "source_value",
+        "accuracy": 1.0,
+        "start": 0,
+        "end": 12,
+        "meta_anns": meta_anns,
+        "Status": "Affirmed",
+    }]
+
+
+class _StubCAT(object):
+
+    def get_entities(self, text, addl_info):
+        return self.get_entities_multi_texts([text], addl_info)[0]
+
+    def get_entities_multi_texts(self, texts, addl_info):
+        return [{"entities": {0: {"pretty_name": text, "cui": "cui", "meta_anns": {}, "pid": os.getpid()}}} for text in texts]
+
+
+def _enable_batch_pool(medcat_model):
+    medcat_model._model = _StubCAT()
+    medcat_model._config.BATCH_POOL_PROCESSES = 2
+    medcat_model._batch_pool_enabled = True
+    medcat_model._batch_pool_pid = os.getpid()
+
+
+def test_batch_annotate_with_batch_pool(medcat_model):
+    _enable_batch_pool(medcat_model)
+    texts = [f"text_{i}" * (i + 1) for i in range(10)]
+
+    try:
+        assert medcat_model.batch_annotate(texts)[0][0]["pid"] == os.getpid()
+        assert medcat_model._batch_pool is None
+
+        medcat_model.warm_up([])
+        annotations_list = medcat_model.batch_annotate(texts)
+
+        assert medcat_model._batch_pool_size == 2
+        assert gc.get_freeze_count() > 0
+    finally:
+        medcat_model.close()
+        gc.unfreeze()
+
+    assert [annotations[0]["label_name"] for annotations in annotations_list] == texts
+    assert all(annotations[0]["pid"] != os.getpid() for annotations in annotations_list)
+    assert medcat_model._batch_pool is None
+
+
+def test_warm_up_drains_previous_batch_pool(medcat_model):
+    _enable_batch_pool(medcat_model)
+    try:
+        previous_pool = medcat_model._start_batch_pool()
+        in_flight = medcat_model._submit_shard(previous_pool, ["text_1"])
+
+        timings = medcat_model.warm_up(["text_2"])
+
+        assert in_flight.result()[0][0]["label_name"] == "text_1"
+        assert medcat_model._batch_pool is not previous_pool
+        assert "batch_pool" in timings
+    finally:
+        medcat_model.close()
+        gc.unfreeze()
+
+
+def test_restart_broken_batch_pool_once(medcat_model):
+    _enable_batch_pool(medcat_model)
+    try:
+        broken_pool = medcat_model._start_batch_pool()
+        restarted_pool = medcat_model._restart_broken_batch_pool(broken_pool)
+
+        assert restarted_pool is not broken_pool
+        assert medcat_model._restart_broken_batch_pool(broken_pool) is restarted_pool
+    finally:
+        medcat_model.close()
+        gc.unfreeze()
+
+
+def test_swap_model_restarts_batch_pool(medcat_model):
+    _enable_batch_pool(medcat_model)
+    new_model = _StubCAT()
+    try:
+        previous_pool = medcat_model._start_batch_pool()
+        with patch.object(MedCATModelSnomed, "_prepare_served_model"), \
+             patch.object(medcat_model._model_swapper, "swap", side_effect=lambda model_service, model, *args: setattr(model_service, "_model", model)), \
+             patch.object(medcat_model, "_get_model_card"):
+            medcat_model.swap_model(new_model)
+
+        assert medcat_model._batch_pool is not previous_pool
+        assert medcat_model._batch_pool_model is new_model
+    finally:
+        medcat_model.close()
+        gc.unfreeze()
+
+
+def test_batch_annotate_without_batch_pool(medcat_model):
+    medcat_model._model = _StubCAT()
+
+    annotations_list = medcat_model.batch_annotate(["text_1", "text_2"])
+
+    assert [annotations[0]["label_name"] for annotations in annotations_list] == ["text_1", "text_2"]
+    assert annotations_list[0][0]["pid"] == os.getpid()
+
+
+def test_swap_model_prepares_retrained_model(medcat_model):
+    medcat_model._model = _StubCAT()
+    new_model = Mock()
+    prepared = []
+
+    def prepare_served_model(model_service, retrained=False):
+        prepared.append((model_service.model, retrained))
+
+    with patch.object(MedCATModelSnomed, "_prepare_served_model", autospec=True, side_effect=prepare_served_model), \
+         patch.object(medcat_model._model_swapper, "swap", return_value={"model_swap_duration_seconds": 0.1}) as swap, \
+         patch.object(medcat_model, "_get_model_card"):
+        assert medcat_model.swap_model(new_model) == {"model_swap_duration_seconds": 0.1}
+
+    assert prepared == [(new_model, True)]
+    warm_up_service = swap.call_args.args[2]
+    assert isinstance(warm_up_service, MedCATModelSnomed)
+    assert warm_up_service.model is new_model
+    assert warm_up_service._config is medcat_model._config
+
+
+def test_get_records_from_empty_doc(medcat_model):
+    assert medcat_model.get_records_from_doc({"entities": {}}) == []
+
+
 @pytest.mark.skipif(not os.path.exists(os.path.join(MODEL_PARENT_DIR, "snomed_model.zip")),
                     reason="requires the model file to be present in the resources folder")
 def test_init_model(medcat_model):
@@ -89,6 +237,58 @@ def test_info(medcat_model):
     assert model_card.model_type == "MedCAT"
 
 
+def test_info_with_cached_model_card(medcat_model):
+    model = Mock()
+    model.get_model_card.return_value = {"Model ID": "model_1"}
+    medcat_model.model = model
+
+    assert medcat_model.info().model_card == {"Model ID": "model_1"}
+    assert medcat_model.info().model_card == {"Model ID": "model_1"}
+    model.get_model_card.assert_called_once_with(as_dict=True)
+
+    new_model = Mock()
+    new_model.get_model_card.return_value = {"Model ID": "model_2"}
+    medcat_model.model = new_model
+
+    assert medcat_model.info().model_card == {"Model ID": "model_2"}
+
+
+def test_annotate_with_stage_timings(medcat_model):
+    medcat_model.model = Mock()
+    medcat_model.model.get_entities.return_value = {"entities": {}}
+    timings = StageTimings()
+    token = set_stage_timings(timings)
+    try:
+        assert medcat_model.annotate("Spinal stenosis") == []
+    finally:
+        reset_stage_timings(token)
+
+    assert set(timings.durations.keys()) == {"ner_linking", "get_records_from_doc"}
+
+
+def test_time_meta_cat_stages():
+    class _MetaCAT(object):
+
+        def pipe(self, stream, *args, **kwargs):
+            for doc in stream:
+                yield f"{doc} with meta annotations"
+
+        def __call__(self, doc):
+            return next(self.pipe(iter([doc])))
+
+    meta_cat = _MetaCAT()
+    _time_meta_cat_stages(Mock(_meta_cats=[meta_cat]))
+    timings = StageTimings()
+    token = set_stage_timings(timings)
+    try:
+        assert meta_cat("doc") == "doc with meta annotations"
+        assert list(meta_cat.pipe(iter(["doc_1", "doc_2"]))) == ["doc_1 with meta annotations", "doc_2 with meta annotations"]
+    finally:
+        reset_stage_timings(token)
+
+    assert set(timings.durations.keys()) == {"ner_linking", "meta_cat"}
+
+
 @pytest.mark.skipif(not os.path.exists(os.path.join(MODEL_PARENT_DIR, "snomed_model.zip")),
                     reason="requires the model file to be present in the resources folder")
 def test_annotate(medcat_model):
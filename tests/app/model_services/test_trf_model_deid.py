@@ -1,5 +1,7 @@
 import os
 import pytest
+import torch
+from transformers import BertConfig, BertTokenizerFast
 from transformers.models.bert.modeling_bert import BertForTokenClassification
 from medcat.tokenizers.transformers_ner import TransformersTokenizerNER
 from config import Settings
@@ -16,6 +18,28 @@ def trf_model():
     return TransformersModelDeIdentification(config, MODEL_PARENT_DIR)
 
 
+@pytest.fixture(scope="function")
+def tiny_trf_model(tmp_path):
+    vocab_path = os.path.join(tmp_path, "vocab.txt")
+    with open(vocab_path, "w") as f:
+        f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "nw1", "2da", "john", "smith", "seen", "on", "##s", "."]))
+    hf_tokenizer = BertTokenizerFast(vocab_path)
+    id2type = {token_id: "sub" if token.startswith("##") else "start" for token, token_id in hf_tokenizer.vocab.items()}
+    tokenizer = TransformersTokenizerNER(hf_tokenizer, max_len=8, id2type=id2type, cui2name={"A": "Label A", "B": "Label B"})
+    tokenizer.label_map.update({"A": 2, "B": 3})
+    torch.manual_seed(0)
+    model_config = BertConfig(vocab_size=len(hf_tokenizer), hidden_size=16, num_hidden_layers=1, num_attention_heads=2, intermediate_size=32, num_labels=4)
+    config = Settings()
+    config.DEVICE = "cpu"
+    config.INCLUDE_SPAN_TEXT = "true"
+    trf_model = TransformersModelDeIdentification(config, MODEL_PARENT_DIR)
+    trf_model._tokenizer = tokenizer
+    trf_model.model = BertForTokenClassification(model_config).eval()
+    trf_model._id2cui = {cui_id: cui for cui, cui_id in tokenizer.label_map.items()}
+    trf_model._id2token, trf_model._skipped_token_ids = trf_model._get_token_lookups(tokenizer)
+    return trf_model
+
+
 def test_model_name(trf_model):
     assert trf_model.model_name == "De-identification model"
 
@@ -70,3 +94,22 @@ def test_batch_annotate(trf_model):
     assert type(annotation_list[1][0]["label_name"]) is str
     assert annotation_list[0][0]["start"] == annotation_list[1][0]["start"] == 0
     assert annotation_list[0][0]["end"] == annotation_list[1][0]["end"] == 7
+
+
+def test_batch_annotate_with_chunks_of_mixed_lengths(tiny_trf_model):
+    texts = ["john smith seen on nw1 2da . " * 5, "", "john", "nw1 2da seen . johns smith on . nw1"]
+
+    annotation_list = tiny_trf_model.batch_annotate(texts)
+
+    assert len(annotation_list) == 4
+    assert annotation_list[1] == []
+    assert annotation_list == [tiny_trf_model.annotate(text) for text in texts]
+    for text, annotations in zip(texts, annotation_list):
+        for annotation in annotations:
+            assert annotation["text"] == text[annotation["start"]:annotation["end"]]
+
+
+def test_get_length_bucketed_batches():
+    batches = TransformersModelDeIdentification._get_length_bucketed_batches([3, 8, 1, 8, 5], 2)
+
+    assert batches == [[1, 3], [4, 0], [2]]
@@ -0,0 +1,103 @@
+import threading
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from management.annotation_cache import AnnotationCache, get_annotation_cache
+from config import Settings
+from tests.app.helper import get_annotations, get_model_service
+
+
+@pytest.fixture(scope="function")
+def model_service():
+    return get_model_service()
+
+
+def test_annotate_from_cache(model_service):
+    cache = AnnotationCache(1024 * 1024, Settings())
+
+    first = cache.annotate(model_service, "text")
+    second = cache.annotate(model_service, "text")
+
+    assert first == second == [{"label_id": "text", "start": 0, "end": 4}]
+    assert first is not second
+    model_service.annotate.assert_called_once_with("text")
+
+
+def test_annotate_with_different_settings(model_service):
+    config = Settings()
+    cache = AnnotationCache(1024 * 1024, config)
+
+    cache.annotate(model_service, "text")
+    config.INCLUDE_SPAN_TEXT = "true" if config.INCLUDE_SPAN_TEXT != "true" else "false"
+    cache.annotate(model_service, "text")
+
+    assert model_service.annotate.call_count == 2
+
+
+def test_annotate_with_single_flight(model_service):
+    cache = AnnotationCache(1024 * 1024, Settings())
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_annotate(text):
+        started.set()
+        release.wait(5)
+        return get_annotations(text)
+
+    model_service.annotate.side_effect = slow_annotate
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        first = executor.submit(cache.annotate, model_service, "text")
+        started.wait(5)
+        second = executor.submit(cache.annotate, model_service, "text")
+        release.set()
+        assert first.result() == second.result()
+
+    model_service.annotate.assert_called_once_with("text")
+
+
+def test_evict_least_recently_used(model_service):
+    entry_size = len(AnnotationCache._serialise([{"label_id": "text_1", "start": 0, "end": 6}])) + 256
+    cache = AnnotationCache(entry_size * 2, Settings())
+
+    cache.annotate(model_service, "text_1")
+    cache.annotate(model_service, "text_2")
+    cache.annotate(model_service, "text_1")
+    cache.annotate(model_service, "text_3")
+    cache.annotate(model_service, "text_1")
+    cache.annotate(model_service, "text_2")
+
+    assert [call.args[0] for call in model_service.annotate.call_args_list] == ["text_1", "text_2", "text_3", "text_2"]
+    assert cache.size <= entry_size * 2
+
+
+def test_batch_annotate_with_partial_hits(model_service):
+    cache = AnnotationCache(1024 * 1024, Settings())
+    cache.annotate(model_service, "text_1")
+
+    annotations_list = cache.batch_annotate(model_service, ["text_1", "text_2", "text_2", "text_3"])
+
+    assert [annotations[0]["label_id"] for annotations in annotations_list] == ["text_1", "text_2", "text_2", "text_3"]
+    model_service.batch_annotate.assert_called_once_with(["text_2", "text_3"])
+
+
+def test_invalidate(model_service):
+    cache = AnnotationCache(1024 * 1024, Settings())
+    cache.annotate(model_service, "text")
+
+    cache.invalidate(model_service)
+    cache.annotate(model_service, "text")
+
+    assert model_service.annotate.call_count == 2
+    assert cache.size > 0
+
+
+def test_propagate_exception(model_service):
+    cache = AnnotationCache(1024 * 1024, Settings())
+    model_service.annotate.side_effect = ValueError("failed")
+
+    with pytest.raises(ValueError, match="failed"):
+        cache.annotate(model_service, "text")
+    assert cache.size == 0
+
+
+def test_get_annotation_cache():
+    assert get_annotation_cache() is get_annotation_cache()
@@ -0,0 +1,57 @@
+import os
+import json
+import time
+import pytest
+from unittest.mock import patch
+from management.benchmark import Benchmark, get_corpus, get_percentile
+
+
+def test_get_corpus(tmp_path):
+    corpus_file_path = os.path.join(tmp_path, "corpus.txt")
+    with open(corpus_file_path, "w") as f:
+        f.write(json.dumps({"name": "doc1", "text": "Spinal stenosis"}) + "\n\nDiabetes mellitus\n")
+
+    assert get_corpus(corpus_file_path) == ["Spinal stenosis", "Diabetes mellitus"]
+
+
+def test_get_percentile():
+    latencies = [float(latency) for latency in range(1, 101)]
+
+    assert get_percentile(latencies, 50) == 50.0
+    assert get_percentile(latencies, 95) == 95.0
+    assert get_percentile(latencies, 99) == 99.0
+    assert get_percentile([], 99) == 0.0
+
+
+def test_run():
+    batches = []
+    benchmark = Benchmark(["Spinal stenosis", "Diabetes mellitus", "Hypertension"], concurrency=2, repeats=2)
+
+    results = benchmark.run("batch_annotate", lambda batch: batches.append(batch) or time.sleep(0.01), batch_size=4)
+
+    assert sorted(len(batch) for batch in batches) == [2, 4]
+    assert results["docs"] == 6
+    assert results["calls"] == 2
+    assert results["docs_per_second"] == pytest.approx(6 / results["duration_seconds"])
+    assert results["chars_per_second"] == pytest.approx(2 * 44 / results["duration_seconds"])
+    assert 0.01 <= results["latency_p50_seconds"] <= results["latency_p95_seconds"] <= results["latency_p99_seconds"]
+    assert results["peak_rss_bytes"] > 0
+
+
+def test_sample_peak_rss_per_scenario():
+    rss = {"value": 100}
+    benchmark = Benchmark(["Spinal stenosis"], rss_sample_interval=0.01)
+
+    def allocate(_):
+        rss["value"] = 500
+        time.sleep(0.2)
+        rss["value"] = 100
+
+    with patch("management.benchmark.get_rss_bytes", side_effect=lambda: rss["value"]):
+        assert benchmark.run("annotate", allocate)["peak_rss_bytes"] == 500
+        assert benchmark.run("annotate", lambda _: time.sleep(0.05))["peak_rss_bytes"] == 100
+
+
+def test_run_with_empty_corpus():
+    with pytest.raises(ValueError):
+        Benchmark([])
@@ -0,0 +1,49 @@
+from prometheus_client import REGISTRY
+from management.metrics_aggregator import QualityMetricsAggregator, SpaceSavingSketch
+
+
+def test_space_saving_sketch():
+    sketch = SpaceSavingSketch(2)
+
+    assert sketch.add("a") is None
+    assert sketch.add("a") is None
+    assert sketch.add("b") is None
+    assert sketch.add("c") == "b"
+    assert sketch.add("c") is None
+
+    assert "b" not in sketch
+    assert sketch.top() == [("c", 3, 1), ("a", 2, 0)]
+    assert sketch.top(1) == [("c", 3, 1)]
+
+
+def test_aggregate_document_metrics():
+    aggregator = QualityMetricsAggregator(window_size=3, start=False)
+    for accuracy in [0.1, 0.2, 0.6, 0.7]:
+        aggregator.record("/test_doc", [
+            {"label_id": "c1", "accuracy": accuracy, "meta_anns": {"Status": {"confidence": accuracy}}},
+            {"label_id": "c2", "accuracy": accuracy, "meta_anns": {"Status": {"confidence": 1.0}}},
+        ])
+    aggregator.record("/test_doc", [])
+
+    aggregator.flush()
+
+    assert abs(REGISTRY.get_sample_value("cms_avg_anno_acc_per_doc", {"handler": "/test_doc"}) - 0.5) < 1e-9
+    assert abs(REGISTRY.get_sample_value("cms_avg_meta_anno_conf_per_doc", {"handler": "/test_doc"}) - 0.75) < 1e-9
+    assert REGISTRY.get_sample_value("cms_anno_acc_per_doc_quantile", {"handler": "/test_doc", "quantile": "0.05"}) == 0.2
+    assert REGISTRY.get_sample_value("cms_anno_acc_per_doc_quantile", {"handler": "/test_doc", "quantile": "0.95"}) == 0.7
+    assert REGISTRY.get_sample_value("cms_avg_anno_acc_per_concept", {"handler": "/test_doc", "concept": "c1"}) is None
+
+
+def test_aggregate_top_k_concept_metrics():
+    aggregator = QualityMetricsAggregator(top_k=2, per_concept=True, start=False)
+    aggregator.record("/test_concept", [{"label_id": "c1", "accuracy": 0.8}, {"label_id": "c1", "accuracy": 0.6}, {"label_id": "c2", "accuracy": 0.5}])
+    aggregator.flush()
+
+    assert abs(REGISTRY.get_sample_value("cms_avg_anno_acc_per_concept", {"handler": "/test_concept", "concept": "c1"}) - 0.7) < 1e-9
+    assert REGISTRY.get_sample_value("cms_avg_anno_acc_per_concept", {"handler": "/test_concept", "concept": "c2"}) == 0.5
+
+    aggregator.record("/test_concept", [{"label_id": "c3", "accuracy": 0.9}])
+    aggregator.flush()
+
+    assert REGISTRY.get_sample_value("cms_avg_anno_acc_per_concept", {"handler": "/test_concept", "concept": "c2"}) is None
+    assert REGISTRY.get_sample_value("cms_avg_anno_acc_per_concept", {"handler": "/test_concept", "concept": "c3"}) == 0.9
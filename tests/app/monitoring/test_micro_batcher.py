@@ -0,0 +1,95 @@
+import threading
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from management.micro_batcher import MicroBatcher, close_micro_batcher, get_micro_batcher
+from config import Settings
+from tests.app.helper import get_annotations, get_model_service
+
+
+@pytest.fixture(scope="function")
+def model_service():
+    return get_model_service()
+
+
+def test_annotate_single_document(model_service):
+    micro_batcher = MicroBatcher(model_service, max_wait_ms=1)
+
+    assert micro_batcher.annotate("text") == get_annotations("text")
+    model_service.annotate.assert_called_once_with("text")
+    model_service.batch_annotate.assert_not_called()
+
+
+def test_coalesce_concurrent_documents(model_service):
+    micro_batcher = MicroBatcher(model_service, max_wait_ms=500, max_docs=4)
+    texts = [f"text_{i}" for i in range(4)]
+    barrier = threading.Barrier(len(texts))
+
+    def annotate(text):
+        barrier.wait()
+        return micro_batcher.annotate(text)
+
+    with ThreadPoolExecutor(max_workers=len(texts)) as executor:
+        results = list(executor.map(annotate, texts))
+
+    assert results == [get_annotations(text) for text in texts]
+    batched_texts = [text for call in model_service.batch_annotate.call_args_list for text in call.args[0]]
+    single_texts = [call.args[0] for call in model_service.annotate.call_args_list]
+    assert sorted(batched_texts + single_texts) == texts
+    assert model_service.batch_annotate.call_count >= 1
+
+
+def test_respect_max_chars(model_service):
+    micro_batcher = MicroBatcher(model_service, max_wait_ms=200, max_chars=10)
+    texts = ["a" * 8, "b" * 8]
+    barrier = threading.Barrier(len(texts))
+
+    def annotate(text):
+        barrier.wait()
+        return micro_batcher.annotate(text)
+
+    with ThreadPoolExecutor(max_workers=len(texts)) as executor:
+        results = list(executor.map(annotate, texts))
+
+    assert results == [get_annotations(text) for text in texts]
+    model_service.batch_annotate.assert_not_called()
+    assert model_service.annotate.call_count == 2
+
+
+def test_propagate_exception(model_service):
+    model_service.annotate.side_effect = ValueError("failed")
+    micro_batcher = MicroBatcher(model_service, max_wait_ms=1)
+
+    with pytest.raises(ValueError, match="failed"):
+        micro_batcher.annotate("text")
+
+
+def test_get_micro_batcher(model_service):
+    config = Settings()
+
+    micro_batcher = get_micro_batcher(model_service, config)
+
+    assert isinstance(micro_batcher, MicroBatcher)
+    assert get_micro_batcher(model_service, config) is micro_batcher
+
+
+def test_close(model_service):
+    micro_batcher = MicroBatcher(model_service, max_wait_ms=1)
+    assert micro_batcher.annotate("text") == get_annotations("text")
+
+    micro_batcher.close()
+    micro_batcher._worker.join(timeout=5)
+
+    assert not micro_batcher._worker.is_alive()
+    with pytest.raises(RuntimeError, match="closed"):
+        micro_batcher.annotate("text")
+
+
+def test_close_micro_batcher(model_service):
+    config = Settings()
+    micro_batcher = get_micro_batcher(model_service, config)
+
+    close_micro_batcher(model_service)
+    micro_batcher._worker.join(timeout=5)
+
+    assert not micro_batcher._worker.is_alive()
+    assert get_micro_batcher(model_service, config) is not micro_batcher
@@ -0,0 +1,131 @@
+import threading
+import time
+import pytest
+from unittest.mock import patch
+from prometheus_client import REGISTRY
+from config import Settings
+from management.model_host import ModelHost
+from tests.app.helper import get_model_service
+
+
+def _get_model_host(memory_budget_bytes=0, load_memory_bytes=100):
+    rss = {"value": 0}
+    loaded = []
+
+    def create_model_service(model_type, model_file_path, model_name):
+        rss["value"] += load_memory_bytes
+        loaded.append(model_type)
+        return get_model_service(model_type=model_type, model_file_path=model_file_path)
+
+    model_host = ModelHost(Settings(), memory_budget_bytes, model_service_factory=create_model_service)
+    model_host.register("medcat_snomed", "snomed.zip", "SNOMED model")
+    model_host.register("medcat_umls", "umls.zip")
+    model_host.register("medcat_deid", "deid.zip")
+    return model_host, loaded, rss
+
+
+def _get_residency(model_host):
+    return {model_type: REGISTRY.get_sample_value("cms_hosted_model_resident", {"model_type": model_type}) == 1 for model_type in model_host.model_types}
+
+
+def test_load_lazily():
+    model_host, loaded, rss = _get_model_host()
+    with patch("management.model_host.get_rss_bytes", side_effect=lambda: rss["value"]):
+        assert loaded == []
+        model_service = model_host.get_model_service("medcat_umls")
+        assert model_host.get_model_service("medcat_umls") is model_service
+
+    assert model_service.model_file_path == "umls.zip"
+    assert loaded == ["medcat_umls"]
+    assert _get_residency(model_host) == {"medcat_snomed": False, "medcat_umls": True, "medcat_deid": False}
+    assert REGISTRY.get_sample_value("cms_hosted_model_memory_bytes", {"model_type": "medcat_umls"}) == 100
+    assert REGISTRY.get_sample_value("cms_hosted_model_load_duration_seconds", {"model_type": "medcat_umls"}) >= 0
+
+
+def test_evict_least_recently_used():
+    model_host, loaded, rss = _get_model_host(memory_budget_bytes=250)
+    with patch("management.model_host.get_rss_bytes", side_effect=lambda: rss["value"]):
+        snomed_service = model_host.get_model_service("medcat_snomed")
+        model_host.get_model_service("medcat_umls")
+        model_host.get_model_service("medcat_snomed")
+        model_host.get_model_service("medcat_deid")
+
+    assert _get_residency(model_host) == {"medcat_snomed": True, "medcat_umls": False, "medcat_deid": True}
+    assert model_host.get_model_service("medcat_snomed") is snomed_service
+    snomed_service.close.assert_not_called()
+
+    with patch("management.model_host.get_rss_bytes", side_effect=lambda: rss["value"]):
+        model_host.get_model_service("medcat_umls")
+    assert loaded == ["medcat_snomed", "medcat_umls", "medcat_deid", "medcat_umls"]
+    assert _get_residency(model_host)["medcat_deid"] is False
+
+
+def test_never_evict_without_budget():
+    model_host, _, rss = _get_model_host()
+    with patch("management.model_host.get_rss_bytes", side_effect=lambda: rss["value"]):
+        for model_type in model_host.model_types:
+            model_host.get_model_service(model_type)
+
+    assert all(_get_residency(model_host).values())
+
+
+def test_load_once_under_concurrency():
+    model_host, loaded, _ = _get_model_host()
+    threads = [threading.Thread(target=model_host.get_model_service, args=("medcat_snomed",)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert loaded == ["medcat_snomed"]
+
+
+def test_get_unregistered_model_service():
+    model_host, _, _ = _get_model_host()
+
+    with pytest.raises(KeyError):
+        model_host.get_model_service("transformers_deid")
+
+
+def test_close():
+    model_host, _, _ = _get_model_host()
+    model_service = model_host.get_model_service("medcat_snomed")
+
+    with patch("management.model_host.close_micro_batcher") as close_micro_batcher:
+        model_host.close()
+
+    close_micro_batcher.assert_called_once_with(model_service)
+    model_service.close.assert_called_once()
+    assert not any(_get_residency(model_host).values())
+
+
+def test_close_evicted_model_service_after_last_lease_released():
+    model_host, _, rss = _get_model_host(memory_budget_bytes=150)
+    with patch("management.model_host.get_rss_bytes", side_effect=lambda: rss["value"]):
+        snomed_service = model_host.get_model_service("medcat_snomed", lease=True)
+        model_host.get_model_service("medcat_snomed", lease=True)
+        model_host.get_model_service("medcat_umls")
+
+    assert _get_residency(model_host)["medcat_snomed"] is False
+    model_host.release(snomed_service)
+    snomed_service.close.assert_not_called()
+    model_host.release(snomed_service)
+    snomed_service.close.assert_called_once()
+
+
+def test_close_evicted_model_service_after_training_finished():
+    model_host, _, rss = _get_model_host(memory_budget_bytes=150)
+    with patch("management.model_host.get_rss_bytes", side_effect=lambda: rss["value"]):
+        snomed_service = model_host.get_model_service("medcat_snomed")
+        snomed_service.training_in_progress = True
+        model_host.get_model_service("medcat_umls")
+        snomed_service.close.assert_not_called()
+
+        snomed_service.training_in_progress = False
+        model_host.get_model_service("medcat_umls")
+
+    for _ in range(50):
+        if snomed_service.close.called:
+            break
+        time.sleep(0.1)
+    snomed_service.close.assert_called_once()
@@ -0,0 +1,98 @@
+import os
+import shutil
+import numpy as np
+import pytest
+from unittest.mock import patch
+from medcat.cdb import CDB
+from medcat.config import Config
+from medcat.vocab import Vocab
+from management.model_pack_cache import ModelPackCache, load_snapshot, save_snapshot
+from utils import get_file_sha256
+
+
+@pytest.fixture(scope="function")
+def cdb():
+    cdb = CDB(config=Config())
+    cdb.add_names("C0000001", {"chest~pain": {"tokens": ["chest", "pain"], "snames": ["chest", "chest~pain"], "raw_name": "chest pain", "is_upper": False}})
+    cdb.cui2context_vectors["C0000001"] = {"long": np.arange(300, dtype=np.float32)}
+    return cdb
+
+
+@pytest.fixture(scope="function")
+def model_file_path(cdb, tmp_path):
+    vocab = Vocab()
+    vocab.add_word("chest", 10, np.arange(300, dtype=np.float32))
+    model_pack_dir = os.path.join(tmp_path, "model")
+    os.makedirs(model_pack_dir)
+    cdb.save(os.path.join(model_pack_dir, "cdb.dat"))
+    vocab.save(os.path.join(model_pack_dir, "vocab.dat"))
+    return shutil.make_archive(model_pack_dir, "zip", model_pack_dir)
+
+
+def test_save_and_load_snapshot(cdb, tmp_path):
+    snapshot_path = os.path.join(tmp_path, "cdb.snapshot")
+
+    save_snapshot(cdb, snapshot_path)
+    loaded = load_snapshot(snapshot_path)
+
+    assert loaded.cui2names == {"C0000001": {"chest~pain"}}
+    assert np.array_equal(loaded.cui2context_vectors["C0000001"]["long"], np.arange(300, dtype=np.float32))
+    loaded.cui2context_vectors["C0000001"]["long"][0] = -1
+    assert load_snapshot(snapshot_path).cui2context_vectors["C0000001"]["long"][0] == 0
+
+
+def test_load_snapshot_of_wrong_format(tmp_path):
+    snapshot_path = os.path.join(tmp_path, "cdb.snapshot")
+    with open(snapshot_path, "wb") as f:
+        f.write(b"not a snapshot")
+
+    with pytest.raises(ValueError):
+        load_snapshot(snapshot_path)
+
+
+def test_get_unpacked_path(model_file_path, tmp_path):
+    cache = ModelPackCache(os.path.join(tmp_path, "cache"))
+
+    unpacked_path = cache.get_unpacked_path(model_file_path)
+
+    assert unpacked_path == os.path.join(tmp_path, "cache", get_file_sha256(model_file_path))
+    assert sorted(os.listdir(unpacked_path)) == ["cdb.dat", "vocab.dat"]
+    with patch("management.model_pack_cache.shutil.unpack_archive") as unpack_archive:
+        assert cache.get_unpacked_path(model_file_path) == unpacked_path
+    unpack_archive.assert_not_called()
+
+
+def test_get_unpacked_path_rehashes_only_changed_model_pack(model_file_path, tmp_path):
+    cache = ModelPackCache(os.path.join(tmp_path, "cache"))
+    unpacked_path = cache.get_unpacked_path(model_file_path)
+
+    with patch("utils.get_file_sha256") as get_sha256:
+        assert cache.get_unpacked_path(model_file_path) == unpacked_path
+    get_sha256.assert_not_called()
+
+    with open(model_file_path, "ab") as f:
+        f.write(b"\0")
+    assert cache.get_unpacked_path(model_file_path) == os.path.join(tmp_path, "cache", get_file_sha256(model_file_path))
+
+
+def test_load_model_pack_from_snapshots(model_file_path, tmp_path):
+    cache = ModelPackCache(os.path.join(tmp_path, "cache"))
+
+    with patch("management.model_pack_cache.CAT") as cat:
+        cache.load_model_pack(model_file_path)
+    unpacked_path = cache.get_unpacked_path(model_file_path)
+    assert len([file_name for file_name in os.listdir(unpacked_path) if file_name.endswith(".snapshot")]) == 2
+
+    with patch("management.model_pack_cache.CAT") as cat, \
+         patch("management.model_pack_cache.CDB.load") as cdb_load, \
+         patch("management.model_pack_cache.Vocab.load") as vocab_load:
+        cache.load_model_pack(model_file_path)
+
+    cdb_load.assert_not_called()
+    vocab_load.assert_not_called()
+    kwargs = cat.call_args[1]
+    assert kwargs["cdb"].cui2names == {"C0000001": {"chest~pain"}}
+    assert kwargs["cdb"].config.general.spacy_model.startswith(unpacked_path)
+    assert "chest" in kwargs["vocab"].vocab
+    assert kwargs["meta_cats"] == []
+    assert kwargs["addl_ner"] == []
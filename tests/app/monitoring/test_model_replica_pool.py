@@ -0,0 +1,119 @@
+import gc
+import os
+import time
+import pytest
+from typing import Any, Dict, List
+from model_services.base import AbstractModelService
+from management.model_replica_pool import ModelReplicaPool
+from config import Settings
+
+
+class _ModelService(AbstractModelService):
+
+    def __init__(self, config: Settings) -> None:
+        super().__init__(config)
+        self.model = "model_1"
+
+    @staticmethod
+    def load_model(model_file_path: str, *args: Any, **kwargs: Any) -> Any:
+        return None
+
+    def info(self) -> Any:
+        return None
+
+    def init_model(self) -> None:
+        pass
+
+    def annotate(self, text: str) -> List[Dict[str, Any]]:
+        if text == "exit":
+            os._exit(1)
+        if text == "hang":
+            time.sleep(60)
+        if text == "error":
+            raise ValueError("failed")
+        return [{"text": text, "model": self.model, "pid": os.getpid()}]
+
+    def batch_annotate(self, texts: List[str]) -> List[List[Dict[str, Any]]]:
+        return [self.annotate(text) for text in texts]
+
+
+@pytest.fixture(scope="function")
+def model_replica_pool():
+    model_replica_pool = ModelReplicaPool(_ModelService(Settings()), 2, health_check_interval=0.1)
+    yield model_replica_pool
+    model_replica_pool.close()
+
+
+def test_annotate_in_worker(model_replica_pool):
+    annotations = model_replica_pool.annotate("text")
+
+    assert annotations[0]["text"] == "text"
+    assert annotations[0]["pid"] != os.getpid()
+
+
+def test_batch_annotate_in_order(model_replica_pool):
+    texts = [f"text_{i}" for i in range(7)]
+
+    annotations_list = model_replica_pool.batch_annotate(texts)
+
+    assert [annotations[0]["text"] for annotations in annotations_list] == texts
+
+
+def test_warm_up_every_worker(model_replica_pool):
+    timings = model_replica_pool.warm_up(["text_1", "text_2"])
+
+    assert sorted(timings.keys()) == ["annotate", "batch_annotate"]
+    assert all(duration >= 0 for duration in timings.values())
+    assert model_replica_pool._idle.qsize() == 2
+
+
+def test_propagate_exception(model_replica_pool):
+    with pytest.raises(ValueError, match="failed"):
+        model_replica_pool.annotate("error")
+    assert model_replica_pool.annotate("text")[0]["text"] == "text"
+
+
+def test_restart_crashed_worker(model_replica_pool):
+    with pytest.raises(RuntimeError, match="exited unexpectedly"):
+        model_replica_pool.annotate("exit")
+
+    assert model_replica_pool.annotate("text")[0]["text"] == "text"
+    assert model_replica_pool.batch_annotate(["text_1", "text_2"])[1][0]["text"] == "text_2"
+
+
+def test_restart_hung_worker():
+    model_replica_pool = ModelReplicaPool(_ModelService(Settings()), 2, health_check_interval=0.1, call_timeout=0.5)
+    try:
+        with pytest.raises(TimeoutError):
+            model_replica_pool.annotate("hang")
+        with pytest.raises(TimeoutError):
+            model_replica_pool.batch_annotate(["text", "hang"])
+
+        assert model_replica_pool.annotate("text")[0]["text"] == "text"
+        for _ in range(50):
+            if len(model_replica_pool._workers) == 2:
+                break
+            time.sleep(0.1)
+        assert len(model_replica_pool._workers) == 2
+    finally:
+        model_replica_pool.close()
+
+
+def test_refork_on_model_change(model_replica_pool):
+    pid = model_replica_pool.annotate("text")[0]["pid"]
+
+    model_replica_pool.model_service.model = "model_2"
+    annotations = model_replica_pool.annotate("text")
+
+    assert annotations[0]["model"] == "model_2"
+    assert annotations[0]["pid"] != pid
+    assert model_replica_pool._generation == 1
+    assert gc.get_freeze_count() > 0
+
+
+def test_delegate_to_model_service(model_replica_pool):
+    model_replica_pool.model_name = "model_name"
+
+    assert model_replica_pool.model_name == "model_name"
+    assert model_replica_pool.model_service.model_name == "model_name"
+    assert model_replica_pool.service_config is model_replica_pool.model_service.service_config
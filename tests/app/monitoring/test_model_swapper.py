@@ -0,0 +1,90 @@
+import threading
+import time
+import pytest
+from unittest.mock import Mock
+from management.model_swapper import ModelSwapper
+
+
+class _ModelService(object):
+
+    def __init__(self, swapper, model):
+        self._swapper = swapper
+        self._model = model
+
+    @property
+    def model(self):
+        return self._swapper.get_model(self._model)
+
+    @model.setter
+    def model(self, model):
+        self._model = model
+
+
+def test_swap_without_in_flight_calls():
+    swapper = ModelSwapper()
+    model_service = _ModelService(swapper, "old model")
+    warm_up_service = Mock()
+    warm_up_service.warm_up.return_value = {"annotate": 0.1, "batch_annotate": 0.2}
+
+    swap_stats = swapper.swap(model_service, "new model", warm_up_service, ["text"])
+
+    assert model_service.model == "new model"
+    warm_up_service.warm_up.assert_called_once_with(["text"])
+    assert swap_stats["model_warm_up_duration_seconds"] == pytest.approx(0.3)
+    assert swap_stats["model_swap_duration_seconds"] >= 0
+    assert swapper._retired == {}
+
+
+def test_in_flight_call_finishes_on_previous_model():
+    swapper = ModelSwapper()
+    old_model = Mock()
+    new_model = Mock()
+    model_service = _ModelService(swapper, old_model)
+    leased = threading.Event()
+    swapped = threading.Event()
+    seen_models = []
+
+    def in_flight_call():
+        with swapper.lease(model_service):
+            seen_models.append(model_service.model)
+            leased.set()
+            swapped.wait(5)
+            with swapper.lease(model_service):
+                seen_models.append(model_service.model)
+
+    thread = threading.Thread(target=in_flight_call)
+    thread.start()
+    leased.wait(5)
+    swap_thread = threading.Thread(target=swapper.swap, args=(model_service, new_model, Mock(warm_up=Mock(return_value={})), ["text"]))
+    swap_thread.start()
+    for _ in range(50):
+        if model_service._model is new_model:
+            break
+        time.sleep(0.1)
+
+    assert model_service.model is new_model
+    assert swapper._retired == {id(old_model): old_model}
+    assert swap_thread.is_alive()
+    swapped.set()
+    thread.join(5)
+    swap_thread.join(5)
+
+    assert not swap_thread.is_alive()
+    assert seen_models == [old_model, old_model]
+    assert swapper._retired == {}
+    assert swapper._refs == {}
+    with swapper.lease(model_service):
+        assert model_service.model is new_model
+
+
+def test_swap_returns_after_release_timeout():
+    swapper = ModelSwapper(release_timeout=0.1)
+    old_model = Mock()
+    model_service = _ModelService(swapper, old_model)
+
+    with swapper.lease(model_service):
+        swapper.swap(model_service, Mock(), Mock(warm_up=Mock(return_value={})), ["text"])
+        assert swapper._retired == {id(old_model): old_model}
+
+    assert swapper._retired == {}
+    assert swapper._refs == {}
@@ -0,0 +1,131 @@
+import os
+import sys
+import pytest
+import torch
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
+from transformers import BertConfig, BertForTokenClassification, BertTokenizerFast
+from config import Settings
+from management.onnx_runtime import (
+    OnnxTokenClassificationModel,
+    get_onnx_model,
+    get_onnx_model_path,
+    has_prediction_parity,
+    is_onnx_runtime_applicable,
+)
+
+
+class _StubSession(object):
+
+    def __init__(self, model, logits_offset=None):
+        self._model = model
+        self._logits_offset = logits_offset
+        self.feeds = None
+
+    def get_inputs(self):
+        return [SimpleNamespace(name="input_ids"), SimpleNamespace(name="attention_mask")]
+
+    def run(self, output_names, feeds):
+        self.feeds = feeds
+        logits = self._model(input_ids=torch.from_numpy(feeds["input_ids"]), attention_mask=torch.from_numpy(feeds["attention_mask"])).logits.detach()
+        if self._logits_offset is not None:
+            logits = logits + self._logits_offset
+        return [logits.numpy()]
+
+
+@pytest.fixture(scope="function")
+def tokenizer(tmp_path):
+    vocab_path = os.path.join(tmp_path, "vocab.txt")
+    with open(vocab_path, "w") as f:
+        f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "john", "smith", "london", "nw1", "2da", "."]))
+    return BertTokenizerFast(vocab_path)
+
+
+@pytest.fixture(scope="function")
+def model(tokenizer):
+    torch.manual_seed(0)
+    model_config = BertConfig(vocab_size=len(tokenizer), hidden_size=16, num_hidden_layers=1, num_attention_heads=2, intermediate_size=32, num_labels=3)
+    return BertForTokenClassification(model_config).eval()
+
+
+def test_onnx_model_call(model, tokenizer):
+    session = _StubSession(model)
+    onnx_model = OnnxTokenClassificationModel(session, model)
+    inputs = tokenizer("john smith", return_tensors="pt")
+
+    output = onnx_model(**inputs)
+
+    assert sorted(session.feeds.keys()) == ["attention_mask", "input_ids"]
+    assert output["logits"].shape == (1, 4, 3)
+    assert onnx_model.config is model.config
+    assert onnx_model.model is model
+
+
+def test_has_prediction_parity(model, tokenizer):
+    session = _StubSession(model)
+    diverged_session = _StubSession(model, logits_offset=torch.tensor([0.0, 0.0, 1000.0]))
+    onnx_model = OnnxTokenClassificationModel(session, model)
+    diverged_onnx_model = OnnxTokenClassificationModel(diverged_session, model)
+
+    assert has_prediction_parity(model, onnx_model, tokenizer)
+    assert not has_prediction_parity(model, diverged_onnx_model, tokenizer)
+
+
+def test_get_onnx_model_path(tmp_path):
+    model_file_path = os.path.join(tmp_path, "model.zip")
+    with open(model_file_path, "wb") as f:
+        f.write(b"content")
+
+    assert get_onnx_model_path(model_file_path, "deid_0") == os.path.join(tmp_path, "model.ed7002b439e9ac84.deid_0.onnx")
+    with patch("utils.get_file_sha256") as get_sha256:
+        assert get_onnx_model_path(model_file_path, "deid_0") == os.path.join(tmp_path, "model.ed7002b439e9ac84.deid_0.onnx")
+    get_sha256.assert_not_called()
+
+
+def test_is_onnx_runtime_applicable():
+    config = Settings()
+    config.ENABLE_ONNX_RUNTIME = "true"
+    config.DEVICE = "cpu"
+    assert is_onnx_runtime_applicable(config)
+    config.DEVICE = "cuda:0"
+    assert not is_onnx_runtime_applicable(config)
+    config.ENABLE_ONNX_RUNTIME = "false"
+    config.DEVICE = "cpu"
+    assert not is_onnx_runtime_applicable(config)
+
+
+def test_get_onnx_model_without_onnx_runtime(model, tokenizer, tmp_path):
+    with patch.dict(sys.modules, {"onnxruntime": None}):
+        assert get_onnx_model(model, tokenizer, os.path.join(tmp_path, "model.zip"), "deid_0", Settings()) is None
+
+
+def test_get_onnx_model_with_prediction_parity(model, tokenizer, tmp_path):
+    pytest.importorskip("onnx")
+    pytest.importorskip("onnxruntime")
+    model_file_path = os.path.join(tmp_path, "model.zip")
+    with open(model_file_path, "wb") as f:
+        f.write(b"content")
+
+    onnx_model = get_onnx_model(model, tokenizer, model_file_path, "deid_0", Settings())
+
+    assert onnx_model is not None
+    assert os.path.exists(get_onnx_model_path(model_file_path, "deid_0"))
+    assert has_prediction_parity(model, onnx_model, tokenizer, "john smith london nw1 2da .")
+
+
+def test_get_onnx_model_overwrites_previous_export(model, tokenizer, tmp_path):
+    model_file_path = os.path.join(tmp_path, "model.zip")
+    with open(model_file_path, "wb") as f:
+        f.write(b"content")
+    onnx_model_path = get_onnx_model_path(model_file_path, "deid_0_retrained")
+    with open(onnx_model_path, "wb") as f:
+        f.write(b"previous export")
+
+    with patch.dict(sys.modules, {"onnxruntime": Mock()}), \
+         patch("management.onnx_runtime.export_token_classification_model") as export, \
+         patch("management.onnx_runtime.OnnxTokenClassificationModel"), \
+         patch("management.onnx_runtime.has_prediction_parity", return_value=True):
+        assert get_onnx_model(model, tokenizer, model_file_path, "deid_0_retrained", Settings()) is not None
+        export.assert_not_called()
+        assert get_onnx_model(model, tokenizer, model_file_path, "deid_0_retrained", Settings(), overwrite=True) is not None
+        export.assert_called_once_with(model, tokenizer, onnx_model_path)
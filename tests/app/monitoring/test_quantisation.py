@@ -0,0 +1,84 @@
+import pytest
+import torch
+from types import SimpleNamespace
+from unittest.mock import patch
+from prometheus_client import REGISTRY
+from config import Settings
+from management.quantisation import apply_dynamic_quantisation, get_module_size, is_quantisation_applicable
+from tests.app.helper import get_model_service
+
+
+@pytest.fixture(scope="function")
+def network():
+    torch.manual_seed(0)
+    return torch.nn.Sequential(torch.nn.Linear(256, 256), torch.nn.ReLU(), torch.nn.Linear(256, 2))
+
+
+@pytest.fixture(scope="function")
+def model_service(network):
+    model_service = get_model_service(pipe=SimpleNamespace(model=network), meta_cat=SimpleNamespace(model=network))
+    model_service.annotate.side_effect = lambda text: model_service.pipe.model(torch.ones(1, 256))
+    return model_service
+
+
+def test_is_quantisation_applicable():
+    config = Settings()
+    config.ENABLE_DYNAMIC_QUANTISATION = "true"
+    config.DEVICE = "cpu"
+    assert is_quantisation_applicable(config)
+    config.DEVICE = "mps"
+    assert not is_quantisation_applicable(config)
+    config.ENABLE_DYNAMIC_QUANTISATION = "false"
+    config.DEVICE = "default"
+    assert not is_quantisation_applicable(config)
+
+
+def test_apply_dynamic_quantisation(model_service, network):
+    report = apply_dynamic_quantisation(model_service, [(model_service.pipe, "model"), (model_service.meta_cat, "model")], Settings(), latency_check_repeats=1)
+
+    assert model_service.pipe.model is not network
+    assert model_service.pipe.model is model_service.meta_cat.model
+    assert isinstance(model_service.pipe.model[0], torch.ao.nn.quantized.dynamic.Linear)
+    assert report["size_after_mb"] < report["size_before_mb"]
+    assert report["latency_before_ms"] >= 0
+    assert report["latency_after_ms"] >= 0
+    assert "f1_before" not in report
+    assert get_module_size(model_service.pipe.model) < get_module_size(network)
+    assert REGISTRY.get_sample_value("cms_model_quantisation", {"model": "test model", "measure": "size_after_mb"}) == report["size_after_mb"]
+    assert REGISTRY.get_sample_value("cms_model_quantisation", {"model": "test model", "measure": "applied"}) == 1.0
+
+
+def test_apply_dynamic_quantisation_within_tolerance(model_service, network):
+    config = Settings()
+    config.QUANTISATION_SANITY_CHECK_EXPORT = "trainer_export.json"
+    config.QUANTISATION_MAX_F1_DROP = 0.05
+
+    with patch("management.quantisation.sanity_check_model_with_trainer_export", side_effect=[(0.9, 0.9, 0.9, {}), (0.9, 0.9, 0.88, {})]) as sanity_check:
+        report = apply_dynamic_quantisation(model_service, [(model_service.pipe, "model")], config, latency_check_repeats=1)
+
+    assert sanity_check.call_count == 2
+    assert sanity_check.call_args[0] == ("trainer_export.json", model_service)
+    assert report["f1_before"] == 0.9
+    assert report["f1_after"] == 0.88
+    assert model_service.pipe.model is not network
+
+
+def test_apply_dynamic_quantisation_beyond_tolerance(model_service, network):
+    config = Settings()
+    config.QUANTISATION_SANITY_CHECK_EXPORT = "trainer_export.json"
+    config.QUANTISATION_MAX_F1_DROP = 0.01
+
+    with patch("management.quantisation.sanity_check_model_with_trainer_export", side_effect=[(0.9, 0.9, 0.9, {}), (0.8, 0.8, 0.8, {})]):
+        report = apply_dynamic_quantisation(model_service, [(model_service.pipe, "model")], config, latency_check_repeats=1)
+
+    assert report is None
+    assert model_service.pipe.model is network
+    assert REGISTRY.get_sample_value("cms_model_quantisation", {"model": "test model", "measure": "f1_after"}) == 0.8
+    assert REGISTRY.get_sample_value("cms_model_quantisation", {"model": "test model", "measure": "applied"}) == 0.0
+
+
+def test_apply_dynamic_quantisation_without_networks():
+    model_service = get_model_service(pipe=SimpleNamespace(model="not a network"))
+
+    assert apply_dynamic_quantisation(model_service, [(model_service.pipe, "model")], Settings()) is None
+    model_service.annotate.assert_not_called()
@@ -0,0 +1,86 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from management.stage_timings import (
+    STAGE_QUEUEING,
+    StageTimings,
+    bind_stage_timings,
+    get_stage_timings,
+    reset_stage_timings,
+    set_stage_timings,
+    timed_stage,
+)
+
+
+def test_timed_stage_without_timings():
+    assert get_stage_timings() is None
+    with timed_stage("ner_linking"):
+        pass
+    assert get_stage_timings() is None
+
+
+def test_nested_stages_are_timed_exclusively():
+    timings = StageTimings()
+    token = set_stage_timings(timings)
+    try:
+        with timed_stage("ner_linking"):
+            time.sleep(0.02)
+            with timed_stage("meta_cat"):
+                time.sleep(0.05)
+            time.sleep(0.02)
+        with timed_stage("ner_linking"):
+            time.sleep(0.01)
+    finally:
+        reset_stage_timings(token)
+
+    durations = timings.durations
+    assert set(durations.keys()) == {"ner_linking", "meta_cat"}
+    assert 0.05 <= durations["meta_cat"] < 0.09
+    assert 0.05 <= durations["ner_linking"] < 0.09
+
+
+def test_stages_from_different_threads():
+    timings = StageTimings()
+    barrier = threading.Barrier(2)
+
+    def run():
+        token = set_stage_timings(timings)
+        with timed_stage("ner_linking"):
+            barrier.wait(5)
+            time.sleep(0.01)
+        reset_stage_timings(token)
+
+    threads = [threading.Thread(target=run) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert timings.durations["ner_linking"] >= 0.02
+
+
+def test_bind_stage_timings():
+    timings = StageTimings()
+    token = set_stage_timings(timings)
+    try:
+        func = bind_stage_timings(lambda text: get_stage_timings() is timings and text)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            assert executor.submit(func, "text").result() == "text"
+    finally:
+        reset_stage_timings(token)
+
+    assert STAGE_QUEUEING in timings.durations
+
+
+def test_bind_stage_timings_without_timings():
+    func = lambda text: text  # noqa: E731
+    assert bind_stage_timings(func) is func
+
+
+def test_to_server_timing():
+    timings = StageTimings()
+    timings.add("ner_linking", 0.0123)
+    timings.add("serialisation", 0.001)
+
+    assert timings.to_server_timing() == "ner_linking;dur=12.300, serialisation;dur=1.000"
+    assert timings.to_server_timing(0.02) == "ner_linking;dur=12.300, serialisation;dur=1.000, total;dur=20.000"
@@ -211,6 +211,23 @@ def test_save_pretrained_model(mlflow_fixture):
     model_manager.log_model.assert_called_once_with("model_name", "model_path", "model_name")
 
 
+def test_save_benchmark_results(mlflow_fixture):
+    tracker_client = TrackerClient("")
+
+    run_id = tracker_client.save_benchmark_results("model name",
+                                                   "run_name",
+                                                   {"concurrency": 2},
+                                                   {"annotate": {"docs_per_second": 10.0}, "batch_annotate": {"docs_per_second": 20.0}})
+
+    assert run_id == "run_id"
+    mlflow.get_experiment_by_name.assert_called_once_with("model_name_benchmark")
+    mlflow.start_run.assert_called_once_with(experiment_id="experiment_id")
+    mlflow.log_params.assert_called_once_with({"concurrency": 2})
+    mlflow.log_metrics.assert_has_calls([call({"annotate_docs_per_second": 10.0}, 0), call({"batch_annotate_docs_per_second": 20.0}, 0)])
+    assert mlflow.set_tags.call_args.args[0]["mlflow.runName"] == "run_name"
+    mlflow.end_run.assert_called_once_with("FINISHED")
+
+
 def test_log_single_exception(mlflow_fixture):
     tracker_client = TrackerClient("")
 
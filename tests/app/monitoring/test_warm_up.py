@@ -0,0 +1,43 @@
+from unittest.mock import Mock
+from management.warm_up import DEFAULT_WARM_UP_TEXTS, Readiness, get_readiness, get_warm_up_texts, start_warm_up
+
+
+def test_get_warm_up_texts(tmp_path):
+    texts_file = tmp_path / "texts.txt"
+    texts_file.write_text("first text\n\n  second text  \n")
+
+    assert get_warm_up_texts("") == DEFAULT_WARM_UP_TEXTS
+    assert get_warm_up_texts(str(texts_file)) == ["first text", "second text"]
+
+
+def test_default_warm_up_texts_include_long_text():
+    assert max(len(text.split()) for text in DEFAULT_WARM_UP_TEXTS) > 500
+
+
+def test_readiness():
+    readiness = Readiness()
+    assert readiness.ready
+    readiness.set_warming_up()
+    assert not readiness.ready
+    readiness.set_warmed_up()
+    assert readiness.ready
+
+
+def test_start_warm_up():
+    model_service = Mock()
+    model_service.warm_up.return_value = {"annotate": 0.1, "batch_annotate": 0.2}
+
+    start_warm_up(model_service, ["text"]).join(5)
+
+    model_service.warm_up.assert_called_once_with(["text"])
+    model_service.info.assert_called_once()
+    assert get_readiness().ready
+
+
+def test_start_warm_up_with_failure():
+    model_service = Mock()
+    model_service.warm_up.side_effect = RuntimeError("failed")
+
+    start_warm_up(model_service, ["text"]).join(5)
+
+    assert get_readiness().ready
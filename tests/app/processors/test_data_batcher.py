@@ -1,4 +1,7 @@
-from processors.data_batcher import mini_batch
+import asyncio
+import time
+import pytest
+from processors.data_batcher import mini_batch, get_lines_from_byte_stream, process_in_batches
 
 
 def test_mini_batch():
@@ -16,3 +19,83 @@ def test_non_positive_batch_size():
     batches2 = mini_batch(data, -1)
     assert next(batches1) == data
     assert next(batches2) == data
+
+
+@pytest.mark.asyncio
+async def test_get_lines_from_byte_stream():
+    async def byte_stream():
+        for chunk in [b'{"text": "a"}\n{"te', b'xt": "b"}', b"", b"\n\n", b'{"text": "c"}']:
+            yield chunk
+
+    lines = [line async for line in get_lines_from_byte_stream(byte_stream())]
+
+    assert lines == [b'{"text": "a"}', b'{"text": "b"}', b"", b'{"text": "c"}']
+
+
+@pytest.mark.asyncio
+async def test_process_in_batches():
+    async def data():
+        for item in ["a", "bb", "ccc", "dddd", "eeeee"]:
+            yield item
+            await asyncio.sleep(0)
+
+    batches = []
+
+    def process(batch):
+        batches.append(list(batch))
+        return [item.upper() for item in batch]
+
+    results = [result async for result in process_in_batches(data(), process, len, max_docs=2, max_chars=100)]
+
+    assert results == [("a", "A"), ("bb", "BB"), ("ccc", "CCC"), ("dddd", "DDDD"), ("eeeee", "EEEEE")]
+    assert all(len(batch) <= 2 for batch in batches)
+    assert [item for batch in batches for item in batch] == ["a", "bb", "ccc", "dddd", "eeeee"]
+
+
+@pytest.mark.asyncio
+async def test_process_in_batches_propagates_exception():
+    async def data():
+        yield "a"
+        raise ValueError("failed")
+
+    with pytest.raises(ValueError, match="failed"):
+        _ = [result async for result in process_in_batches(data(), lambda batch: batch, len, max_docs=2, max_chars=100)]
+
+
+@pytest.mark.asyncio
+async def test_process_in_batches_fills_batches_from_fast_data():
+    async def data():
+        for item in range(10):
+            yield str(item)
+            await asyncio.sleep(0)
+
+    batches = []
+
+    def process(batch):
+        time.sleep(0.05)
+        batches.append(list(batch))
+        return batch
+
+    results = [result async for result in process_in_batches(data(), process, len, max_docs=4, max_chars=100, max_wait_ms=100)]
+
+    assert [item for item, _ in results] == [str(item) for item in range(10)]
+    assert sorted(len(batch) for batch in batches) == [2, 4, 4]
+
+
+@pytest.mark.asyncio
+async def test_process_in_batches_flushes_partial_batch_after_max_wait():
+    loop = asyncio.get_running_loop()
+    processed = asyncio.Event()
+
+    async def data():
+        yield "a"
+        await asyncio.wait_for(processed.wait(), 5)
+        yield "b"
+
+    def process(batch):
+        loop.call_soon_threadsafe(processed.set)
+        return batch
+
+    results = [result async for result in process_in_batches(data(), process, len, max_docs=4, max_chars=100, max_wait_ms=10)]
+
+    assert results == [("a", "a"), ("b", "b")]
@@ -3,6 +3,7 @@ import json
 import tempfile
 import torch
 from safetensors.torch import save_file
+from unittest.mock import patch, mock_open
 
 from urllib.parse import urlparse
 from utils import (
@@ -19,6 +20,9 @@ from utils import (
     breakdown_annotations,
     augment_annotations,
     safetensors_to_pytorch,
+    get_cpu_count,
+    get_file_sha256,
+    get_cached_file_sha256,
 )
 
 
@@ -220,3 +224,31 @@ class _DummyModel(torch.nn.Module):
 
     def forward(self, x):
         return self.linear(x)
+
+
+def test_get_cpu_count_with_cgroup_v2_quota():
+    with patch("builtins.open", mock_open(read_data="150000 100000\n")):
+        assert get_cpu_count() == min(2, len(os.sched_getaffinity(0)))
+
+
+def test_get_cpu_count_without_cgroup_quota():
+    with patch("builtins.open", side_effect=OSError()):
+        assert get_cpu_count() == len(os.sched_getaffinity(0))
+
+
+def test_get_file_sha256():
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(b"content")
+        f.flush()
+        assert get_file_sha256(f.name, chunk_size=3) == "ed7002b439e9ac845f22357d822bac1444730fbdb6016d3ec9432297b9ec9f73"
+
+
+def test_get_cached_file_sha256(tmp_path):
+    file_path = os.path.join(tmp_path, "model.zip")
+    with open(file_path, "wb") as f:
+        f.write(b"content")
+
+    assert get_cached_file_sha256(file_path, tmp_path) == "ed7002b439e9ac845f22357d822bac1444730fbdb6016d3ec9432297b9ec9f73"
+    with patch("utils.get_file_sha256") as get_sha256:
+        assert get_cached_file_sha256(file_path, tmp_path) == "ed7002b439e9ac845f22357d822bac1444730fbdb6016d3ec9432297b9ec9f73"
+    get_sha256.assert_not_called()
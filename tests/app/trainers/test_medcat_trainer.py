@@ -51,9 +51,17 @@ def test_get_flattened_config():
 
 def test_deploy_model():
     model = Mock()
-    supervised_trainer.deploy_model(model_service, model, True)
+    model_service.swap_model.return_value = {"model_swap_duration_seconds": 1.0}
+    swap_stats = supervised_trainer.deploy_model(model_service, model, True)
     model._versioning.assert_called_once()
-    assert model_service.model == model
+    model_service.swap_model.assert_called_with(model)
+    assert swap_stats == {"model_swap_duration_seconds": 1.0}
+
+
+def test_deploy_model_invalidates_annotation_cache():
+    with patch("trainers.medcat_trainer.get_annotation_cache") as get_annotation_cache:
+        supervised_trainer.deploy_model(model_service, Mock(), True)
+    get_annotation_cache.return_value.invalidate.assert_called_once_with(model_service)
 
 
 def test_save_model_pack():
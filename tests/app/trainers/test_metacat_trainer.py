@@ -49,9 +49,11 @@ def test_get_flattened_config():
 
 def test_deploy_model():
     model = Mock()
-    metacat_trainer.deploy_model(model_service, model, True)
+    model_service.swap_model.return_value = {"model_swap_duration_seconds": 1.0}
+    swap_stats = metacat_trainer.deploy_model(model_service, model, True)
     model._versioning.assert_called_once()
-    assert model_service.model == model
+    model_service.swap_model.assert_called_with(model)
+    assert swap_stats == {"model_swap_duration_seconds": 1.0}
 
 
 def test_save_model_pack():